@@ -0,0 +1,284 @@
+import asyncio
+import re
+import ssl as ssl_lib
+from time import time
+
+from imapclient import exceptions
+from imapclient.datetime_util import datetime_to_INTERNALDATE
+from imapclient.imap_utf7 import encode as encode_utf7, decode as decode_utf7
+from imapclient.response_parser import parse_response, parse_fetch_response
+
+#: the same patterns imaplib uses to split untagged responses into their type and data
+UNTAGGED_RESPONSE = re.compile(rb'\* (?P<type>[A-Z-]+)( (?P<data>.*))?')
+UNTAGGED_STATUS = re.compile(rb'\*[ ]+(?P<data>\d+) (?P<type>[A-Z-]+)( (?P<data2>.*))?')
+LITERAL = re.compile(rb'.*{(?P<size>\d+)}$')
+RESPONSE_CODE = re.compile(rb'\[(?P<code>[A-Z-]+)( (?P<value>[^\]]*))?\]')
+
+
+class Literal(bytes):
+    """
+    a command argument that is always sent as a literal (like the mail of an APPEND)
+    """
+
+
+def quote(value):
+    """
+    returns value as quoted string or as Literal if it contains characters which can't be quoted
+    """
+    if isinstance(value, str):
+        value = value.encode()
+    if any(byte > 127 or byte in b'\r\n\0' for byte in value):
+        return Literal(value)
+    return b'"' + value.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+class AsyncIMAPClient:
+    def __init__(self, host, port, ssl=True, ssl_context=None, timeout=300, keepalive=600):
+        """
+        a minimal IMAP client for asyncio with the methods pymap-copy needs. the responses are parsed like
+        IMAPClient does, so they look the same (like the dict of fetch()).
+
+        commands of a connection are sent one after another. if no command was sent for keepalive seconds, a NOOP
+        is sent, so the server does not close the connection while it waits (like the destination while the next
+        buffer is fetched from the source). every response must arrive within timeout seconds.
+        """
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.capabilities = ()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.observe = None  #: called with the name and the duration of each command (like for metrics)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._tag = 0
+        self._last_command = time()
+        self._keepalive_task = None
+        self._logout = False  #: the BYE of a LOGOUT is expected
+
+    async def connect(self, starttls=False):
+        """
+        open the connection, read the greeting and upgrade it with STARTTLS if starttls is True
+        """
+        context = self.ssl_context or ssl_lib.create_default_context()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context if self.ssl else None,
+                                    limit=1048576), self.timeout)
+
+        greeting = await self._read_line()
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            raise exceptions.IMAPClientError(f'unexpected greeting: {greeting.decode(errors="replace")}')
+
+        if starttls:
+            if not hasattr(self._writer, 'start_tls'):
+                raise exceptions.IMAPClientError('STARTTLS requires Python 3.11 or newer in the async engine')
+            await self._command(b'STARTTLS')
+            await self._writer.start_tls(context, server_hostname=self.host)
+
+        await self.capability()
+        self._keepalive_task = asyncio.ensure_future(self._keep_alive())
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(max(1, self.keepalive - (time() - self._last_command)))
+            if time() - self._last_command >= self.keepalive and not self._lock.locked():
+                try:
+                    await self.noop()
+                except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError):
+                    return
+
+    async def _read_line(self):
+        try:
+            line = await asyncio.wait_for(self._reader.readuntil(b'\r\n'), self.timeout)
+        except asyncio.IncompleteReadError:
+            raise exceptions.IMAPClientAbortError('the server closed the connection')
+        self.bytes_received += len(line)
+        return line[:-2]
+
+    async def _read_exactly(self, size):
+        try:
+            data = await asyncio.wait_for(self._reader.readexactly(size), self.timeout)
+        except asyncio.IncompleteReadError:
+            raise exceptions.IMAPClientAbortError('the server closed the connection')
+        self.bytes_received += size
+        return data
+
+    async def _read_response(self, responses):
+        """
+        read a (multi line) response. an untagged response is appended to responses as (type, data) in the format
+        of imaplib, literals are (line, literal) tuples. returns the line of a tagged or continuation response.
+        raises an IMAPClientAbortError if the server closes the connection (like imaplib for a BYE).
+        """
+        line = await self._read_line()
+        if not line.startswith(b'* '):
+            return line
+
+        match = UNTAGGED_STATUS.match(line)
+        if match:
+            typ, data = match.group('type'), match.group('data')
+            if match.group('data2'):
+                data += b' ' + match.group('data2')
+        else:
+            match = UNTAGGED_RESPONSE.match(line)
+            if not match:
+                return None
+            typ, data = match.group('type'), match.group('data') or b''
+
+        if typ == b'BYE' and not self._logout:
+            raise exceptions.IMAPClientAbortError(f'the server closed the connection: {data.decode(errors="replace")}')
+
+        items = []
+        while True:
+            literal = LITERAL.match(data)
+            if not literal:
+                items.append(data)
+                break
+            items.append((data, await self._read_exactly(int(literal.group('size')))))
+            data = await self._read_line()
+        responses.append((typ.decode(), items))
+        return None
+
+    async def _send(self, data):
+        self._writer.write(data)
+        self.bytes_sent += len(data)
+        #: backpressure: wait until the socket buffer has room again
+        await self._writer.drain()
+
+    async def _command(self, *arguments):
+        """
+        send a command and return its untagged responses. arguments are bytes (sent as they are) or Literals.
+        raises an IMAPClientError if the server does not answer with OK.
+        """
+        async with self._lock:
+            self._last_command = start = time()
+            self._tag += 1
+            tag = f'A{self._tag:04d}'.encode()
+            responses = []
+
+            line = tag
+            for argument in arguments:
+                if isinstance(argument, Literal):
+                    synchronizing = b'LITERAL+' not in self.capabilities
+                    await self._send(line + b' {' + str(len(argument)).encode() +
+                                     (b'' if synchronizing else b'+') + b'}\r\n')
+                    if synchronizing:
+                        while True:
+                            response = await self._read_response(responses)
+                            if response is None:
+                                continue
+                            if response.startswith(b'+'):
+                                break
+                            #: the server refused the literal, the command ends here
+                            text = response.partition(b' ')[2].partition(b' ')[2]
+                            raise exceptions.IMAPClientError(f'{arguments[0].decode()} failed: '
+                                                             f'{text.decode(errors="replace")}')
+                    line = bytes(argument)
+                else:
+                    line += b' ' + argument
+            await self._send(line + b'\r\n')
+
+            while True:
+                response = await self._read_response(responses)
+                if response is None or not response.startswith(tag + b' '):
+                    continue
+                status, _, text = response[len(tag) + 1:].partition(b' ')
+                if self.observe:
+                    name = arguments[1] if arguments[0] == b'UID' and len(arguments) > 1 else arguments[0]
+                    self.observe(name.decode(), time() - start)
+                if status != b'OK':
+                    raise exceptions.IMAPClientError(f'{arguments[0].decode()} failed: '
+                                                     f'{text.decode(errors="replace")}')
+                return responses, text
+
+    async def capability(self):
+        responses, _ = await self._command(b'CAPABILITY')
+        for typ, items in responses:
+            if typ == 'CAPABILITY':
+                self.capabilities = tuple(items[0].upper().split())
+        return self.capabilities
+
+    def has_capability(self, capability):
+        return capability.upper().encode() in self.capabilities
+
+    async def login(self, user, password):
+        await self._command(b'LOGIN', quote(user), quote(password))
+        await self.capability()
+
+    async def noop(self):
+        await self._command(b'NOOP')
+
+    async def logout(self):
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+        self._logout = True
+        try:
+            await self._command(b'LOGOUT')
+        finally:
+            self._writer.close()
+
+    async def list_folders(self, directory=''):
+        """
+        returns a list of (flags, separator, name) tuples like IMAPClient.list_folders()
+        """
+        responses, _ = await self._command(b'LIST', quote(encode_utf7(directory)), b'"*"')
+        data = [item for typ, items in responses if typ == 'LIST' for item in items]
+        folders = []
+        parsed = parse_response(data) if data else []
+        for i in range(0, len(parsed), 3):
+            flags, separator, name = parsed[i:i + 3]
+            name = str(name) if isinstance(name, int) else decode_utf7(name)
+            folders.append((flags, separator, name))
+        return folders
+
+    async def select_folder(self, folder, readonly=False):
+        """
+        returns the EXISTS, UIDVALIDITY and UIDNEXT of the folder like IMAPClient.select_folder()
+        """
+        responses, _ = await self._command(b'EXAMINE' if readonly else b'SELECT', quote(encode_utf7(folder)))
+        info = {}
+        for typ, items in responses:
+            if typ == 'EXISTS':
+                info[b'EXISTS'] = int(items[0].split()[0])
+            elif typ == 'OK':
+                match = RESPONSE_CODE.search(items[0])
+                if match and match.group('code') in (b'UIDVALIDITY', b'UIDNEXT', b'HIGHESTMODSEQ'):
+                    info[match.group('code')] = int(match.group('value'))
+        return info
+
+    async def create_folder(self, folder):
+        await self._command(b'CREATE', quote(encode_utf7(folder)))
+
+    async def subscribe_folder(self, folder):
+        await self._command(b'SUBSCRIBE', quote(encode_utf7(folder)))
+
+    async def search(self):
+        """
+        returns the uids of all mails of the selected folder
+        """
+        responses, _ = await self._command(b'UID', b'SEARCH', b'ALL')
+        return [int(uid) for typ, items in responses if typ == 'SEARCH' for uid in items[0].split()]
+
+    async def fetch(self, uids, data):
+        """
+        returns the data items of the mails like IMAPClient.fetch()
+        """
+        responses, _ = await self._command(b'UID', b'FETCH', ','.join([str(uid) for uid in uids]).encode(),
+                                           b'(' + ' '.join(data).encode() + b')')
+        items = [item for typ, fetch_items in responses if typ == 'FETCH' for item in fetch_items]
+        return parse_fetch_response(items) if items else {}
+
+    async def append(self, folder, msg, flags=(), msg_time=None):
+        """
+        append the mail to the folder and returns the text of the tagged response (with APPENDUID if supported)
+        """
+        arguments = [b'APPEND', quote(encode_utf7(folder)),
+                     b'(' + b' '.join([flag if isinstance(flag, bytes) else flag.encode() for flag in flags]) + b')']
+        if msg_time:
+            arguments.append(f'"{datetime_to_INTERNALDATE(msg_time)}"'.encode())
+        arguments.append(Literal(msg))
+        _, text = await self._command(*arguments)
+        return text
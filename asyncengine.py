@@ -0,0 +1,497 @@
+import asyncio
+import ssl
+from collections import Counter
+from functools import partial
+from time import time
+
+from imapclient import exceptions
+
+from aioimap import AsyncIMAPClient
+from migrator import Migrator, MigrationError, OPTIONS, connection_lost
+from prefetch import BufferSizer
+from stream import line_length_exceeded
+from utils import beautysized, imaperror_decode, parse_appenduid
+
+#: options of the synchronous engine which the async engine does not support (yet)
+UNSUPPORTED_OPTIONS = ('list', 'follow', 'gmail', 'cache_size', 'lean_scan', 'state_db', 'checkpoint', 'resume')
+
+
+class MemoryBudget:
+    def __init__(self, max_bytes):
+        """
+        limits the size of the mails held in memory by all transfers of an event loop. a buffer is only fetched if
+        it fits into the budget (or nothing else is held), so fast sources can't fill the memory while the
+        destinations are slow. it can be created before the event loop is running.
+        """
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = None
+
+    @property
+    def condition(self):
+        #: created in the running loop, before Python 3.10 it is bound to the loop of the thread when it is created
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, size):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used == 0 or self.used + size <= self.max_bytes)
+            self.used += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+def lost_connection(side, error):
+    """
+    returns a MigrationError if the error means that the connection of the side is dead (the async engine does not
+    reconnect, every following command would fail the same way), otherwise None
+    """
+    if connection_lost(error) or isinstance(error, asyncio.TimeoutError):
+        return MigrationError(f'Connection lost: {side} ({imaperror_decode(error)})')
+    return None
+
+
+class TransferAborted(MigrationError):
+    """
+    the transfer was stopped at the first error (abort_on_error)
+    """
+
+
+class AsyncMigrator(Migrator):
+    def __init__(self, *args, memory=None, **options):
+        """
+            the asyncio version of Migrator, so hundreds of migrations can run in a single event loop (see
+            run_all()). it takes the same arguments and fills the same stats. the folders are mapped by
+            Migrator.plan(), so redirections, the destination root and special folders work the same way.
+
+            each migration uses one connection pair. the mails of a folder are fetched in buffers (like --buffer-size
+            and --buffer-bytes) while the previous buffers are appended, memory is a MemoryBudget shared by all
+            migrations (by default each migration has its own of --prefetch-size plus --buffer-bytes). idle
+            connections send a NOOP every --idle-interval seconds.
+            raises a ValueError for options the async engine does not support.
+        """
+        unsupported = [option for option in UNSUPPORTED_OPTIONS if options.get(option, OPTIONS[option]) !=
+                       OPTIONS[option]]
+        if unsupported or options.get('workers', 1) > 1:
+            raise ValueError(f'The async engine does not support: {", ".join(unsupported or ["workers"])}')
+        super(AsyncMigrator, self).__init__(*args, **options)
+        self.memory = memory or MemoryBudget((self.args.prefetch_size or 0) + (self.args.buffer_bytes or 0))
+
+    async def run(self):
+        """
+            run all phases and close the connections
+            returns the stats, raises a MigrationError if the migration could not be started
+        """
+        try:
+            await self.connect()
+            await self.scan()
+            self.plan()
+            try:
+                with self.metrics.phase('transfer'):
+                    await self.transfer()
+            except TransferAborted:
+                self.output('\n\nAbort!\n')
+            else:
+                self.output('Finish!\n')
+        except MigrationError as e:
+            self.stats['aborted'] = str(e)
+            raise
+        finally:
+            await self.close()
+        return self.stats
+
+    async def connect_server(self, server, port, encryption):
+        """
+            connect to the server, returns the client (or None) and the status message
+        """
+        ssl_context = None
+        if self.args.ssl_no_verify:
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+        client = AsyncIMAPClient(server, port, ssl=encryption in ['ssl', 'tls'], ssl_context=ssl_context,
+                                 keepalive=self.args.idle_interval)
+        try:
+            await client.connect(starttls=encryption == 'starttls')
+        except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError) as e:
+            return None, f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}'
+        return client, self.colorize('OK', color='green')
+
+    async def login_client(self, client, user, password):
+        if not client:
+            return False, f'{self.colorize("Error:", color="red", bold=True)} No active connection'
+        try:
+            await client.login(user, password)
+        except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError) as e:
+            return False, f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}'
+        return True, self.colorize('OK', color='green')
+
+    async def connect(self):
+        """
+            connect and login the source and the destination
+            raises a MigrationError if a connection or a login failed
+        """
+        args = self.args
+        self.metrics.start()
+        for side in ('source', 'destination'):
+            server, port = getattr(args, f'{side}_server'), getattr(self, f'{side}_port')
+            with self.metrics.phase('connect'):
+                client, status = await self.connect_server(server, port, getattr(args, f'{side}_encryption'))
+            setattr(self, side, client)
+            self.output(f'Connecting {side:<17}: {server}:{port}, {status}')
+            if client:
+                client.observe = partial(self.metrics.observe_command, side)
+                self.metrics.add_connection(side, client)
+
+        for side in ('source', 'destination'):
+            user = getattr(args, f'{side}_user')
+            with self.metrics.phase('login'):
+                ok, status = await self.login_client(getattr(self, side), user, getattr(args, f'{side}_pass'))
+            self.output(f'Login {side:<22}: {user}, {status}')
+            if not ok:
+                raise MigrationError('Please fix the errors above.')
+        self.output()
+
+    async def scan(self):
+        """
+            scan the source and the destination folders like Migrator.scan()
+        """
+        with self.metrics.phase('source_scan'):
+            await self.scan_source_folders()
+        with self.metrics.phase('destination_scan'):
+            await self.scan_destination_folders()
+
+    async def scan_source_folders(self):
+        """
+            get the source folders and scan their mails
+        """
+        args = self.args
+        db = self.db
+
+        for flags, separator, name in await self.source.list_folders():
+            if not self.source_separator:
+                self.source_separator = separator.decode()
+            if args.source_folder and name not in args.source_folder and name.startswith(self.wildcards) is False:
+                continue
+            self.source_folders.append(name)
+
+            try:
+                select_info = await self.source.select_folder(name, readonly=True)
+            except exceptions.IMAPClientError as e:
+                self.stats['skipped_folders']['no_parent'] += 1
+                self.stats['errors'].append({'size': 'unknown',
+                                             'subject': 'unknown',
+                                             'exception': str(e),
+                                             'folder': name,
+                                             'date': 'unknown',
+                                             'id': 'unknown'})
+                continue
+
+            mails = await self.source.search()
+            if not mails and args.skip_empty_folders:
+                continue
+
+            db['source']['folders'][name] = {'flags': flags,
+                                             'mails': {},
+                                             'size': 0,
+                                             'pending': [],
+                                             'uidvalidity': select_info.get(b'UIDVALIDITY'),
+                                             'state': None,
+                                             'high_water_mark': max(mails + [0]),
+                                             'uidnext': select_info.get(b'UIDNEXT', max(mails + [0]) + 1),
+                                             'highestmodseq': select_info.get(b'HIGHESTMODSEQ'),
+                                             'copies': {}}
+            await self.scan_source_folder(self.source, name, mails)
+
+        self.output(f'Getting source folders      : {self.stats["source_mails"]} mails in '
+                    f'{len(db["source"]["folders"])} folders '
+                    f'({beautysized(sum([f["size"] for f in db["source"]["folders"].values()]))})')
+
+    async def scan_destination_folders(self):
+        """
+            get the destination folders and scan their mails
+        """
+        args = self.args
+        db = self.db
+        for flags, separator, name in await self.destination.list_folders(args.destination_root):
+            if not self.destination_separator:
+                self.destination_separator = separator.decode()
+            if args.source_folder and name not in args.source_folder and name.startswith(self.wildcards) is False:
+                continue
+
+            db['destination']['folders'][name] = {'flags': flags, 'mails': {}, 'size': 0, 'msg_ids': Counter(),
+                                                  'scanned': False}
+            await self.scan_destination_folder(self.destination, name)
+
+        self.output(f'Getting destination folders : {self.stats["destination_mails"]} mails in '
+                    f'{len(db["destination"]["folders"])} folders '
+                    f'({beautysized(sum([f["size"] for f in db["destination"]["folders"].values()]))})\n')
+
+    async def scan_source_folder(self, client, name, mails):
+        """
+            fetch size, subject and Message-ID of the given mails of the (selected) source folder
+        """
+        folder = self.db['source']['folders'][name]
+        for i in range(0, len(mails), self.args.buffer_size or len(mails)):
+            for mail_id, data in (await client.fetch(mails[i:i + (self.args.buffer_size or len(mails))],
+                                                     ['RFC822.SIZE', 'ENVELOPE'])).items():
+                if b'ENVELOPE' not in data:
+                    self.stats['skipped_mails']['no_envelope'] += 1
+                    continue
+                folder['mails'][mail_id] = {'size': data[b'RFC822.SIZE'],
+                                            'subject': data[b'ENVELOPE'].subject,
+                                            'msg_id': data[b'ENVELOPE'].message_id}
+                folder['size'] += data[b'RFC822.SIZE']
+                self.stats['source_mails'] += 1
+
+    async def scan_destination_folder(self, client, name):
+        """
+            fetch the size (and the Message-ID in incremental mode) of all mails in the destination folder
+        """
+        folder = self.db['destination']['folders'][name]
+        folder['uidvalidity'] = (await client.select_folder(name, readonly=True)).get(b'UIDVALIDITY')
+        folder['scanned'] = True
+        mails = await client.search()
+
+        fetch_data = ['RFC822.SIZE', 'ENVELOPE'] if self.args.incremental else ['RFC822.SIZE']
+        for i in range(0, len(mails), self.args.buffer_size or len(mails)):
+            for mail_id, data in (await client.fetch(mails[i:i + (self.args.buffer_size or len(mails))],
+                                                     fetch_data)).items():
+                folder['mails'][mail_id] = {'size': data[b'RFC822.SIZE']}
+                folder['size'] += data[b'RFC822.SIZE']
+                if self.args.incremental and data[b'ENVELOPE'].message_id:
+                    folder['msg_ids'][data[b'ENVELOPE'].message_id] += 1
+                self.stats['destination_mails'] += 1
+
+    async def transfer(self):
+        """
+            create the destination folders of the plan and copy the mails into them
+            raises a TransferAborted at the first error in abort_on_error mode
+        """
+        args = self.args
+        db = self.db
+
+        for sf_name, df_name in self.mapping.items():
+            source_folder = db['source']['folders'][sf_name]
+            if df_name in db['destination']['folders']:
+                self.output(f'Current folder: {sf_name} ({len(source_folder["mails"])} mails, '
+                            f'{beautysized(source_folder["size"])}) -> {df_name} '
+                            f'({len(db["destination"]["folders"][df_name]["mails"])} mails, '
+                            f'{beautysized(db["destination"]["folders"][df_name]["size"])})')
+                self.stats['skipped_folders']['already_exists'] += 1
+
+            else:
+                self.output(f'Current folder: {sf_name} ({len(source_folder["mails"])} mails, '
+                            f'{beautysized(source_folder["size"])}) -> {df_name} (non existing)')
+
+                if not args.dry_run:
+                    if args.skip_empty_folders and not source_folder['mails']:
+                        self.stats['skipped_folders']['empty'] += 1
+                        continue
+                    try:
+                        with self.metrics.phase('folder_creation'):
+                            await self.destination.create_folder(df_name)
+                            if args.destination_no_subscribe is False:
+                                await self.destination.subscribe_folder(df_name)
+                        db['destination']['folders'][df_name] = {'flags': (), 'mails': {}, 'size': 0,
+                                                                 'msg_ids': Counter(), 'scanned': True}
+                        self.stats['copied_folders'] += 1
+                    except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError) as e:
+                        if lost_connection('destination', e):
+                            raise lost_connection('destination', e)
+                        if 'alreadyexists' in str(e).lower():
+                            self.stats['skipped_folders']['already_exists'] += 1
+                        else:
+                            self.output(f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}\n')
+                            if args.abort_on_error:
+                                raise TransferAborted(imaperror_decode(e))
+                            continue
+            if args.dry_run:
+                continue
+
+            source_folder['df_name'] = df_name
+            self.select_mails(sf_name, df_name)
+            await self.transfer_folder(sf_name, df_name)
+
+    async def transfer_folder(self, sf_name, df_name):
+        """
+            copy the pending mails of the source folder. a producer fetches the next buffers (as far as the queue and
+            the memory budget allow) while the current one is appended to the destination.
+        """
+        mails = self.db['source']['folders'][sf_name]['mails']
+        sizer = BufferSizer(self.args.buffer_bytes, self.args.buffer_size)
+        buffers = sizer.buffers(self.db['source']['folders'][sf_name]['pending'],
+                                lambda mail_id: mails[mail_id]['size'], lambda mail_id: False)
+        queue = asyncio.Queue(maxsize=max(1, (self.args.prefetch_size or 0) // max(1, self.args.buffer_bytes or 0)))
+
+        await self.source.select_folder(sf_name, readonly=True)
+
+        async def produce():
+            try:
+                for buffer, size in buffers:
+                    await self.memory.acquire(size)
+                    #: the budget belongs to the consumer only once the buffer is in the queue, a cancelled fetch or
+                    #: put (the queue is full until the consumer stops) must give it back
+                    queued = False
+                    try:
+                        start = time()
+                        try:
+                            fetched = await self.source.fetch(buffer, ['FLAGS', 'RFC822', 'INTERNALDATE'])
+                        except BaseException:
+                            sizer.failed()
+                            raise
+                        sizer.update(size, time() - start)
+                        self.metrics.add_folder(sf_name, fetch_time=time() - start,
+                                                fetch_bytes=sum([mails[mail_id]['size'] for mail_id in fetched]))
+                        await queue.put((buffer, size, fetched))
+                        queued = True
+                    finally:
+                        if not queued:
+                            await self.memory.release(size)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            buffer_counter = 0
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise lost_connection('source', item) or item
+
+                buffer, size, fetched = item
+                buffer_counter += 1
+                self.output(f'Progressing... {sf_name} (buffer {buffer_counter}, {len(buffer)} mails, '
+                            f'{beautysized(size)})')
+                start = time()
+                copied = self.stats['copied_mails']
+                try:
+                    await self.append_buffer(sf_name, df_name, buffer, fetched)
+                finally:
+                    await self.memory.release(size)
+                    self.metrics.add_folder(sf_name, append_time=time() - start, append_bytes=size,
+                                            mails=self.stats['copied_mails'] - copied)
+        finally:
+            producer.cancel()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if isinstance(item, tuple):
+                    await self.memory.release(item[1])
+
+        self.output(self.colorize('Folder finished!', clear=True))
+
+    async def append_buffer(self, sf_name, df_name, buffer, fetched):
+        """
+            append the fetched mails of a buffer to the destination folder and count them in the stats like
+            Migrator.transfer_folder()
+        """
+        destination_folder = self.db['destination']['folders'].get(df_name)
+        for mail_id in buffer:
+            mail = self.db['source']['folders'][sf_name]['mails'][mail_id]
+            data = fetched.get(mail_id, {})
+            msg_id = mail['msg_id']
+
+            if not all(key in data for key in (b'FLAGS', b'RFC822', b'INTERNALDATE')):
+                self.stats['errors'].append({'size': mail['size'],
+                                             'subject': self.mail_subject(mail),
+                                             'exception': 'KeyError: the mail could not be fetched',
+                                             'folder': df_name,
+                                             'date': data.get(b'INTERNALDATE', '(unknown)'),
+                                             'id': msg_id.decode(errors='replace') if msg_id else '(unknown)'})
+                continue
+
+            #: a mail could exist twice in the source
+            if self.args.incremental and msg_id and destination_folder and destination_folder['msg_ids'][msg_id] > 0:
+                self.stats['skipped_mails']['already_exists'] += 1
+                self.stats['processed'] += 1
+                continue
+
+            if self.args.max_line_length and line_length_exceeded(data[b'RFC822'], self.args.max_line_length)[0]:
+                self.stats['skipped_mails']['max_line_length'] += 1
+                self.stats['processed'] += 1
+                continue
+
+            flags = [flag for flag in data[b'FLAGS'] if flag.lower() not in self.denied_flags]
+            self.stats['processed'] += 1
+            try:
+                status = await self.destination.append(df_name, data[b'RFC822'], flags, data[b'INTERNALDATE'])
+            except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError) as e:
+                if lost_connection('destination', e):
+                    raise lost_connection('destination', e)
+                self.stats['errors'].append({'size': beautysized(mail['size']),
+                                             'subject': self.mail_subject(mail),
+                                             'exception': f'{type(e).__name__}: {e}',
+                                             'folder': df_name,
+                                             'date': data[b'INTERNALDATE'],
+                                             'id': msg_id.decode(errors='replace') if msg_id else '(unknown)'})
+                self.output(f'\n{self.colorize("Error:", color="red", bold=True)} {e}\n')
+                if self.args.abort_on_error:
+                    raise TransferAborted(str(e))
+                continue
+
+            self.stats['copied_mails'] += 1
+            if msg_id and destination_folder:
+                destination_folder['msg_ids'][msg_id] += 1
+            _, uids = parse_appenduid(status)
+            if uids:
+                self.db['source']['folders'][sf_name]['copies'][mail_id] = uids[0]
+
+    async def close(self):
+        """
+            logout the source and the destination
+        """
+        for side in ('source', 'destination'):
+            client = getattr(self, side)
+            if client:
+                try:
+                    await client.logout()
+                except (exceptions.IMAPClientError, OSError, asyncio.TimeoutError):
+                    pass
+        self.metrics.stop()
+
+
+async def run_all(migrators, concurrency=100, max_per_host=0, callback=None):
+    """
+    run the AsyncMigrators in one event loop, up to concurrency at the same time and with up to max_per_host
+    connections to a single server (0 means no limit). callback(migrator, result, duration) is called after each
+    migration, the result is its stats or the exception that stopped it.
+    returns the results in the order of the migrators
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connections = Counter()
+    condition = asyncio.Condition()
+
+    def fits(hosts):
+        return not max_per_host or all(connections[host] == 0 or connections[host] + count <= max_per_host
+                                       for host, count in hosts.items())
+
+    async def run(migrator):
+        hosts = Counter({migrator.args.source_server: 1}) + Counter({migrator.args.destination_server: 1})
+        async with condition:
+            await condition.wait_for(lambda: fits(hosts))
+            connections.update(hosts)
+        try:
+            async with semaphore:
+                start = time()
+                try:
+                    result = await migrator.run()
+                except Exception as e:
+                    result = e
+        finally:
+            async with condition:
+                connections.subtract(hosts)
+                condition.notify_all()
+
+        if callback:
+            callback(migrator, result, time() - start)
+        return result
+
+    return await asyncio.gather(*[run(migrator) for migrator in migrators])
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+"""
+    Benchmark pymap-copy with synthetic mailboxes on local IMAP stand-ins
+"""
+import asyncio
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from multiprocessing import Pipe, Process
+from socket import IPPROTO_TCP, TCP_NODELAY
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeimap import DEFAULT_CAPABILITIES, Server, synthetic_mailbox  # noqa: E402
+from migrator import OPTIONS, Migrator, add_arguments  # noqa: E402
+from utils import beautysized  # noqa: E402
+
+#: the phases of each engine in the order they are run
+SYNC_PHASES = ('connect', 'check_quota', 'scan', 'plan', 'transfer', 'close')
+ASYNC_PHASES = ('connect', 'scan', 'plan', 'transfer', 'close')
+
+
+def serve(connection, config):
+    """
+    runs the source and the destination server in a separate process, so their memory and cpu time are not measured.
+    sends the ports and the size of the mailboxes and, after it received anything, the counters of both servers.
+    """
+    source, destination = synthetic_mailbox(config.folders, config.mails, config.median_size, config.max_size,
+                                            seed=config.seed, existing=config.existing)
+    capabilities = DEFAULT_CAPABILITIES + tuple(config.capability)
+    servers = [Server(mailbox, capabilities, latency=config.latency, bandwidth=config.bandwidth).start()
+               for mailbox in (source, destination)]
+    existing_size = destination.size()
+    connection.send({'ports': [server.port for server in servers], 'mails': source.count(), 'size': source.size(),
+                     'existing_mails': destination.count(), 'existing_size': existing_size})
+    connection.recv()
+    connection.send({'copied_size': destination.size() - existing_size, 'source': dict(servers[0].counters),
+                     'destination': dict(servers[1].counters)})
+    for server in servers:
+        server.shutdown()
+
+
+class BenchmarkMigrator(Migrator):
+    def connect_server(self, server, port, encryption):
+        """
+        like Migrator.connect_server() with TCP_NODELAY like the stand-ins, so Nagle's algorithm and the delayed ACK
+        don't add 40ms to each command on localhost (asyncio sets it by default)
+        """
+        client, status = super(BenchmarkMigrator, self).connect_server(server, port, encryption)
+        if client:
+            client.socket().setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return client, status
+
+
+def peak_rss():
+    """
+    returns the peak resident memory of this process in bytes (None if the platform can't tell)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_sync(migrator):
+    phases = {}
+    for phase in SYNC_PHASES:
+        start = time()
+        getattr(migrator, phase)()
+        phases[phase] = time() - start
+    return phases
+
+
+async def run_async(migrator):
+    phases = {}
+    for phase in ASYNC_PHASES:
+        start = time()
+        result = getattr(migrator, phase)()
+        if asyncio.iscoroutine(result):
+            await result
+        phases[phase] = time() - start
+    return phases
+
+
+parser = ArgumentParser(usage='%(prog)s [options] [-- pymap-copy options]',
+                        description='Benchmark pymap-copy with synthetic mailboxes on local IMAP stand-ins. '
+                                    'Options for pymap-copy (like --buffer-size) can be given after --.',
+                        epilog='benchmark.py --mails 500 --latency 0.01 --results bench.jsonl -- --workers 4')
+parser.add_argument('--folders', help='the number of source folders (default: 5)', type=int, default=5)
+parser.add_argument('--mails', help='the number of mails in each source folder (default: 200)', type=int,
+                    default=200)
+parser.add_argument('--median-size', help='the median size of the mails in byte, the sizes are log-normal '
+                                          'distributed (default: 10000)', type=int, default=10000)
+parser.add_argument('--max-size', help='the maximum size of a mail in byte (default: 10000000)', type=int,
+                    default=10000000)
+parser.add_argument('--existing', help='the share of the mails which are already in the destination, like 0.9 to '
+                                       'benchmark incremental runs (default: 0)', type=float, default=0.0)
+parser.add_argument('--seed', help='the seed of the synthetic mailboxes (default: 0)', type=int, default=0)
+parser.add_argument('--latency', help='the latency of each command in seconds (default: 0)', type=float, default=0)
+parser.add_argument('--bandwidth', help='the bandwidth of each connection in byte per second (default: 0 = no '
+                                        'limit)', type=int, default=0)
+parser.add_argument('--capability', help='an additional capability of the servers (like MULTIAPPEND or CONDSTORE), '
+                                         'can be used multiple times', action='append', default=[])
+parser.add_argument('--async', help='benchmark the async engine (AsyncMigrator)', dest='use_async',
+                    action='store_true')
+parser.add_argument('--results', help='append the results as a json line to this file, to compare versions', type=str)
+parser.add_argument('--label', help='a label for the results (like the version or the commit)', default='')
+parser.add_argument('--verbose', help='show the output of pymap-copy', action='store_true')
+
+#: everything after -- is passed to pymap-copy
+if '--' in sys.argv:
+    copy_arguments = sys.argv[sys.argv.index('--') + 1:]
+    args = parser.parse_args(sys.argv[1:sys.argv.index('--')])
+else:
+    copy_arguments = []
+    args = parser.parse_args()
+
+copy_parser = ArgumentParser(prog='pymap-copy.py')
+add_arguments(copy_parser)
+
+print('Generating mailboxes...', flush=True)
+connection, server_connection = Pipe()
+server_process = Process(target=serve, args=(server_connection, args), daemon=True)
+server_process.start()
+mailboxes = connection.recv()
+source_port, destination_port = mailboxes['ports']
+print(f'Mails: {mailboxes["mails"]} in {args.folders} folders ({beautysized(mailboxes["size"])}), '
+      f'{mailboxes["existing_mails"]} already in the destination\n', flush=True)
+
+copy_args = copy_parser.parse_args(['-u', 'bench', '-p', 'bench', '-s', '127.0.0.1', '-e', 'none', '--source-port',
+                                    str(source_port), '-U', 'bench', '-P', 'bench', '-S', '127.0.0.1', '-E', 'none',
+                                    '--destination-port', str(destination_port), '--no-colors'] + copy_arguments)
+options = {name: getattr(copy_args, name) for name in OPTIONS}
+output = print if args.verbose else None
+rss_start = peak_rss()
+
+start_time = time()
+if args.use_async:
+    from asyncengine import AsyncMigrator
+    migrator = AsyncMigrator('bench', 'bench', '127.0.0.1', 'bench', 'bench', '127.0.0.1', output=output, **options)
+    phase_times = asyncio.run(run_async(migrator))
+else:
+    migrator = BenchmarkMigrator('bench', 'bench', '127.0.0.1', 'bench', 'bench', '127.0.0.1', output=output, **options)
+    phase_times = run_sync(migrator)
+total_time = time() - start_time
+
+connection.send('stop')
+counters = connection.recv()
+server_process.join()
+
+stats = migrator.stats
+transfer_time = phase_times['transfer'] or 1e-9
+result = {
+    'label': args.label,
+    'date': datetime.now().isoformat(timespec='seconds'),
+    'engine': 'async' if args.use_async else 'sync',
+    'setup': {name: getattr(args, name) for name in ('folders', 'mails', 'median_size', 'max_size', 'existing',
+                                                      'seed', 'latency', 'bandwidth', 'capability')},
+    'arguments': copy_arguments,
+    'mails': mailboxes['mails'],
+    'size': mailboxes['size'],
+    'copied_mails': stats['copied_mails'],
+    'copied_size': counters['copied_size'],
+    'errors': len(stats['errors']),
+    'phases': {phase: round(seconds, 3) for phase, seconds in phase_times.items()},
+    'total': round(total_time, 3),
+    'mails_per_second': round(stats['copied_mails'] / transfer_time, 1),
+    'mb_per_second': round(counters['copied_size'] / transfer_time / 1000000, 2),
+    'peak_rss': peak_rss(),
+    'start_rss': rss_start,
+    'commands': {'source': counters['source'], 'destination': counters['destination']},
+    'metrics': migrator.metrics.report()
+}
+
+print(f'Phases     : {", ".join([f"{phase} {seconds:.2f}s" for phase, seconds in phase_times.items()])}')
+print(f'Total      : {total_time:.2f}s')
+print(f'Transfer   : {stats["copied_mails"]} mails ({beautysized(counters["copied_size"])}), '
+      f'{result["mails_per_second"]} mails/s, {result["mb_per_second"]} MB/s')
+if result['peak_rss']:
+    print(f'Peak RSS   : {beautysized(result["peak_rss"])} (before the run: {beautysized(rss_start)})')
+print(f'Errors     : {result["errors"]}')
+for side in ('source', 'destination'):
+    commands = {name: count for name, count in counters[side].items() if not name.startswith('bytes_')}
+    print(f'{side.title():<11}: {", ".join([f"{name} {count}" for name, count in sorted(commands.items())])}, '
+          f'{beautysized(counters[side].get("bytes_sent", 0))} sent, '
+          f'{beautysized(counters[side].get("bytes_received", 0))} received')
+
+if args.results:
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(result) + '\n')
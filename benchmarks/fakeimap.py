@@ -0,0 +1,422 @@
+"""
+    A local IMAP stand-in for the pymap-copy benchmarks. It keeps the mailboxes in memory and supports the commands
+    pymap-copy uses (LIST, SELECT, SEARCH, FETCH, APPEND, STORE, IDLE, ...), not the whole protocol.
+"""
+import random
+import re
+import socketserver
+import threading
+from base64 import b64encode
+from collections import Counter
+from time import sleep, time
+
+DEFAULT_CAPABILITIES = ('IMAP4rev1', 'IDLE', 'UIDPLUS', 'LITERAL+')
+#: characters which end an atom (a literal is passed as bytes and ends it as well)
+ATOM_END = ' ()'
+
+
+class Mailbox:
+    def __init__(self):
+        """
+        the folders of a mailbox, each with its mails by uid
+        """
+        self.folders = {}
+        self.lock = threading.RLock()
+        self.create('INBOX')
+
+    def create(self, name):
+        with self.lock:
+            if name not in self.folders:
+                self.folders[name] = {'uidvalidity': int(time()) % 100000 + len(self.folders), 'uidnext': 1,
+                                      'modseq': 1, 'mails': {}}
+
+    def add(self, folder, body, flags=(), date=None):
+        """
+        add a mail to the folder and returns its uid
+        """
+        with self.lock:
+            folder = self.folders[folder]
+            uid = folder['uidnext']
+            folder['uidnext'] += 1
+            folder['modseq'] += 1
+            folder['mails'][uid] = {'body': body, 'flags': list(flags), 'date': date or '01-Jan-2020 10:00:00 +0000',
+                                    'modseq': folder['modseq']}
+            return uid
+
+    def size(self):
+        return sum([len(mail['body']) for folder in self.folders.values() for mail in folder['mails'].values()])
+
+    def count(self):
+        return sum([len(folder['mails']) for folder in self.folders.values()])
+
+
+def synthetic_mail(number, size, text):
+    """
+    returns a mail of about size bytes with a unique Message-ID. the body is taken from text (base64 lines like an
+    attachment), so generating large mailboxes is cheap.
+    """
+    head = (f'From: Sender {number % 97} <sender{number % 97}@example.org>\r\n'
+            f'To: Recipient <recipient@example.net>\r\n'
+            f'Subject: Benchmark mail {number}\r\n'
+            f'Date: Wed, 1 Jan 2020 10:00:00 +0000\r\n'
+            f'Message-ID: <bench{number}@example.org>\r\n'
+            f'MIME-Version: 1.0\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode()
+    body_size = max(78, size - len(head))
+    offset = (number * 7919) % (len(text) - 78) // 78 * 78
+    body = text[offset:offset + body_size]
+    while len(body) < body_size:
+        body += text[:body_size - len(body)]
+    return head + body[:len(body) - len(body) % 78]
+
+
+def synthetic_mailbox(folders, mails, median_size, max_size, seed=0, existing=0.0):
+    """
+    returns a source and a destination Mailbox. the source has mails mails in each of folders folders, their sizes
+    are log-normal distributed (most mails are small, a few have large attachments) around median_size and capped
+    at max_size. existing is the share of mails which are already in the destination (like in an incremental run).
+    """
+    rnd = random.Random(seed)
+    text = b''.join([b64encode(rnd.getrandbits(8 * 57).to_bytes(57, 'little')) + b'\r\n' for _ in range(16384)])
+    source, destination = Mailbox(), Mailbox()
+    names = ['INBOX'] + [f'INBOX.Folder {i}' for i in range(1, folders)]
+    number = 0
+    for name in names:
+        source.create(name)
+        if existing:
+            destination.create(name)
+        for i in range(mails):
+            size = min(max_size, int(rnd.lognormvariate(0, 1.3) * median_size))
+            body = synthetic_mail(number, size, text)
+            flags = ['\\Seen'] if rnd.random() < 0.8 else []
+            source.add(name, body, flags)
+            if i < mails * existing:
+                destination.add(name, body, flags)
+            number += 1
+    return source, destination
+
+
+def tokenize(parts):
+    """
+    returns the arguments of a command as nested lists of strings, literals stay bytes
+    """
+    result = []
+    stack = [result]
+    i = 0
+    while i < len(parts):
+        char = parts[i]
+        if isinstance(char, bytes):
+            stack[-1].append(char)
+            i += 1
+        elif char == ' ':
+            i += 1
+        elif char == '(':
+            stack[-1].append([])
+            stack.append(stack[-1][-1])
+            i += 1
+        elif char == ')':
+            stack.pop()
+            i += 1
+        elif char == '"':
+            i += 1
+            value = ''
+            while parts[i] != '"':
+                if parts[i] == '\\':
+                    i += 1
+                value += parts[i]
+                i += 1
+            stack[-1].append(value)
+            i += 1
+        else:
+            start, depth = i, 0
+            while i < len(parts) and not isinstance(parts[i], bytes) and (parts[i] not in ATOM_END or depth):
+                depth += {'[': 1, ']': -1}.get(parts[i], 0)
+                i += 1
+            stack[-1].append(''.join(parts[start:i]))
+    return result
+
+
+def quote(s):
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def header(body, name):
+    match = re.search(rb'^' + name.encode() + rb':\s*(.*)$', body.split(b'\r\n\r\n', 1)[0], re.I | re.M)
+    return match.group(1).strip() if match else None
+
+
+class Handler(socketserver.StreamRequestHandler):
+    #: TCP_NODELAY (see setup()), otherwise the delayed ACK of the client holds back each small response for 40ms
+    disable_nagle_algorithm = True
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.server.count('bytes_sent', len(data))
+        if self.server.bandwidth:
+            sleep(len(data) / self.server.bandwidth)
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def read_command(self):
+        """
+        returns the characters of the next command (literals as bytes) or None if the connection was closed. a
+        command with a literal larger than max_literal of the server is refused and returned empty.
+        """
+        parts = []
+        refused = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            self.server.count('bytes_received', len(line))
+            line = line.decode('utf8', 'replace').rstrip('\r\n')
+            literal = re.search(r'{(\d+)(\+?)}$', line)
+            if not literal:
+                parts.extend(line)
+                break
+            parts.extend(line[:literal.start()])
+            size = int(literal.group(1))
+            if self.server.max_literal and size > self.server.max_literal:
+                refused = True
+                #: a synchronizing literal is refused before it is sent, the command ends here
+                if not literal.group(2):
+                    break
+            elif not literal.group(2):
+                self.send('+ go ahead\r\n')
+            if self.server.bandwidth:
+                sleep(size / self.server.bandwidth)
+            parts.append(self.rfile.read(size))
+            self.server.count('bytes_received', size)
+
+        if refused:
+            self.send(f'{"".join(parts[:parts.index(" ")])} NO [TOOBIG] literal too large\r\n')
+            return []
+        return parts
+
+    def handle(self):
+        self.selected = None
+        self.mailbox = self.server.mailbox
+        self.send('* OK benchmark server ready\r\n')
+        commands = 0
+        while True:
+            parts = self.read_command()
+            if parts is None:
+                return
+            commands += 1
+            if self.server.max_commands and commands > self.server.max_commands:
+                self.send('* BYE too many commands\r\n')
+                return
+            arguments = tokenize(parts)
+            if len(arguments) < 2:
+                continue
+            if self.server.latency:
+                sleep(self.server.latency)
+            tag, command, arguments = arguments[0], arguments[1].upper(), arguments[2:]
+            if command == 'UID':
+                command, arguments = arguments[0].upper(), arguments[1:]
+            self.server.count(command)
+            method = getattr(self, f'do_{command.lower()}', None)
+            if method is None:
+                self.send(f'{tag} BAD unknown command\r\n')
+            elif method(tag, arguments) == 'logout':
+                return
+
+    def do_capability(self, tag, arguments):
+        self.send(f'* CAPABILITY {" ".join(self.server.capabilities)}\r\n{tag} OK done\r\n')
+
+    def do_login(self, tag, arguments):
+        self.send(f'{tag} OK [CAPABILITY {" ".join(self.server.capabilities)}] logged in\r\n')
+
+    def do_logout(self, tag, arguments):
+        self.send(f'* BYE\r\n{tag} OK bye\r\n')
+        return 'logout'
+
+    def do_noop(self, tag, arguments):
+        self.send(f'{tag} OK noop\r\n')
+
+    def do_enable(self, tag, arguments):
+        self.send(f'* ENABLED {" ".join(arguments)}\r\n{tag} OK enabled\r\n')
+
+    def do_list(self, tag, arguments):
+        for name in sorted(self.mailbox.folders):
+            if not arguments[0] or name.startswith(arguments[0]):
+                self.send(f'* LIST () "." {quote(name)}\r\n')
+        self.send(f'{tag} OK list\r\n')
+
+    do_lsub = do_list
+
+    def do_create(self, tag, arguments):
+        if arguments[0] in self.mailbox.folders:
+            self.send(f'{tag} NO [ALREADYEXISTS] folder exists\r\n')
+        else:
+            self.mailbox.create(arguments[0])
+            self.send(f'{tag} OK created\r\n')
+
+    def do_subscribe(self, tag, arguments):
+        self.send(f'{tag} OK subscribed\r\n')
+
+    def do_select(self, tag, arguments):
+        folder = self.mailbox.folders.get(arguments[0])
+        if folder is None:
+            self.send(f'{tag} NO no such folder\r\n')
+            return
+        self.selected = folder
+        self.send(f'* {len(folder["mails"])} EXISTS\r\n* 0 RECENT\r\n* FLAGS (\\Seen \\Answered \\Flagged)\r\n'
+                  f'* OK [UIDVALIDITY {folder["uidvalidity"]}] uidvalidity\r\n'
+                  f'* OK [UIDNEXT {folder["uidnext"]}] uidnext\r\n'
+                  f'* OK [HIGHESTMODSEQ {folder["modseq"]}] highestmodseq\r\n{tag} OK selected\r\n')
+
+    do_examine = do_select
+
+    def do_status(self, tag, arguments):
+        folder = self.mailbox.folders.get(arguments[0])
+        if folder is None:
+            self.send(f'{tag} NO no such folder\r\n')
+            return
+        values = {'MESSAGES': len(folder['mails']), 'UIDNEXT': folder['uidnext'], 'RECENT': 0, 'UNSEEN': 0,
+                  'UIDVALIDITY': folder['uidvalidity'], 'HIGHESTMODSEQ': folder['modseq'],
+                  'SIZE': sum([len(mail['body']) for mail in folder['mails'].values()])}
+        items = ' '.join([f'{item} {values[item.upper()]}' for item in arguments[1]])
+        self.send(f'* STATUS {quote(arguments[0])} ({items})\r\n{tag} OK status\r\n')
+
+    def uids(self, uid_set):
+        uids = sorted(self.selected['mails'])
+        result = []
+        for part in uid_set.split(','):
+            first, _, last = part.partition(':')
+            first = int(first)
+            last = (uids[-1] if uids else 0) if last == '*' else int(last or first)
+            first, last = min(first, last), max(first, last)
+            result.extend([uid for uid in uids if first <= uid <= last])
+        return result
+
+    def do_search(self, tag, arguments):
+        uids = sorted(self.selected['mails'])
+        for i, argument in enumerate(arguments):
+            if argument == 'UID':
+                uids = [uid for uid in uids if uid in set(self.uids(arguments[i + 1]))]
+            elif argument == 'MODSEQ':
+                uids = [uid for uid in uids if self.selected['mails'][uid]['modseq'] > int(arguments[i + 1])]
+        self.send(f'* SEARCH {" ".join(map(str, uids))}\r\n{tag} OK search\r\n')
+
+    def fetch_item(self, item, mail):
+        body = mail['body']
+        if item == 'FLAGS':
+            return f'FLAGS ({" ".join(mail["flags"])})'.encode()
+        elif item == 'MODSEQ':
+            return f'MODSEQ ({mail["modseq"]})'.encode()
+        elif item == 'RFC822.SIZE':
+            return f'RFC822.SIZE {len(body)}'.encode()
+        elif item == 'INTERNALDATE':
+            return f'INTERNALDATE "{mail["date"]}"'.encode()
+        elif item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+            return f'{"RFC822" if item == "RFC822" else "BODY[]"} {{{len(body)}}}\r\n'.encode() + body
+        elif item.startswith('BODY.PEEK[]<'):
+            offset, length = map(int, item[len('BODY.PEEK[]<'):-1].split('.'))
+            part = body[offset:offset + length]
+            return f'BODY[]<{offset}> {{{len(part)}}}\r\n'.encode() + part
+        elif item.startswith('BODY.PEEK[HEADER.FIELDS'):
+            headers = b''
+            for name in re.findall(r'[A-Z0-9-]+', item[len('BODY.PEEK[HEADER.FIELDS'):]):
+                value = header(body, name)
+                if value is not None:
+                    headers += name.title().encode() + b': ' + value + b'\r\n'
+            headers += b'\r\n'
+            return f'{item.replace(".PEEK", "")} {{{len(headers)}}}\r\n'.encode() + headers
+        elif item == 'ENVELOPE':
+            subject, message_id = header(body, 'Subject'), header(body, 'Message-ID')
+            subject = quote(subject.decode()) if subject else 'NIL'
+            message_id = quote(message_id.decode()) if message_id else 'NIL'
+            return (f'ENVELOPE ("Wed, 1 Jan 2020 10:00:00 +0000" {subject} NIL NIL NIL NIL NIL NIL NIL '
+                    f'{message_id})').encode()
+        return None
+
+    def do_fetch(self, tag, arguments):
+        items = arguments[1] if isinstance(arguments[1], list) else [arguments[1]]
+        changed_since = None
+        if len(arguments) > 2 and isinstance(arguments[2], list) and arguments[2][0].upper() == 'CHANGEDSINCE':
+            changed_since = int(arguments[2][1])
+        sequence = {uid: i for i, uid in enumerate(sorted(self.selected['mails']), start=1)}
+        for uid in self.uids(arguments[0]):
+            mail = self.selected['mails'][uid]
+            if changed_since is not None and mail['modseq'] <= changed_since:
+                continue
+            data = [f'UID {uid}'.encode()] + [self.fetch_item(item.upper(), mail) for item in items]
+            self.send(f'* {sequence[uid]} FETCH ('.encode() + b' '.join([d for d in data if d]) + b')\r\n')
+        self.send(f'{tag} OK fetch\r\n')
+
+    def do_store(self, tag, arguments):
+        mode = arguments[1].upper()
+        flags = arguments[2] if isinstance(arguments[2], list) else [arguments[2]]
+        for uid in self.uids(arguments[0]):
+            mail = self.selected['mails'][uid]
+            if mode.startswith('+FLAGS'):
+                mail['flags'] = list(dict.fromkeys(mail['flags'] + flags))
+            elif mode.startswith('-FLAGS'):
+                mail['flags'] = [flag for flag in mail['flags'] if flag not in flags]
+            else:
+                mail['flags'] = list(flags)
+            self.selected['modseq'] += 1
+            mail['modseq'] = self.selected['modseq']
+        self.send(f'{tag} OK store\r\n')
+
+    def do_append(self, tag, arguments):
+        folder = self.mailbox.folders.get(arguments[0])
+        if folder is None:
+            self.send(f'{tag} NO [TRYCREATE] no such folder\r\n')
+            return
+        uids, flags, date = [], [], None
+        for argument in arguments[1:]:
+            if isinstance(argument, list):
+                flags = argument
+            elif isinstance(argument, bytes):
+                uids.append(self.mailbox.add(arguments[0], argument, flags, date))
+                flags, date = [], None
+            else:
+                date = argument
+        self.server.count('appended_mails', len(uids))
+        if 'UIDPLUS' in self.server.capabilities:
+            self.send(f'{tag} OK [APPENDUID {folder["uidvalidity"]} {",".join(map(str, uids))}] APPEND completed\r\n')
+        else:
+            self.send(f'{tag} OK APPEND completed\r\n')
+
+    def do_idle(self, tag, arguments):
+        self.send('+ idling\r\n')
+        self.rfile.readline()
+        self.send(f'{tag} OK idle terminated\r\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox, capabilities=DEFAULT_CAPABILITIES, latency=0, bandwidth=0, port=0, max_literal=0,
+                 max_commands=0):
+        """
+        serves the mailbox on localhost (any user and password) until shutdown() is called. latency is added to each
+        command in seconds, bandwidth limits each connection in byte per second (0 means no limit).
+        literals larger than max_literal bytes are refused with NO and each connection is closed with a BYE after
+        max_commands commands (0 means no limit).
+        """
+        super(Server, self).__init__(('127.0.0.1', port), Handler)
+        self.mailbox = mailbox
+        self.capabilities = list(capabilities)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_literal = max_literal
+        self.max_commands = max_commands
+        self.counters = Counter()  #: number of each command, bytes sent and received
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,96 @@
+import json
+import os
+from bisect import bisect_right
+from threading import RLock
+from time import time
+
+
+class Checkpoint:
+    def __init__(self, path, source_account, destination_account, resume=False, interval=10):
+        """
+        remember the progress of each folder in a json file, so an interrupted copy can be resumed
+
+        the file is written at most every interval seconds (or if save() is forced). the processed UIDs of a folder
+        are stored as a sorted list of disjoint [first, last] ranges together with its UIDVALIDITY.
+        """
+        self.path = path
+        self.interval = interval
+        self._lock = RLock()
+        self._saved = 0
+        self._data = {'source': source_account, 'destination': destination_account, 'folders': {}}
+
+        if resume:
+            with open(path) as f:
+                data = json.load(f)
+            if data['source'] != source_account or data['destination'] != destination_account:
+                raise ValueError(f'The checkpoint belongs to {data["source"]} -> {data["destination"]}')
+            self._data = data
+
+    def _folder(self, name, uidvalidity):
+        folder = self._data['folders'].get(name)
+        if folder is None or folder['uidvalidity'] != uidvalidity:
+            folder = self._data['folders'][name] = {'uidvalidity': uidvalidity, 'finished': False, 'done': []}
+        return folder
+
+    def is_finished(self, name, uidvalidity):
+        """
+        returns True if the folder (with this UIDVALIDITY) was completely copied
+        """
+        with self._lock:
+            folder = self._data['folders'].get(name)
+            return bool(folder and folder['uidvalidity'] == uidvalidity and folder['finished'])
+
+    def is_done(self, name, uidvalidity, uid):
+        """
+        returns True if the mail was already processed
+        """
+        with self._lock:
+            folder = self._data['folders'].get(name)
+            if not folder or folder['uidvalidity'] != uidvalidity:
+                return False
+            #: the last range which starts at or before the uid
+            i = bisect_right(folder['done'], [uid, float('inf')])
+            return i > 0 and folder['done'][i - 1][1] >= uid
+
+    def add(self, name, uidvalidity, uids):
+        """
+        mark the given UIDs of the folder as processed
+        """
+        with self._lock:
+            done = self._folder(name, uidvalidity)['done']
+            for uid in uids:
+                i = bisect_right(done, [uid, float('inf')])
+                if i > 0 and done[i - 1][1] >= uid:
+                    continue
+
+                #: the uid extends (or joins) the neighbouring ranges, mostly the last one as the uids ascend
+                joins_previous = i > 0 and done[i - 1][1] == uid - 1
+                joins_next = i < len(done) and done[i][0] == uid + 1
+                if joins_previous and joins_next:
+                    done[i - 1][1] = done.pop(i)[1]
+                elif joins_previous:
+                    done[i - 1][1] = uid
+                elif joins_next:
+                    done[i][0] = uid
+                else:
+                    done.insert(i, [uid, uid])
+            self.save()
+
+    def finish(self, name, uidvalidity):
+        """
+        mark the folder as completely copied
+        """
+        with self._lock:
+            self._folder(name, uidvalidity)['finished'] = True
+            self.save(force=True)
+
+    def save(self, force=False):
+        with self._lock:
+            if not force and time() - self._saved < self.interval:
+                return
+
+            #: write to a temporary file first, so a crash while writing does not destroy the checkpoint
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(self._data, f)
+            os.replace(f'{self.path}.tmp', self.path)
+            self._saved = time()
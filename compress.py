@@ -0,0 +1,88 @@
+import imaplib
+import zlib
+from io import BufferedReader, RawIOBase
+
+from imapclient import exceptions
+
+#: imaplib refuses to send commands it does not know
+if 'COMPRESS' not in imaplib.Commands:
+    imaplib.Commands['COMPRESS'] = ('AUTH', 'SELECTED')
+
+
+class DeflateReader(RawIOBase):
+    def __init__(self, file, compression):
+        """
+        a raw stream that reads DEFLATE compressed data from file and returns it decompressed
+        """
+        self.file = file
+        self.compression = compression
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._tail = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            data = self._tail
+            if not data:
+                data = self.file.read1(65536)
+                if not data:
+                    return 0
+                self.compression.received_compressed += len(data)
+
+            #: limit the output to the size of b, the rest of the input is kept for the next call
+            out = self._decompressor.decompress(data, len(b))
+            self._tail = self._decompressor.unconsumed_tail
+            if out:
+                b[:len(out)] = out
+                self.compression.received += len(out)
+                return len(out)
+
+    def close(self):
+        self.file.close()
+        super(DeflateReader, self).close()
+
+
+class Compression:
+    def __init__(self, client):
+        """
+        compress the connection of the client with DEFLATE (RFC 4978) and count the bytes before and after the
+        compression. raises an IMAPClientError if the server refuses it.
+        """
+        self.sent = 0
+        self.sent_compressed = 0
+        self.received = 0
+        self.received_compressed = 0
+
+        imap = client._imap
+        typ, data = imap._simple_command('COMPRESS', 'DEFLATE')
+        if typ != 'OK':
+            raise exceptions.IMAPClientError(f'COMPRESS failed: {data[-1].decode(errors="replace")}')
+
+        #: everything after the OK response is compressed
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._sock = imap.sock
+        imap.file = BufferedReader(DeflateReader(imap.file, self), 65536)
+        imap.send = self.send
+
+    def send(self, data):
+        #: every command is flushed, so the server can process it right away
+        compressed = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.sent += len(data)
+        self.sent_compressed += len(compressed)
+        self._sock.sendall(compressed)
+
+    @property
+    def ratio(self):
+        """
+        the compression ratio of all sent and received data
+        """
+        return (self.sent + self.received) / max(1, self.sent_compressed + self.received_compressed)
+
+    @property
+    def saved(self):
+        """
+        the number of bytes that were not transferred thanks to the compression
+        """
+        return self.sent + self.received - self.sent_compressed - self.received_compressed
@@ -1,43 +1,150 @@
-from threading import Thread
+import logging
+from heapq import heappop, heappush
+from itertools import count
+from select import select
+from threading import Condition, RLock, Thread
 from time import sleep, time
 
+from imapclient import exceptions
 
-class IMAPIdle(Thread):
-    def __init__(self, client, interval=1680):
+
+class KeepAlive(Thread):
+    def __init__(self):
+        """
+        a single thread which restarts the idle mode of all IMAPIdle connections when it is due. it sleeps until the
+        next deadline, so hundreds of connections need neither polling nor a thread each.
+        """
+        super(KeepAlive, self).__init__(daemon=True)
+        self._condition = Condition()
+        self._schedule = []  #: heap of (deadline, counter, IMAPIdle)
+        self._counter = count()
+        self._running = False
+
+    def schedule(self, idle, deadline):
+        with self._condition:
+            heappush(self._schedule, (deadline, next(self._counter), idle))
+            if not self._running:
+                self._running = True
+                self.start()
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._schedule or self._schedule[0][0] > time():
+                    self._condition.wait(self._schedule[0][0] - time() if self._schedule else None)
+                deadline, _, idle = heappop(self._schedule)
+
+            #: the connection was used (or idles again with a later deadline) since it was scheduled
+            if idle.deadline == deadline:
+                idle.keep_alive()
+
+
+#: the scheduler of all connections of this process
+KEEPALIVE = KeepAlive()
+
+
+class IMAPIdle:
+    def __init__(self, client, interval=1680, keepalive=KEEPALIVE):
+        """
+        holds a connection alive while it is not used. it idles (RFC 2177) on the selected folder or, if the server
+        does not support IDLE, sends a NOOP. the idle mode is restarted every interval seconds by the keepalive
+        scheduler.
+
+        every command of this class holds lock. the connection must not be used between start_idle() and
+        stop_idle(), after stop_idle() returned the scheduler does not touch it anymore.
+        """
         self.client = client
         self.interval = interval
+        self.keepalive = keepalive
+        self.lock = RLock()
+        self.deadline = None  #: the time of the next restart while idling
         self._idle = False
         self._exit = False
-        super(IMAPIdle, self).__init__(daemon=True)
-
-    def run(self):
-        while self._exit is False:
-            if self._idle and (time()-self._idle) > self.interval:
-                self.restart_idle()
-            sleep(0.1)
+        self._use_idle = client.has_capability('IDLE')
 
     def exit(self):
-        self._exit = True
+        """
+        stop the restarts of the idle mode (the connection is closed soon)
+        """
+        with self.lock:
+            self._exit = True
+            self.deadline = None
+
+    def _schedule(self):
+        self.deadline = time() + self.interval
+        self.keepalive.schedule(self, self.deadline)
 
     def start_idle(self):
         """
         start imap idle to hold the connection alive
         """
-        if self._idle is False:
-            #: must select a folder before invoking idle. we simply select the first folder to idle on
-            _, _, some_folder = self.client.list_folders()[0]
-            self.client.select_folder(some_folder, readonly=True)
-            self.client.idle()
-            self._idle = time()
+        with self.lock:
+            if self._idle or self._exit:
+                return
+            if self._use_idle:
+                #: must select a folder before invoking idle, the selected folder is used if there is one
+                if self.client._imap.state != 'SELECTED':
+                    self.client.select_folder('INBOX', readonly=True)
+                self.client.idle()
+            self._idle = True
+            self._schedule()
 
     def stop_idle(self):
         """
         stop idle mode to allow normal commands
         """
-        if self._idle:
-            self.client.idle_done()
-            self._idle = False
+        with self.lock:
+            self.deadline = None
+            if self._idle:
+                self._idle = False
+                if self._use_idle:
+                    try:
+                        self.client.idle_done()
+                    except (exceptions.IMAPClientError, OSError) as e:
+                        #: the connection is broken, the next command will notice it
+                        logging.warning(f'Could not stop the idle mode: {e}')
+
+    def keep_alive(self):
+        """
+        restart the idle mode (or send a NOOP), called by the scheduler
+        """
+        with self.lock:
+            if not self._idle or self._exit:
+                return
+            try:
+                if self._use_idle:
+                    self.client.idle_done()
+                    self.client.idle()
+                else:
+                    self.client.noop()
+            except (exceptions.IMAPClientError, OSError) as e:
+                #: the connection is broken, the next command will notice it
+                logging.warning(f'Could not keep the connection alive: {e}')
+                self._idle = False
+                self.deadline = None
+                return
+            self._schedule()
+
+    def wait(self, folder, timeout):
+        """
+        idle on the folder until the server reports a change or timeout seconds passed
+        returns the untagged responses of the server (like EXISTS or FETCH)
+        """
+        with self.lock:
+            self.stop_idle()
+            if not self._use_idle:
+                sleep(timeout)
+                return []
+            self.client.select_folder(folder, readonly=True)
+            self.client.idle()
+            try:
+                select([self.client.socket()], [], [], timeout)
+            finally:
+                _, responses = self.client.idle_done()
+            return responses
 
     def restart_idle(self):
-        self.stop_idle()
-        self.start_idle()
+        with self.lock:
+            self.stop_idle()
+            self.start_idle()
@@ -0,0 +1,114 @@
+import os
+from collections import OrderedDict
+from tempfile import mkdtemp
+from threading import RLock
+
+
+class MailCache:
+    def __init__(self, uses, max_memory, max_disk=0):
+        """
+        keep downloaded mails of this run, so a mail that exists in several source folders is downloaded only once
+
+        uses is a Counter of how often each key occurs in the source. a mail is only kept if its key will be used
+        again and it's dropped after its last use. up to max_memory bytes are held in memory, older mails are moved
+        to temporary files up to max_disk bytes. beyond that the least recently used mails are evicted.
+        """
+        self.uses = uses
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.hits = 0
+        self.saved = 0  #: bytes not downloaded
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._directory = None
+        self._files = 0
+        self._lock = RLock()
+
+    def wanted(self, key):
+        """
+        returns True if a mail with this key occurs in more than one place
+        """
+        return key is not None and self.uses[key] > 1
+
+    def get(self, key):
+        """
+        returns the cached mail (and counts this use) or None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                data = self._memory[key]
+            elif key in self._disk:
+                with open(self._disk[key], 'rb') as f:
+                    data = f.read()
+                self._disk.move_to_end(key)
+            else:
+                return None
+
+            self.hits += 1
+            self.saved += len(data)
+            self._use(key)
+            return data
+
+    def add(self, key, data):
+        """
+        count this use of the downloaded mail and keep it, if it will be used again
+        """
+        with self._lock:
+            if key in self._memory or key in self._disk:
+                self._use(key)
+                return
+            self.uses[key] -= 1
+            if self.uses[key] <= 0 or len(data) > self.max_memory:
+                return
+
+            self._memory[key] = data
+            self._memory_size += len(data)
+
+            #: move the least recently used mails to the disk
+            while self._memory_size > self.max_memory:
+                old_key, old_data = self._memory.popitem(last=False)
+                self._memory_size -= len(old_data)
+                self._spill(old_key, old_data)
+
+    def _use(self, key):
+        self.uses[key] -= 1
+        if self.uses[key] <= 0:
+            self._remove(key)
+
+    def _spill(self, key, data):
+        if len(data) > self.max_disk:
+            return
+
+        while self._disk_size + len(data) > self.max_disk:
+            self._remove(next(iter(self._disk)))
+
+        if self._directory is None:
+            self._directory = mkdtemp(prefix='pymap-copy-')
+        self._files += 1
+        path = os.path.join(self._directory, str(self._files))
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._disk[key] = path
+        self._disk_size += len(data)
+
+    def _remove(self, key):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        elif key in self._disk:
+            path = self._disk.pop(key)
+            self._disk_size -= os.path.getsize(path)
+            os.remove(path)
+
+    def close(self):
+        """
+        remove all cached mails and the temporary files
+        """
+        with self._lock:
+            for key in list(self._memory) + list(self._disk):
+                self._remove(key)
+            if self._directory:
+                os.rmdir(self._directory)
+                self._directory = None
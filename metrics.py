@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Event, RLock, Thread
+from time import time
+
+#: upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+#: the counters of the stats which are part of the report
+STATS_COUNTERS = ('source_mails', 'destination_mails', 'processed', 'copied_mails', 'copied_folders', 'synced_flags',
+                  'reconnects', 'throttled')
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        counts the observed values in buckets (like a prometheus histogram)
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        """
+        returns (upper bound, number of values <= upper bound) tuples, the last bound is '+Inf'
+        """
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6),
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class ConnectionMetrics:
+    def __init__(self, metrics, client, name):
+        """
+        measures the latency of each command of an IMAPClient connection and counts the bytes it sent and received
+        (before a compression). the imaplib methods every command passes are wrapped on the instance, so this has to
+        be done after the compression was enabled.
+        """
+        self.metrics = metrics
+        self.side = name.split()[0]  #: workers are counted together with their side
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._command = None  #: [tag, command, start time] of the running command
+
+        imap = client._imap
+        self._new_tag, self._send, self._read, self._readline, self._command_complete = \
+            imap._new_tag, imap.send, imap.read, imap.readline, imap._command_complete
+        imap._new_tag, imap.send, imap.read, imap.readline, imap._command_complete = \
+            self.new_tag, self.send, self.read, self.readline, self.command_complete
+
+    def new_tag(self):
+        tag = self._new_tag()
+        self._command = [tag, None, time()]
+        return tag
+
+    def send(self, data):
+        #: the first line of a command names it (like "A001 UID FETCH ...")
+        if self._command and self._command[1] is None and data.startswith(self._command[0] + b' '):
+            words = data.split(b' ', 3)
+            command = words[2] if words[1].upper() == b'UID' and len(words) > 2 else words[1]
+            self._command[1] = command.strip().decode(errors='replace').upper()
+        self.bytes_sent += len(data)
+        return self._send(data)
+
+    def read(self, size):
+        data = self._read(size)
+        self.bytes_received += len(data)
+        return data
+
+    def readline(self):
+        line = self._readline()
+        self.bytes_received += len(line)
+        return line
+
+    def command_complete(self, name, tag):
+        try:
+            return self._command_complete(name, tag)
+        finally:
+            if self._command and self._command[0] == tag:
+                self.metrics.observe_command(self.side, self._command[1] or name, time() - self._command[2])
+                self._command = None
+
+
+class Metrics:
+    def __init__(self, json_path=None, prometheus_path=None, interval=10, labels=None, stats=None):
+        """
+        collects the duration of each phase, the latency of each IMAP command, the bytes of each connection and the
+        fetch and append times of each folder
+
+        the report is written to json_path and as prometheus textfile (like for the textfile collector of the
+        node_exporter) to prometheus_path, every interval seconds while start() is running and by stop(). labels
+        (like the source and the destination account) are added to every prometheus metric, the counters of stats
+        are part of the report.
+        """
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.labels = labels or {}
+        self.stats = stats if stats is not None else {}
+        self.start_time = time()
+        self.phases = {}  #: phase -> seconds, phases which run several times are added up
+        self.commands = {}  #: (side, command) -> Histogram
+        self.connections = {}  #: name -> ConnectionMetrics (or anything with bytes_sent and bytes_received)
+        self.folders = {}  #: source folder -> counters
+        self._lock = RLock()
+        self._stop = Event()
+        self._thread = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + time() - start
+
+    def watch(self, client, name):
+        """
+        measure the commands and the bytes of the connection of an IMAPClient. the bytes of a previous connection with
+        the same name (like before a reconnect) are kept.
+        """
+        with self._lock:
+            previous = self.connections.get(name)
+            connection = self.connections[name] = ConnectionMetrics(self, client, name)
+            if previous:
+                connection.bytes_sent, connection.bytes_received = previous.bytes_sent, previous.bytes_received
+
+    def add_connection(self, name, connection):
+        """
+        count the bytes of a connection which counts them itself (bytes_sent and bytes_received like an
+        AsyncIMAPClient)
+        """
+        with self._lock:
+            self.connections[name] = connection
+
+    def observe_command(self, side, command, seconds):
+        with self._lock:
+            histogram = self.commands.get((side, command))
+            if histogram is None:
+                histogram = self.commands[(side, command)] = Histogram()
+            histogram.observe(seconds)
+
+    def add_folder(self, name, **values):
+        """
+        add to the counters of the source folder (fetch_time, fetch_bytes, append_time, append_bytes, mails)
+        """
+        with self._lock:
+            folder = self.folders.setdefault(name, {'fetch_time': 0.0, 'fetch_bytes': 0, 'append_time': 0.0,
+                                                    'append_bytes': 0, 'mails': 0})
+            for key, value in values.items():
+                folder[key] += value
+
+    def report(self):
+        with self._lock:
+            return {
+                'labels': self.labels,
+                'duration': round(time() - self.start_time, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'commands': {f'{side} {command}': histogram.as_dict()
+                             for (side, command), histogram in sorted(self.commands.items())},
+                'connections': {name: {'bytes_sent': connection.bytes_sent,
+                                       'bytes_received': connection.bytes_received}
+                                for name, connection in self.connections.items()},
+                'folders': {name: {key: round(value, 3) for key, value in folder.items()}
+                            for name, folder in self.folders.items()},
+                'stats': {**{key: self.stats.get(key, 0) for key in STATS_COUNTERS},
+                          'errors': len(self.stats.get('errors', []))}
+            }
+
+    def prometheus(self):
+        """
+        returns the report in the prometheus text format
+        """
+        def metric(name, value, **labels):
+            labels = {**self.labels, **labels}
+            label_text = ','.join([f'{key}="{escape(value)}"' for key, value in labels.items()])
+            return f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}'
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        report = self.report()
+        lines = ['# HELP pymap_copy_duration_seconds Seconds since the start of the migration',
+                 '# TYPE pymap_copy_duration_seconds gauge',
+                 metric('pymap_copy_duration_seconds', report['duration']),
+                 '# HELP pymap_copy_phase_seconds Seconds spent in each phase of the migration',
+                 '# TYPE pymap_copy_phase_seconds gauge']
+        lines.extend([metric('pymap_copy_phase_seconds', seconds, phase=phase)
+                      for phase, seconds in report['phases'].items()])
+
+        lines.extend(['# HELP pymap_copy_command_duration_seconds Latency of the IMAP commands',
+                      '# TYPE pymap_copy_command_duration_seconds histogram'])
+        with self._lock:
+            for (side, command), histogram in sorted(self.commands.items()):
+                lines.extend([metric('pymap_copy_command_duration_seconds_bucket', count, side=side, command=command,
+                                     le=bound) for bound, count in histogram.cumulative()])
+                lines.append(metric('pymap_copy_command_duration_seconds_sum', round(histogram.sum, 6), side=side,
+                                    command=command))
+                lines.append(metric('pymap_copy_command_duration_seconds_count', histogram.count, side=side,
+                                    command=command))
+
+        for direction in ('sent', 'received'):
+            lines.extend([f'# HELP pymap_copy_connection_bytes_{direction}_total Bytes {direction} by each '
+                          f'connection (before the compression)',
+                          f'# TYPE pymap_copy_connection_bytes_{direction}_total counter'])
+            lines.extend([metric(f'pymap_copy_connection_bytes_{direction}_total', values[f'bytes_{direction}'],
+                                 connection=name) for name, values in report['connections'].items()])
+
+        for key, help_text in (('fetch_time', 'Seconds spent fetching the mails of each folder'),
+                               ('append_time', 'Seconds spent appending the mails of each folder'),
+                               ('fetch_bytes', 'Bytes fetched from each folder'),
+                               ('append_bytes', 'Bytes appended from each folder'),
+                               ('mails', 'Mails appended from each folder')):
+            name = f'pymap_copy_folder_{key.replace("_time", "_seconds")}_total'
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+            lines.extend([metric(name, folder[key], folder=folder_name)
+                          for folder_name, folder in report['folders'].items()])
+
+        lines.extend(['# HELP pymap_copy_mails Counters of the migration (like copied_mails)',
+                      '# TYPE pymap_copy_mails gauge'])
+        lines.extend([metric('pymap_copy_mails', value, counter=key) for key, value in report['stats'].items()])
+        return '\n'.join(lines) + '\n'
+
+    def save(self):
+        """
+        write the report to the json file and the prometheus textfile (if set)
+        """
+        for path, content in ((self.json_path, lambda: json.dumps(self.report(), indent=2)),
+                              (self.prometheus_path, self.prometheus)):
+            if not path:
+                continue
+            #: write to a temporary file first, so a reader never sees a half written report
+            with open(f'{path}.tmp', 'w') as f:
+                f.write(content())
+            os.replace(f'{path}.tmp', path)
+
+    def start(self):
+        """
+        write the report every interval seconds in a background thread (if a file is set)
+        """
+        if (self.json_path or self.prometheus_path) and self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning(f'Could not write the metrics: {e}')
+
+    def stop(self):
+        """
+        stop the background thread and write the final report. an error while writing it is logged, so it can't
+        hide the result of the migration.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.save()
+        except OSError as e:
+            logging.warning(f'Could not write the metrics: {e}')
@@ -0,0 +1,2122 @@
+import logging
+from argparse import ArgumentTypeError, Namespace
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from queue import Queue, Empty
+from threading import Condition, Thread, Event, RLock
+from time import sleep, time
+
+from imapclient import IMAPClient, exceptions
+from imapclient.imap_utf7 import decode as decode_utf7
+from imapclient.response_parser import parse_response
+
+from checkpoint import Checkpoint
+from compress import Compression
+from imapidle import IMAPIdle
+from mailcache import MailCache
+from metrics import Metrics
+from prefetch import Prefetcher, BufferSizer
+from statedb import StateDB
+from stream import SpooledMail, fetch_mail, append_mail, line_length_exceeded
+from throttle import Throttle, is_throttled
+from utils import decode_mime, beautysized, imaperror_decode, parse_appenduid, get_header
+
+#: pre-defined variables
+ENCRYPTIONS = ['ssl', 'tls', 'starttls', 'none']
+SPECIAL_FOLDER_FLAGS = [b'\\Archive', b'\\Junk', b'\\Drafts', b'\\Trash', b'\\Sent']
+LEAN_MESSAGE_ID = 'BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)]'
+GMAIL_CACHE_SIZE = 100000000
+GMAIL_LABELS = {b'\\Sent': '\\Sent', b'\\Drafts': '\\Draft', b'\\Flagged': '\\Starred',
+                b'\\Important': '\\Important'}  #: special folders and their Gmail system labels
+
+#: the options of a Migrator and their defaults (the long arguments of pymap-copy.py)
+OPTIONS = {
+    'dry_run': False,
+    'list': False,
+    'incremental': False,
+    'follow': False,
+    'abort_on_error': False,
+    'buffer_size': 50,
+    'buffer_bytes': 20000000,
+    'denied_flags': None,
+    'prefetch_size': 50000000,
+    'no_compression': False,
+    'gmail': False,
+    'cache_size': 0,
+    'cache_disk_size': 1000000000,
+    'stream_size': 10000000,
+    'redirect': None,
+    'follow_interval': 60,
+    'idle_interval': 1680,
+    'reconnect_retries': 5,
+    'reconnect_delay': 1,
+    'ignore_quota': False,
+    'ignore_folder_flags': False,
+    'lean_scan': False,
+    'max_line_length': None,
+    'max_mail_size': None,
+    'no_colors': False,
+    'skip_empty_folders': False,
+    'checkpoint': None,
+    'resume': False,
+    'state_db': None,
+    'metrics_file': None,
+    'metrics_prometheus': None,
+    'metrics_interval': 10,
+    'ssl_no_verify': False,
+    'workers': 1,
+    'source_encryption': 'ssl',
+    'source_port': None,
+    'source_max_mbps': 0,
+    'source_max_ops': 0,
+    'source_folder': [],
+    'destination_encryption': 'ssl',
+    'destination_port': None,
+    'destination_max_mbps': 0,
+    'destination_max_ops': 0,
+    'destination_root': '',
+    'destination_root_merge': False,
+    'destination_no_subscribe': False
+}
+
+
+class MigrationError(Exception):
+    """
+        the migration can't be started or continued (like a failed login or an insufficient quota)
+    """
+
+
+class TransferInterrupted(Exception):
+    def __init__(self, side, error, results=()):
+        """
+            a command of side (source or destination) failed while copying, so the rest has to be retried. results are
+            the results of the mails which were appended before (see Migrator.append_mails()).
+        """
+        super(TransferInterrupted, self).__init__(f'{side}: {imaperror_decode(error)}')
+        self.side = side
+        self.error = error
+        self.results = list(results)
+
+
+class ConnectionLost(TransferInterrupted):
+    """
+        the connection broke (see connection_lost())
+    """
+
+
+class Throttled(TransferInterrupted):
+    """
+        the server refused a command because of throttling, the connection can still be used
+    """
+
+
+class Connection:
+    def __init__(self, client):
+        """
+            holds the IMAPClient of a connection and passes everything on to it. a reconnect replaces the client, so
+            every reference to the connection (like the ones of the workers and the keepalive) uses the new one.
+        """
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def check_encryption(value):
+    """
+        check for the --???-encryption argument
+        raise an exception if the given encryption is invalid
+    """
+    value = value.lower()
+    if value not in ENCRYPTIONS:
+        raise ArgumentTypeError(f'{value} is an unknown encryption. Use can use ssl, tls, starttls or none instead.')
+    return value
+
+
+def default_port(encryption):
+    """
+        returns a port based on the encryption
+    """
+    if encryption in ['starttls', 'none']:
+        return 143
+    return 993
+
+
+def colorize(s, color=None, bold=False, clear=False, no_colors=False):
+    """
+        turn the string into a colored and/or bold one
+    """
+    colors = {'red': '\x1b[31m',
+              'green': '\x1b[32m',
+              'cyan': '\x1b[36m',
+              'yellow': '\x1b[33m'}
+    if no_colors:
+        return s
+
+    if clear:
+        s = f'\r\x1b[2K{s}'
+    if bold:
+        s = f'\x1b[1m{s}'
+    if color:
+        s = f'{colors[color]}{s}'
+    return f'{s}\x1b[0m'
+
+
+def add_arguments(parser):
+    """
+        add the arguments of pymap-copy.py to the ArgumentParser, the long arguments are the OPTIONS of a Migrator
+    """
+    #: run mode arguments
+    parser.add_argument('-d', '--dry-run', help='copy & creating nothing, just feign', action="store_true")
+    parser.add_argument('-l', '--list', help='copy & creating nothing, just list folders', action="store_true")
+    parser.add_argument('-i', '--incremental', help='copy & creating only new folders/mails', action="store_true")
+    parser.add_argument('--follow', help='keep the destination in sync after the copy: new mails are copied and '
+                                         'changed flags are applied (CONDSTORE) until the process is interrupted',
+                        action="store_true")
+
+    #: special and optimization arguments
+    parser.add_argument('--abort-on-error', help='the process will interrupt at the first mail transfer error',
+                        action="store_true")
+    parser.add_argument('-b', '--buffer-size', help='the maximum number of mails loaded with a single query '
+                                               '(default: 50)', nargs='?', type=int, default=50)
+    parser.add_argument('--buffer-bytes', help='the maximum size in byte of mails loaded with a single query, buffers '
+                                               'get smaller if loading them is slow, 0 disables it (default: 20000000)',
+                        type=int, default=20000000)
+    parser.add_argument('--denied-flags', help='mails with this flags will be skipped', type=str)
+    parser.add_argument('--prefetch-size', help='the maximum size in byte of mails that are fetched in advance while '
+                                                 'the current buffer is copied, 0 disables it (default: 50000000)',
+                        type=int, default=50000000)
+    parser.add_argument('--no-compression', help='do not compress the connections, even if the servers support '
+                                                  'COMPRESS=DEFLATE', action='store_true')
+    parser.add_argument('--gmail', help='copy each mail of a Gmail source only once (by its X-GM-MSGID), it is '
+                                        'labelled on a Gmail destination or uploaded to each of its folders from the '
+                                        'mail cache otherwise', action='store_true')
+    parser.add_argument('--cache-size', help='the size in byte of mails kept in memory to copy a mail that exists in '
+                                              'several source folders without downloading it again, 0 disables it '
+                                              '(default: 0)', type=int, default=0)
+    parser.add_argument('--cache-disk-size', help='the size in byte of cached mails that are moved to temporary files '
+                                                  'if the memory of --cache-size is full (default: 1000000000)',
+                        type=int, default=1000000000)
+    parser.add_argument('--stream-size', help='mails larger than this size in byte are copied in chunks of this size, '
+                                               'so they are never loaded into memory completely, 0 disables it '
+                                               '(default: 10000000)', type=int, default=10000000)
+    parser.add_argument('-r', '--redirect', help='redirect a folder (source:destination --denied-flags seen,recent -d)',
+                        action='append')
+    parser.add_argument('--follow-interval', help='the interval (in seconds) after that all folders are checked for '
+                                                  'changes in follow mode (default: 60)', type=int, default=60)
+    parser.add_argument('--idle-interval', help='defines the interval (in seconds) after that the idle process is '
+                                                'restarted (default: 1680)', type=int, default=1680)
+    parser.add_argument('--reconnect-retries', help='the number of reconnects in a row after a connection broke while '
+                                                    'copying, 0 disables it (default: 5)', type=int, default=5)
+    parser.add_argument('--reconnect-delay', help='the delay (in seconds) before the first reconnect, it doubles with '
+                                                  'each further reconnect in a row (default: 1)', type=float,
+                        default=1)
+    parser.add_argument('--ignore-quota', help='ignores insufficient quota', action='store_true')
+    parser.add_argument('--ignore-folder-flags', help='do not link default IMAP folders automatically (like Drafts, '
+                                                      'Trash, etc.)', action='store_true')
+    parser.add_argument('--lean-scan', help='fetch only the size (and the Message-ID in incremental mode) of each mail '
+                                             'while scanning, the subjects are read while copying', action='store_true')
+    parser.add_argument('--max-line-length', help='use this option when the program crashes by some mails', type=int)
+    parser.add_argument('--max-mail-size', help='skip all mails larger than the given size in byte', type=int)
+    parser.add_argument('--no-colors', help='disable ANSI Escape Code (for terminals like powershell or cmd)',
+                        action="store_true")
+    parser.add_argument('--skip-empty-folders', help='skip empty folders', action='store_true')
+    parser.add_argument('--checkpoint', help='write the progress to this file, so the copy can be resumed by --resume',
+                        type=str)
+    parser.add_argument('--resume', help='continue an interrupted copy from the --checkpoint file', action='store_true')
+    parser.add_argument('--state-db', help='remember copied mails in this sqlite database, so incremental runs only '
+                                           'scan new mails', type=str)
+    parser.add_argument('--metrics-file', help='write the duration of each phase, the latency of the IMAP commands and '
+                                               'the bytes of each connection as json to this file', type=str)
+    parser.add_argument('--metrics-prometheus', help='write the metrics of --metrics-file in the prometheus text '
+                                                     'format to this file (like for the textfile collector)', type=str)
+    parser.add_argument('--metrics-interval', help='the interval (in seconds) after that the metrics files are '
+                                                   'updated while copying (default: 10)', type=int, default=10)
+    parser.add_argument('--ssl-no-verify', help='do not verify any ssl certificate', action='store_true')
+    parser.add_argument('-w', '--workers', help='the number of connection pairs used to copy folders in parallel '
+                                                '(default: 1)', type=int, default=1)
+
+    #: source arguments
+    parser.add_argument('-u', '--source-user', help='source mailbox username', nargs='?', required=True)
+    parser.add_argument('-p', '--source-pass', help='source mailbox password', nargs='?', required=True)
+    parser.add_argument('-s', '--source-server', help='hostname or  of the source IMAP-server', nargs='?',
+                        required=True, default=False)
+    parser.add_argument('-e', '--source-encryption', help='select the source encryption (ssl/tls/starttls/none) '
+                                                          '(default: ssl)', default='ssl', type=check_encryption)
+    parser.add_argument('--source-port', help='the IMAP port of the source server (default: 993)', nargs='?', type=int)
+    parser.add_argument('--source-max-mbps', help='the maximum rate (in megabit per second) of mails fetched from the '
+                                                  'source, 0 disables it (default: 0)', type=float, default=0)
+    parser.add_argument('--source-max-ops', help='the maximum number of fetch commands per second sent to the source, '
+                                                 '0 disables it (default: 0)', type=float, default=0)
+    parser.add_argument('-f', '--source-folder', help='', action='append', nargs='?', default=[], type=str)
+
+    #: destination arguments
+    parser.add_argument('-U', '--destination-user', help='destination mailbox username', nargs='?', required=True)
+    parser.add_argument('-P', '--destination-pass', help='destination mailbox password', nargs='?', required=True)
+    parser.add_argument('-S', '--destination-server', help='hostname or IP of the destination server', nargs='?',
+                        required=True)
+    parser.add_argument('-E', '--destination-encryption', help='select the destination encryption '
+                                                               '(ssl/tls/starttls/none) (default: ssl)', default='ssl',
+                        type=check_encryption)
+    parser.add_argument('--destination-port', help='the IMAP port of the destination server', nargs='?', type=int)
+    parser.add_argument('--destination-max-mbps', help='the maximum rate (in megabit per second) of mails appended to '
+                                                       'the destination, 0 disables it (default: 0)', type=float,
+                        default=0)
+    parser.add_argument('--destination-max-ops', help='the maximum number of append commands per second sent to the '
+                                                      'destination, 0 disables it (default: 0)', type=float, default=0)
+    parser.add_argument('--destination-root', help='defines the destination root (case sensitive)', nargs='?',
+                        default='', type=str)
+    parser.add_argument('--destination-root-merge', help='ignores the destination root if the folder is already part '
+                                                         'of it', action='store_true')
+    parser.add_argument('--destination-no-subscribe', help='all copied folders will be not are not subscribed',
+                        action="store_true", default=False)
+
+
+def folder_statuses(client, directory=''):
+    """
+        returns a list of (flags, separator, name, status) of all folders without selecting them. the status contains
+        MESSAGES, UIDNEXT, UIDVALIDITY, SIZE (if STATUS=SIZE is supported) and HIGHESTMODSEQ (if CONDSTORE is
+        supported) or is None if the folder has none. with LIST-STATUS (RFC 5819) a single command is used for all
+        folders.
+    """
+    items = [b'MESSAGES', b'UIDNEXT', b'UIDVALIDITY']
+    if client.has_capability('STATUS=SIZE'):
+        items.append(b'SIZE')
+    if client.has_capability('CONDSTORE'):
+        items.append(b'HIGHESTMODSEQ')
+
+    if not client.has_capability('LIST-STATUS'):
+        folders = []
+        for flags, separator, name in client.list_folders(directory):
+            try:
+                status = client.folder_status(name, items)
+            except exceptions.IMAPClientError as e:
+                if connection_lost(e):
+                    raise
+                status = None  #: e.g. a \Noselect folder
+            folders.append((flags, separator, name, status))
+        return folders
+
+    imap = client._imap
+    typ, data = imap._simple_command('LIST', client._normalise_folder(directory), b'"*"',
+                                     b'RETURN (STATUS (' + b' '.join(items) + b'))')
+    if typ != 'OK':
+        raise exceptions.IMAPClientError(f'LIST failed: {data[-1].decode(errors="replace")}')
+    _, folder_data = imap._untagged_response(typ, data, 'LIST')
+    _, status_data = imap._untagged_response(typ, data, 'STATUS')
+
+    statuses = {}
+    status_data = [item for item in status_data if item not in (b'', None)]
+    if status_data:
+        response = parse_response(status_data)
+        for name, status in zip(response[::2], response[1::2]):
+            if isinstance(name, int):
+                name = str(name)
+            elif client.folder_encode:
+                name = decode_utf7(name)
+            statuses[name] = dict(zip(status[::2], status[1::2]))
+
+    return [(flags, separator, name, statuses.get(name))
+            for flags, separator, name in client._proc_folder_list(folder_data)]
+
+
+def folder_size(client, name, status):
+    """
+        returns the size of all mails in the folder. it's taken from the status if the server supports STATUS=SIZE,
+        otherwise the sizes of the mails are fetched with a single command.
+    """
+    if b'SIZE' in status:
+        return status[b'SIZE']
+    if not status[b'MESSAGES']:
+        return 0
+    client.select_folder(name, readonly=True)
+    return sum([data[b'RFC822.SIZE'] for data in client.fetch('1:*', ['RFC822.SIZE']).values()])
+
+
+def lean_message_id(data):
+    """
+        returns the Message-ID from the response of a lean scan (or None)
+    """
+    for key, value in data.items():
+        if key.startswith(b'BODY[HEADER.FIELDS') and value:
+            return get_header(value, b'Message-ID')
+    return None
+
+
+def cache_key(mail):
+    """
+        returns the key of a scanned mail for the mail cache (its X-GM-MSGID in gmail mode, otherwise its Message-ID and
+        its size) or None. mails without a Message-ID are not cached, their envelopes (like of automatic reports) are
+        often the same although the mails are not.
+    """
+    if mail.get('gm_msgid'):
+        return mail['gm_msgid']
+    if mail['msg_id']:
+        return mail['msg_id'], mail['size']
+    return None
+
+
+def append_succeeded(status):
+    """
+        check the response of an APPEND command
+    """
+    #: differed IMAP servers have differed return codes
+    success_messages = [b'append completed', b'(success)']
+    return any([msg in status.lower() for msg in success_messages])
+
+
+def connection_lost(error):
+    """
+        returns True if the error means that the connection is dead (like a broken pipe, a reset, a timeout, an EOF or
+        a BYE). IMAPClient raises an abort for a synchronizing literal the server answered with a tagged NO or BAD too,
+        but this is just a refused command.
+    """
+    if isinstance(error, OSError):
+        return True
+    return isinstance(error, exceptions.IMAPClientAbortError) and \
+        'waiting for continuation response' not in str(error)
+
+
+@contextmanager
+def interruptions(side):
+    """
+        raises a ConnectionLost (or Throttled) of side if a command of the block failed because the connection broke
+        (or the server throttled it), other errors are passed on
+    """
+    try:
+        yield
+    except (exceptions.IMAPClientError, OSError) as e:
+        if connection_lost(e):
+            raise ConnectionLost(side, e)
+        if is_throttled(e):
+            raise Throttled(side, e)
+        raise
+
+
+def phase(name):
+    """
+        decorator that adds the duration of a Migrator method to the phase name of its metrics
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Migrator:
+    def __init__(self, source_user, source_pass, source_server, destination_user, destination_pass,
+                 destination_server, output=None, **options):
+        """
+            copy the folders and mails of the source mailbox to the destination mailbox
+
+            the options are the long arguments of pymap-copy.py (like incremental=True or workers=4, see OPTIONS). the
+            migration runs in phases: connect(), check_quota(), scan(), plan(), transfer(), follow() and close(), run()
+            calls all of them. the progress is written to output (like print), by default nothing is written.
+            raises a MigrationError if the checkpoint can't be loaded.
+        """
+        unknown = set(options) - set(OPTIONS)
+        if unknown:
+            raise TypeError(f'Unknown options: {", ".join(sorted(unknown))}')
+        self.args = Namespace(**{**OPTIONS, **options, 'source_user': source_user, 'source_pass': source_pass,
+                                 'source_server': source_server, 'destination_user': destination_user,
+                                 'destination_pass': destination_pass, 'destination_server': destination_server})
+        for encryption in (self.args.source_encryption, self.args.destination_encryption):
+            if encryption not in ENCRYPTIONS:
+                raise ValueError(f'{encryption} is an unknown encryption. Use can use ssl, tls, starttls or none '
+                                 f'instead.')
+        if self.args.resume and not self.args.checkpoint:
+            raise ValueError('resume requires a checkpoint')
+
+        self.output = output or (lambda *args, **kwargs: None)
+        self.quiet = output is None  #: nothing is printed, so the subjects are only decoded for the errors
+        self.source_port = self.args.source_port or default_port(self.args.source_encryption)
+        self.destination_port = self.args.destination_port or default_port(self.args.destination_encryption)
+
+        self.denied_flags = [b'\\recent']
+        if self.args.denied_flags:
+            self.denied_flags.extend([f'\\{flag}'.encode() for flag in self.args.denied_flags.lower().split(',')])
+        self.wildcards = tuple([f[:-1] for f in self.args.source_folder if f.endswith('*')])
+
+        self.progress = 0
+        self.destination_separator, self.source_separator = None, None
+        self.lock = RLock()  #: guards stats, db and the output in case of parallel workers
+        self.abort = Event()
+        self.failures = []
+        self.jobs = Queue()
+        self.sizers = {}  #: the BufferSizer of each source connection
+        self.mail_cache = None
+        self.compressions = []  #: (name, Compression) of each compressed connection
+        self.gmail_destination = False
+        self.gmail_copies = {}  #: X-GM-MSGID -> (destination folder, uid) of the mails copied to a Gmail destination
+        self.gmail_uploads = Condition(self.lock)  #: notified if a reserved Gmail copy was uploaded or released
+        self.source, self.destination = None, None
+        self.source_idle, self.destination_idle = None, None
+        self.worker_connections = []
+        self.connection_pairs = []
+        self.source_folders = []  #: the names of all listed source folders (also the finished or empty ones)
+        self.redirections = {}
+        self.mapping = {}  #: source folder -> destination folder
+        self.db = {
+            'source': {
+                'folders': {}
+            },
+            'destination': {
+                'folders': {}
+            }
+        }
+        self.stats = {
+            'start_time': time(),
+            'source_mails': 0,
+            'destination_mails': 0,
+            'processed': 0,
+            'errors': [],
+            'skipped_folders': {
+                'already_exists': 0,
+                'empty': 0,
+                'dry-run': 0,
+                'no_parent': 0
+            },
+            'skipped_mails': {
+                'already_exists': 0,
+                'zero_size': 0,
+                'max_size': 0,
+                'max_line_length': 0,
+                'no_envelope': 0
+            },
+            'copied_mails': 0,
+            'copied_folders': 0,
+            'labelled_mails': 0,
+            'synced_flags': 0,
+            'reconnects': 0,
+            'reconnect_time': 0.0,
+            'throttled': 0,
+            'aborted': None  #: the reason if the migration was stopped by a MigrationError
+        }
+
+        if self.args.state_db:
+            self.state = StateDB(self.args.state_db, f'{source_user}@{source_server}',
+                                 f'{destination_user}@{destination_server}')
+        else:
+            self.state = None
+
+        #: the commands of all workers to a server share its throttle
+        self.throttles = {side: Throttle(self.args.workers, int(getattr(self.args, f'{side}_max_mbps') * 125000),
+                                         getattr(self.args, f'{side}_max_ops'))
+                          for side in ('source', 'destination')}
+
+        self.metrics = Metrics(self.args.metrics_file, self.args.metrics_prometheus, self.args.metrics_interval,
+                               labels={'source': f'{source_user}@{source_server}',
+                                       'destination': f'{destination_user}@{destination_server}'},
+                               stats=self.stats)
+
+        if self.args.checkpoint:
+            try:
+                self.checkpoint = Checkpoint(self.args.checkpoint, f'{source_user}@{source_server}',
+                                             f'{destination_user}@{destination_server}', resume=self.args.resume)
+            except (OSError, ValueError) as e:
+                raise MigrationError(f'Could not load checkpoint: {e}')
+        else:
+            self.checkpoint = None
+
+    def colorize(self, s, color=None, bold=False, clear=False):
+        return colorize(s, color=color, bold=bold, clear=clear, no_colors=self.args.no_colors)
+
+    def run(self):
+        """
+            run all phases of the migration (the list mode is left out, see list()) and close the connections
+            returns the stats. a KeyboardInterrupt stops the transfer, the stats until then are returned.
+            a MigrationError is raised after its reason was recorded as aborted in the stats.
+        """
+        try:
+            self.connect()
+            self.check_quota()
+            self.scan()
+            self.plan()
+            try:
+                self.transfer()
+                if self.args.follow and not self.args.dry_run:
+                    self.follow()
+            except KeyboardInterrupt:
+                self.output('\n\nAbort!\n')
+            else:
+                if self.args.dry_run:
+                    self.output()
+                self.output('Finish!\n')
+        except MigrationError as e:
+            self.stats['aborted'] = str(e)
+            raise
+        finally:
+            self.close()
+        return self.stats
+
+    def connect(self):
+        """
+            connect and login the source, the destination and the worker connections, enable the compression and
+            start the keepalive
+            raises a MigrationError if a connection or a login failed
+        """
+        args = self.args
+        self.metrics.start()
+
+        #: connecting source
+        self.output(f'Connecting source           : {args.source_server}:{self.source_port}, ', end='', flush=True)
+        self.source, status = self.connect_server(args.source_server, self.source_port, args.source_encryption)
+        self.output(status)
+
+        #: connecting destination
+        self.output(f'Connecting destination      : {args.destination_server}:{self.destination_port}, ', end='',
+                    flush=True)
+        self.destination, status = self.connect_server(args.destination_server, self.destination_port,
+                                                       args.destination_encryption)
+        self.output(status)
+
+        self.output()
+
+        #: login source
+        self.output(f'Login source                : {args.source_user}, ', end='', flush=True)
+        source_login_ok, status = self.login_client(self.source, args.source_user, args.source_pass)
+        self.output(status)
+
+        #: login destination
+        self.output(f'Login destination           : {args.destination_user}, ', end='', flush=True)
+        destination_login_ok, status = self.login_client(self.destination, args.destination_user,
+                                                         args.destination_pass)
+        self.output(status)
+
+        if all((source_login_ok, destination_login_ok)) is False:
+            raise MigrationError('Please fix the errors above.')
+
+        self.output()
+
+        #: compress connections
+        self.output(f'Compression source          : {self.enable_compression(self.source, "source")}')
+        self.output(f'Compression destination     : {self.enable_compression(self.destination, "destination")}')
+        self.metrics.watch(self.source, 'source')
+        self.metrics.watch(self.destination, 'destination')
+
+        self.output()
+
+        #: gmail mode
+        if args.gmail:
+            self.output('Gmail mode                  : ', end='', flush=True)
+            if not self.source.has_capability('X-GM-EXT-1'):
+                self.output(f'{self.colorize("Error:", color="red", bold=True)} the source does not support X-GM-EXT-1')
+                raise MigrationError('Please fix the errors above.')
+
+            self.gmail_destination = self.destination.has_capability('X-GM-EXT-1')
+            if self.gmail_destination:
+                self.output(f'{self.colorize("OK", color="green")} (labels are added on the destination)')
+            else:
+                self.output(f'{self.colorize("OK", color="green")} (mails are uploaded to each folder of their labels)')
+            self.output()
+
+        #: connecting workers
+        if args.workers > 1:
+            self.output(f'Connecting workers          : {args.workers - 1} additional connection pairs, ', end='',
+                        flush=True)
+            for _ in range(args.workers - 1):
+                worker_source, status = self.connect_server(args.source_server, self.source_port,
+                                                            args.source_encryption)
+                worker_source_login_ok, status = self.login_client(worker_source, args.source_user, args.source_pass)
+                if worker_source_login_ok:
+                    worker_destination, status = self.connect_server(args.destination_server, self.destination_port,
+                                                                     args.destination_encryption)
+                    worker_destination_login_ok, status = self.login_client(worker_destination, args.destination_user,
+                                                                            args.destination_pass)
+                if not worker_source_login_ok or not worker_destination_login_ok:
+                    self.output(status)
+                    raise MigrationError('Please fix the errors above.')
+                self.enable_compression(worker_source, f'source worker {len(self.worker_connections) + 1}')
+                self.enable_compression(worker_destination, f'destination worker {len(self.worker_connections) + 1}')
+                self.metrics.watch(worker_source, f'source worker {len(self.worker_connections) + 1}')
+                self.metrics.watch(worker_destination, f'destination worker {len(self.worker_connections) + 1}')
+                self.worker_connections.append((worker_source, worker_destination))
+            self.output(self.colorize('OK', color='green'))
+            self.output()
+
+        #: the connections idle while they are not used, a single thread restarts the idle mode of all of them
+        self.output('Keepalive                   : ', end='', flush=True)
+        self.source_idle = IMAPIdle(self.source, interval=args.idle_interval)
+        self.destination_idle = IMAPIdle(self.destination, interval=args.idle_interval)
+        self.connection_pairs = [(self.source, self.destination, self.source_idle, self.destination_idle)]
+
+        #: the worker connections are not needed until the transfer starts, so they idle the whole time
+        for worker_source, worker_destination in self.worker_connections:
+            worker_source_idle = IMAPIdle(worker_source, interval=args.idle_interval)
+            worker_destination_idle = IMAPIdle(worker_destination, interval=args.idle_interval)
+            worker_source_idle.start_idle()
+            worker_destination_idle.start_idle()
+            self.connection_pairs.append((worker_source, worker_destination, worker_source_idle,
+                                          worker_destination_idle))
+        self.output(f'{self.colorize("OK", color="green")} (restarts every {args.idle_interval} seconds)')
+
+        self.output()
+
+    @phase('quota')
+    def check_quota(self):
+        """
+            check if the source fits into the quota of the destination
+            raises a MigrationError if it does not (and the quota is not ignored)
+        """
+        #: get quota from source
+        self.output('Getting source quota        : ', end='', flush=True)
+        logging.info(f'Getting source quota...')
+        source_quota, source_quota_usage, source_quota_limit, source_quota_filled = self.get_quota(self.source)
+        if source_quota:
+            self.output(f'{source_quota_usage}/{source_quota_limit} ({source_quota_filled}%)')
+        else:
+            self.output('server does not support quota')
+
+        #: get quota from destination
+        self.output('Getting destination quota   : ', end='', flush=True)
+        logging.info(f'Getting destination quota...')
+        destination_quota, destination_quota_usage, destination_quota_limit, destination_quota_filled = \
+            self.get_quota(self.destination)
+        if destination_quota:
+            self.output(f'{source_quota_usage}/{source_quota_limit} ({source_quota_filled}%)')
+        else:
+            destination_quota = None
+            self.output('server does not support quota')
+
+        #: checking quota
+        self.output('Checking quota              : ', end='', flush=True)
+        source_usage = source_quota.usage if source_quota else None
+        if source_usage is None and destination_quota and self.source.has_capability('STATUS=SIZE'):
+            #: without quota, the usage of the source is the size of all of its folders
+            source_usage = sum([status[b'SIZE'] for _, _, _, status in folder_statuses(self.source) if status]) // 1024
+
+        if source_usage is not None and destination_quota:
+            destination_quota_free = destination_quota.limit - destination_quota.usage
+            if destination_quota_free < source_usage:
+                self.output(f'{self.colorize("Error:", bold=True, color="cyan")} Insufficient quota: The source usage '
+                            f'is {source_usage} KB but there only {destination_quota_free} KB free on the destination '
+                            f'server', end='', flush=True)
+                if self.args.ignore_quota:
+                    self.output(' (ignoring)')
+                else:
+                    self.output()
+                    raise MigrationError('Insufficient quota')
+            else:
+                self.output(self.colorize('OK', color='green'))
+        else:
+            self.output('could not check quota')
+
+        self.output()
+
+    @phase('list')
+    def list(self):
+        """
+            query the folders of the source and the destination by STATUS, without scanning them (list mode)
+            returns a dict with a list of folders ({'name': ..., 'mails': ..., 'size': ...}) for each side
+        """
+        return {'source': self.list_folders(self.source, self.args.source_folder),
+                'destination': self.list_folders(self.destination, self.args.source_folder,
+                                                 self.args.destination_root or '')}
+
+    def scan(self):
+        """
+            scan the source folders (only mails that may have to be copied) and the destination folders
+        """
+        args = self.args
+        db = self.db
+        self.destination_idle.start_idle()
+        self.scan_source_folders()
+
+        #: count how often each mail exists in the source, so only mails that are used again are cached
+        #: in gmail mode the cache is always used, so each mail is downloaded only once
+        if (args.cache_size or args.gmail) and not args.dry_run:
+            self.mail_cache = MailCache(Counter([cache_key(mail) for folder in db['source']['folders'].values()
+                                                 for mail in folder['mails'].values()]),
+                                        args.cache_size or GMAIL_CACHE_SIZE, args.cache_disk_size)
+
+        self.destination_idle.stop_idle()
+        self.source_idle.start_idle()
+        self.scan_destination_folders()
+
+    @phase('source_scan')
+    def scan_source_folders(self):
+        """
+            get the source folders and scan the mails that may have to be copied
+        """
+        args = self.args
+        db = self.db
+
+        #: get source folders
+        self.output(self.colorize('Getting source folders      : loading (this can take a while)', clear=True),
+                    flush=True, end='')
+        logging.info('Getting source folders (this can take a while)')
+        for flags, separator, name in self.source.list_folders():
+            if not self.source_separator:
+                self.source_separator = separator.decode()
+
+            if args.source_folder:
+                if name not in args.source_folder and name.startswith(self.wildcards) is False:
+                    self.output(self.colorize(f'Getting source folders      : Progressing '
+                                              f'({self.stats["source_mails"]} mails) (skipping): {name}', clear=True),
+                                flush=True, end='')
+                    continue
+            self.source_folders.append(name)
+
+            try:
+                select_info = self.source.select_folder(name, readonly=True)
+            except Exception as e:
+                error_information = {'size': 'unknown',
+                                     'subject': 'unknown',
+                                     'exception': str(e),
+                                     'folder': name,
+                                     'date': 'unknown',
+                                     'id': 'unknown'}
+                self.stats['skipped_folders']['no_parent'] += 1
+                self.stats['errors'].append(error_information)
+                continue
+
+            uidvalidity = select_info[b'UIDVALIDITY']
+            folder_state = self.state.get_folder(name) if self.state and args.incremental else None
+
+            if args.resume and self.checkpoint.is_finished(name, uidvalidity):
+                self.output(self.colorize(f'Getting source folders      : Progressing ({self.stats["source_mails"]} '
+                                          f'mails) (finished): {name}', clear=True), flush=True, end='')
+                continue
+
+            if folder_state and folder_state['uidvalidity'] == uidvalidity:
+                #: only mails above the high-water mark which were not copied yet have to be scanned
+                high_water_mark = folder_state['high_water_mark']
+                copied_uids = self.state.copied_uids(name, high_water_mark)
+                mails = [mail_id for mail_id in self.source.search(['UID', f'{high_water_mark + 1}:*'])
+                         if mail_id > high_water_mark and mail_id not in copied_uids]
+            else:
+                folder_state = None
+                high_water_mark = 0
+                mails = self.source.search()
+
+            if args.resume:
+                mails = [mail_id for mail_id in mails if not self.checkpoint.is_done(name, uidvalidity, mail_id)]
+
+            if not mails and args.skip_empty_folders:
+                continue
+
+            #: the UIDNEXT and HIGHESTMODSEQ (CONDSTORE) of the scan are used to follow the changes after the copy
+            db['source']['folders'][name] = {'flags': flags,
+                                             'mails': {},
+                                             'size': 0,
+                                             'pending': [],
+                                             'uidvalidity': uidvalidity,
+                                             'state': folder_state,
+                                             'high_water_mark': max(mails + [high_water_mark]),
+                                             'uidnext': select_info.get(b'UIDNEXT',
+                                                                        max(mails + [high_water_mark]) + 1),
+                                             'highestmodseq': select_info.get(b'HIGHESTMODSEQ'),
+                                             'copies': {}}
+            self.scan_source_folder(self.source, name, mails)
+
+        self.output(self.colorize(f'Getting source folders      : {self.stats["source_mails"]} mails in '
+                                  f'{len(db["source"]["folders"])} folders '
+                                  f'({beautysized(sum([f["size"] for f in db["source"]["folders"].values()]))}) ',
+                                  clear=True), end='')
+        if any((args.source_folder, args.destination_root)):
+            self.output(f'({self.colorize("filtered by arguments", color="yellow")})', end='')
+        self.output()
+
+    @phase('destination_scan')
+    def scan_destination_folders(self):
+        """
+            get the destination folders and scan their mails (unless the state database or the checkpoint makes it
+            unnecessary)
+        """
+        args = self.args
+        db = self.db
+
+        #: get destination folders
+        self.output(self.colorize('Getting destination folders : loading (this can take a while)', clear=True),
+                    flush=True, end='')
+        logging.info('Getting destination folders (this can take a while)')
+        for flags, separator, name in self.destination.list_folders(args.destination_root):
+
+            if not self.destination_separator:
+                self.destination_separator = separator.decode()
+
+            #: no need to process the source destination mailbox if we skipped the source for it
+            if args.source_folder:
+                if name not in args.source_folder and name.startswith(self.wildcards) is False:
+                    self.output(self.colorize('Getting source folders      : Progressing ({} mails) (skipping): {}'.
+                                              format(self.stats['source_mails'], name), clear=True), flush=True,
+                                end='')
+                    continue
+
+            #: msg_ids counts the Message-IDs of the folder, so the incremental mode can look them up without a full
+            #: scan
+            db['destination']['folders'][name] = {'flags': flags, 'mails': {}, 'size': 0, 'msg_ids': Counter(),
+                                                  'scanned': False}
+
+            #: with a state database (or when resuming) the folder is only scanned later if the incremental mode
+            #: needs it
+            if (self.state and args.incremental) or args.resume:
+                db['destination']['folders'][name]['uidvalidity'] = \
+                    self.destination.select_folder(name, readonly=True)[b'UIDVALIDITY']
+                continue
+
+            self.scan_destination_folder(self.destination, name)
+
+        self.output(self.colorize('Getting destination folders : {} mails in {} folders ({}) '.
+                                  format(self.stats['destination_mails'], len(db['destination']['folders']),
+                                         beautysized(sum([f['size'] for f in db['destination']['folders'].values()]))),
+                                  clear=True), end='')
+        if any((args.source_folder, args.destination_root)):
+            self.output(f'({self.colorize("filtered by arguments", color="yellow")})', end='')
+        self.output('\n')
+
+    @phase('plan')
+    def plan(self):
+        """
+            map each scanned source folder to its destination folder by the separators, the destination root, the
+            special folder flags and the redirections
+            returns the mapping (source folder -> destination folder), raises a MigrationError if a redirection is
+            invalid
+        """
+        args = self.args
+        db = self.db
+
+        #: redirections
+        self.redirections = {}
+        not_found = []
+        if args.redirect:
+            for redirection in args.redirect:
+                try:
+                    r_source, r_destination = redirection.split(':', 1)
+
+                    #: parsing wildcards
+                    if r_source.endswith('*'):
+                        wildcard_matches = [f for f in self.source_folders if f.startswith(r_source[:-1])]
+                        if wildcard_matches:
+                            for folder in wildcard_matches:
+                                self.redirections[folder] = r_destination
+                        else:
+                            not_found.append(r_source)
+                    #: the listed folders, as a finished (--resume) or empty folder is not scanned
+                    elif r_source not in self.source_folders:
+                        not_found.append(r_source)
+
+                except ValueError:
+                    raise MigrationError(f'Could not parse redirection: "{redirection}"')
+                else:
+                    self.redirections[r_source] = r_destination
+
+        if not_found:
+            raise MigrationError(f'Source folder not found: {", ".join(not_found)}')
+
+        self.mapping = {}
+        for sf_name in sorted(db['source']['folders'], key=lambda x: x.lower()):
+            df_name = sf_name.replace(self.source_separator, self.destination_separator)
+
+            if args.destination_root:
+                if args.destination_root_merge is False or \
+                        (df_name.startswith(f'{args.destination_root}{self.destination_separator}') is False
+                         and df_name != args.destination_root):
+                    df_name = f'{args.destination_root}{self.destination_separator}{df_name}'
+
+            #: link special IMAP folder
+            if not args.ignore_folder_flags:
+                for sf_flag in db['source']['folders'][sf_name]['flags']:
+                    if sf_flag in SPECIAL_FOLDER_FLAGS:
+                        for name in db['destination']['folders']:
+                            if sf_flag in db['destination']['folders'][name]['flags']:
+                                df_name = name
+                                break
+
+            #: custom links
+            if sf_name in self.redirections:
+                df_name = self.redirections[sf_name]
+
+            self.mapping[sf_name] = df_name
+        return self.mapping
+
+    @phase('transfer')
+    def transfer(self):
+        """
+            create the destination folders of the plan and copy the mails into them
+            raises a KeyboardInterrupt if the transfer was aborted
+        """
+        args = self.args
+        db = self.db
+        source, destination = self.source, self.destination
+        self.source_idle.stop_idle()
+
+        for sf_name, df_name in self.mapping.items():
+            #: the state of a source folder is only valid if its mails were copied into the same destination folder
+            folder_state = db['source']['folders'][sf_name]['state']
+            if folder_state and (df_name not in db['destination']['folders'] or
+                                 folder_state['destination_folder'] != df_name or
+                                 folder_state['destination_uidvalidity'] !=
+                                 db['destination']['folders'][df_name]['uidvalidity']):
+                with self.metrics.phase('source_scan'):
+                    self.rescan_source_folder(source, sf_name)
+                self.output(self.colorize(f'Getting source folders      : {sf_name} rescanned (state database is '
+                                          f'outdated)', clear=True))
+
+            if args.incremental and not db['source']['folders'][sf_name]['state'] and \
+                    df_name in db['destination']['folders'] and not db['destination']['folders'][df_name]['scanned']:
+                with self.metrics.phase('destination_scan'):
+                    self.scan_destination_folder(destination, df_name)
+                self.output(self.colorize(f'Getting destination folders : {df_name} scanned (no state for {sf_name})',
+                                          clear=True))
+
+            if df_name in db['destination']['folders']:
+                self.output('Current folder: {} ({} mails, {}) -> {} ({} mails, {})'.format(
+                    sf_name, len(db['source']['folders'][sf_name]['mails']),
+                    beautysized(db['source']['folders'][sf_name]['size']), df_name,
+                    len(db['destination']['folders'][df_name]['mails']),
+                    beautysized(db['destination']['folders'][df_name]['size'])))
+
+                self.stats['skipped_folders']['already_exists'] += 1
+
+            else:
+                self.output('Current folder: {} ({} mails, {}) -> {} (non existing)'.format(
+                    sf_name, len(db['source']['folders'][sf_name]['mails']),
+                    beautysized(db['source']['folders'][sf_name]['size']), df_name))
+
+                #: creating non-existing folders
+                if not args.dry_run:
+                    self.output('Creating...', end='', flush=True)
+
+                    if args.skip_empty_folders and not db['source']['folders'][sf_name]['mails']:
+                        self.stats['skipped_folders']['empty'] += 1
+                        self.output('{} \n'.format(self.colorize('Skipped! (skip-empty-folders mode)', color='cyan')))
+                        continue
+                    else:
+                        try:
+                            with self.metrics.phase('folder_creation'):
+                                self.retry(source, destination, self.create_folder, destination, df_name)
+                            db['destination']['folders'][df_name] = {'flags': (), 'mails': {}, 'size': 0,
+                                                                     'msg_ids': Counter(), 'scanned': True}
+                            self.stats['copied_folders'] += 1
+                            self.output(self.colorize('OK', color='green'))
+
+                        except exceptions.IMAPClientError as e:
+                            if 'alreadyexists' in str(e).lower():
+                                self.stats['skipped_folders']['already_exists'] += 1
+                                self.output('{} \n'.format(self.colorize('Skipped! (already exists)', color='cyan')))
+                            else:
+                                e = imaperror_decode(e)
+                                self.output('{} {}\n'.format(self.colorize('Error:', color='red', bold=True), e))
+                                if args.abort_on_error:
+                                    raise KeyboardInterrupt
+                                continue
+            if args.dry_run:
+                continue
+
+            if self.state:
+                if 'uidvalidity' not in db['destination']['folders'][df_name]:
+                    db['destination']['folders'][df_name]['uidvalidity'] = \
+                        destination.folder_status(df_name, [b'UIDVALIDITY'])[b'UIDVALIDITY']
+
+                #: without a valid state all mails of the folder were scanned, so the old state is no longer needed
+                if not db['source']['folders'][sf_name]['state']:
+                    self.state.reset_folder(sf_name)
+                self.state.set_folder(sf_name, db['source']['folders'][sf_name]['uidvalidity'], df_name,
+                                      db['destination']['folders'][df_name]['uidvalidity'])
+
+                #: flags of mails copied by previous runs which were changed since then
+                folder_state = db['source']['folders'][sf_name]['state']
+                if args.incremental and folder_state and folder_state['highest_modseq'] and \
+                        db['source']['folders'][sf_name]['highestmodseq']:
+                    updated = self.retry(source, destination, self.sync_flags, source, destination, sf_name, df_name,
+                                         folder_state['highest_modseq'])
+                    if updated:
+                        self.output(f'Synced flags: {updated} mails')
+
+            db['source']['folders'][sf_name]['df_name'] = df_name
+            self.select_mails(sf_name, df_name)
+
+            #: large folders are split into parts, so multiple workers can copy them at once
+            parts = self.split_folder(sf_name, df_name, args.workers)
+            db['source']['folders'][sf_name]['parts_left'] = len(parts)
+            db['source']['folders'][sf_name]['errors'] = 0
+
+            if args.workers > 1:
+                for part in parts:
+                    self.jobs.put(part)
+                continue
+
+            self.transfer_folder(source, destination, parts[0])
+
+        if args.workers > 1:
+            self.run_workers(self.jobs)
+
+    @phase('follow')
+    def follow(self):
+        """
+            keep the destination in sync after the transfer until the process is interrupted (follow mode)
+        """
+        self.output(self.colorize('Initial copy finished!', clear=True))
+        self.follow_changes(self.source, self.destination, self.source_idle, self.destination_idle)
+
+    def close(self):
+        """
+            stop the keepalive, logout all connections and close the state database, the mail cache and the
+            checkpoint
+        """
+        #: stop the keepalive
+        for _, _, pair_source_idle, pair_destination_idle in self.connection_pairs:
+            pair_source_idle.exit()
+            pair_destination_idle.exit()
+            pair_source_idle.stop_idle()
+            pair_destination_idle.stop_idle()
+
+        if self.state:
+            self.state.close()
+
+        if self.mail_cache:
+            self.mail_cache.close()
+
+        if self.checkpoint:
+            self.checkpoint.save(force=True)
+
+        #: logout workers
+        for worker_source, worker_destination in self.worker_connections:
+            for client in (worker_source, worker_destination):
+                try:
+                    client.logout()
+                except exceptions.IMAPClientError:
+                    pass
+
+        #: logout source
+        if self.source:
+            try:
+                self.output('Logout source...', end='', flush=True)
+                self.source.logout()
+                self.output(self.colorize('OK', color='green'))
+            except exceptions.IMAPClientError as e:
+                self.output(f'ERROR: {imaperror_decode(e)}')
+
+        #: logout destination
+        if self.destination:
+            try:
+                self.output('Logout destination...', end='', flush=True)
+                self.destination.logout()
+                self.output(self.colorize('OK', color='green'))
+            except exceptions.IMAPClientError as e:
+                self.output(f'ERROR: {imaperror_decode(e)}')
+
+        self.metrics.stop()
+
+    @phase('connect')
+    def connect_server(self, server, port, encryption):
+        """
+            connect to the server with the right ssl_context in case of encryption
+            returns a client handle if connected and None if not
+        """
+        use_ssl = False
+        ssl_context = None  # IMAPClient will use a context by default if ssl_context is None
+
+        if encryption in ['tls', 'ssl']:
+            use_ssl = True
+
+        if self.args.ssl_no_verify:
+            import ssl
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+        try:
+            client = Connection(IMAPClient(host=server, port=port, ssl=use_ssl, ssl_context=ssl_context))
+            if encryption == 'starttls':
+                client.starttls(ssl_context=ssl_context)
+                client_status = f'{self.colorize("OK", color="green")} ({self.colorize("STARTTLS", color="green")})'
+
+            elif encryption in ['ssl', 'tls']:
+                client_status = f'{self.colorize("OK", color="green")} ({self.colorize("SSL/TLS", color="green")})'
+
+            else:
+                client_status = f'{self.colorize("OK", color="green")} ' \
+                                f'({self.colorize("NOT ENCRYPTED", color="yellow")})'
+
+            return client, client_status
+
+        except Exception as e:
+            client_status = f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}'
+            return None, client_status
+
+    @phase('login')
+    def login_client(self, client, user, password):
+        """
+            login the client with the given username and password
+        """
+        if client:
+            try:
+                client.login(user, password)
+                return True, self.colorize('OK', color='green')
+            except Exception as e:
+                return False, f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}'
+        else:
+            return False, f'{self.colorize("Error:", color="red", bold=True)} No active connection'
+
+    def reconnect(self, client, side, error, retries=0):
+        """
+            replace the broken IMAPClient of the connection (see Connection) by a new one. it waits reconnect_delay
+            seconds before, doubled for each reconnect in a row (retries). the new client is logged in, compressed and
+            measured like the old one, a folder has to be selected again.
+            returns retries increased by the attempts, raises a MigrationError after reconnect_retries attempts
+        """
+        args = self.args
+        if client is self.source or client is self.destination:
+            name = side
+        else:
+            name = f'{side} worker {[client in pair for pair in self.worker_connections].index(True) + 1}'
+        server, port, encryption, user, password = \
+            (args.source_server, self.source_port, args.source_encryption, args.source_user, args.source_pass) \
+            if side == 'source' else (args.destination_server, self.destination_port, args.destination_encryption,
+                                      args.destination_user, args.destination_pass)
+
+        if is_throttled(error):
+            with self.lock:
+                self.stats['throttled'] += 1
+
+        start = time()
+        try:
+            client.shutdown()
+        except Exception:
+            pass
+
+        try:
+            with self.metrics.phase('reconnect'):
+                while retries < args.reconnect_retries:
+                    delay = args.reconnect_delay * 2 ** retries
+                    retries += 1
+                    with self.lock:
+                        self.output(self.colorize(f'Connection lost: {name} ({imaperror_decode(error)}), reconnecting '
+                                                  f'in {delay:g}s ({retries}/{args.reconnect_retries})...',
+                                                  color='yellow', clear=True))
+                    sleep(delay)
+
+                    new_client, status = self.connect_server(server, port, encryption)
+                    login_ok, status = self.login_client(new_client, user, password)
+                    if not login_ok:
+                        error = status
+                        continue
+
+                    #: the new client takes the place of the broken one
+                    client.client = new_client.client
+                    self.enable_compression(client, name)
+                    self.metrics.watch(client, name)
+                    with self.lock:
+                        self.stats['reconnects'] += 1
+                    return retries
+        finally:
+            with self.lock:
+                self.stats['reconnect_time'] += time() - start
+
+        if not args.reconnect_retries:
+            raise MigrationError(f'Connection lost: {name} ({imaperror_decode(error)})')
+        raise MigrationError(f'Could not reconnect the {name} after {args.reconnect_retries} attempts: '
+                             f'{imaperror_decode(error)}')
+
+    def retry(self, source, destination, function, *args):
+        """
+            call function with args until it did not raise a TransferInterrupted (like sync_flags()). the side that
+            failed is reconnected (or waited for) before each retry.
+            returns the result of function
+        """
+        retries = 0
+        while True:
+            try:
+                return function(*args)
+            except TransferInterrupted as e:
+                if isinstance(e, Throttled):
+                    retries = self.wait_throttled(e.side, e.error, retries)
+                else:
+                    retries = self.reconnect(source if e.side == 'source' else destination, e.side, e.error, retries)
+
+    def wait_throttled(self, side, error, retries=0):
+        """
+            wait after the side refused a command because of throttling. the delay and the limit of retries in a row
+            are the ones of a reconnect (reconnect_delay and reconnect_retries).
+            returns retries increased by one, raises a MigrationError after reconnect_retries retries
+        """
+        with self.lock:
+            self.stats['throttled'] += 1
+        if retries >= self.args.reconnect_retries:
+            raise MigrationError(f'Throttled by the {side}: {imaperror_decode(error)}')
+
+        delay = self.args.reconnect_delay * 2 ** retries
+        with self.lock:
+            self.output(self.colorize(f'Throttled: {side} ({imaperror_decode(error)}), retrying in {delay:g}s '
+                                      f'({retries + 1}/{self.args.reconnect_retries}, '
+                                      f'{self.throttles[side].status()})...', color='yellow', clear=True))
+        with self.metrics.phase('throttled'):
+            sleep(delay)
+        return retries + 1
+
+    def enable_compression(self, client, name):
+        """
+            compress the connection with COMPRESS=DEFLATE if the server supports it. the counters of a previous
+            connection with the same name (like before a reconnect) are kept.
+            returns the status message
+        """
+        if self.args.no_compression:
+            return 'disabled'
+        if not client.has_capability('COMPRESS=DEFLATE'):
+            return 'server does not support COMPRESS=DEFLATE'
+        try:
+            compression = Compression(client)
+        except exceptions.IMAPClientError as e:
+            return f'{self.colorize("Error:", color="red", bold=True)} {imaperror_decode(e)}'
+
+        with self.lock:
+            for i, (previous_name, previous) in enumerate(self.compressions):
+                if previous_name == name:
+                    compression.sent += previous.sent
+                    compression.sent_compressed += previous.sent_compressed
+                    compression.received += previous.received
+                    compression.received_compressed += previous.received_compressed
+                    self.compressions[i] = (name, compression)
+                    break
+            else:
+                self.compressions.append((name, compression))
+        return self.colorize('OK', color='green') + ' (DEFLATE)'
+
+    def get_quota(self, client):
+        """
+            returns the quota of the mailbox
+        """
+        if client.has_capability('QUOTA') and self.args.ignore_quota is False:
+            quota = client.get_quota()[0]
+            quota_usage = beautysized(quota.usage * 1000)
+            quota_limit = beautysized(quota.limit * 1000)
+            quota_filled = f'{quota.usage / quota.limit * 100:.0f}'
+            return quota, quota_usage, quota_limit, quota_filled
+        logging.info(f'Server does not support quota')
+        return None, None, None, None
+
+    def list_folders(self, client, names, directory=''):
+        """
+            returns name, number of mails and size of each folder of the client for the list mode
+        """
+        folders = []
+        for flags, _, name, status in folder_statuses(client, directory):
+            if names and name not in names and name.startswith(self.wildcards) is False:
+                continue
+            if status is None or (self.args.skip_empty_folders and not status[b'MESSAGES']):
+                continue
+            folders.append({'name': name, 'mails': status[b'MESSAGES'], 'size': folder_size(client, name, status)})
+        return folders
+
+    def scan_source_folder(self, client, name, mails):
+        """
+            fetch size, subject and Message-ID of the given mails of the (selected) source folder
+        """
+        while mails:
+            for mail_id, data in client.fetch(mails[:self.args.buffer_size], self.scan_fetch_data()).items():
+                if self.args.lean_scan:
+                    #: the subject is read from the mail itself while copying
+                    subject = None
+                    msg_id = lean_message_id(data)
+                elif b'ENVELOPE' not in data:  # Encountered message with no ENVELOPE? Skipping it
+                    self.stats['skipped_mails']['no_envelope'] += 1
+                    continue
+                else:
+                    #: the subject is decoded only if it is printed
+                    subject = data[b'ENVELOPE'].subject
+                    msg_id = data[b'ENVELOPE'].message_id
+
+                self.db['source']['folders'][name]['mails'][mail_id] = {'size': data[b'RFC822.SIZE'],
+                                                                        'subject': subject,
+                                                                        'msg_id': msg_id}
+                if self.args.gmail:
+                    self.db['source']['folders'][name]['mails'][mail_id]['gm_msgid'] = data.get(b'X-GM-MSGID')
+
+                self.db['source']['folders'][name]['size'] += data[b'RFC822.SIZE']
+                self.stats['source_mails'] += 1
+
+                self.output(self.colorize('Getting source folders      : Progressing ({} mails): {}'.
+                                          format(self.stats['source_mails'], name), clear=True), flush=True, end='')
+
+            del mails[:self.args.buffer_size]
+
+    def scan_fetch_data(self):
+        """
+            returns the data items fetched for each mail by the source scan
+        """
+        if not self.args.lean_scan:
+            fetch_data = ['RFC822.SIZE', 'ENVELOPE']
+        elif self.args.incremental or self.args.cache_size:
+            fetch_data = ['RFC822.SIZE', LEAN_MESSAGE_ID]
+        else:
+            fetch_data = ['RFC822.SIZE']
+
+        if self.args.gmail:
+            fetch_data.append('X-GM-MSGID')
+        return fetch_data
+
+    def mail_subject(self, mail, msg=None):
+        """
+            returns the decoded subject of a scanned mail. in lean scan mode the subject is read from msg.
+        """
+        subject = mail['subject']
+        if subject is None and self.args.lean_scan and msg:
+            subject = get_header(msg.head if isinstance(msg, SpooledMail) else msg, b'Subject')
+        if subject:
+            return decode_mime(subject)
+        return '(no subject)'
+
+    def skipped_subject(self, mail):
+        """
+            returns ": <subject>" of a skipped mail for the output. it is left out if nothing is printed and in lean
+            scan mode (the subject is only read from the mail, which is not downloaded).
+        """
+        if self.quiet or self.args.lean_scan:
+            return ''
+        return f': {self.mail_subject(mail)}'
+
+    def rescan_source_folder(self, client, name):
+        """
+            scan all mails of the source folder again, e.g. if its state in the state database is outdated
+        """
+        self.stats['source_mails'] -= len(self.db['source']['folders'][name]['mails'])
+        self.db['source']['folders'][name].update({'mails': {}, 'size': 0, 'pending': [], 'state': None})
+
+        client.select_folder(name, readonly=True)
+        mails = client.search()
+        self.db['source']['folders'][name]['high_water_mark'] = max(mails + [0])
+        self.scan_source_folder(client, name, mails)
+
+    def scan_destination_folder(self, client, name):
+        """
+            fetch the size (and the Message-ID in incremental mode) of all mails in the destination folder
+        """
+        self.db['destination']['folders'][name]['uidvalidity'] = \
+            client.select_folder(name, readonly=True)[b'UIDVALIDITY']
+        self.db['destination']['folders'][name]['scanned'] = True
+        mails = client.search()
+
+        fetch_data = ['RFC822.SIZE']
+        if self.args.incremental:
+            fetch_data.append(LEAN_MESSAGE_ID if self.args.lean_scan else 'ENVELOPE')
+
+        while mails:
+            for mail_id, data in client.fetch(mails[:self.args.buffer_size], fetch_data).items():
+                self.db['destination']['folders'][name]['mails'][mail_id] = {'size': data[b'RFC822.SIZE']}
+                self.db['destination']['folders'][name]['size'] += data[b'RFC822.SIZE']
+
+                if self.args.incremental:
+                    msg_id = lean_message_id(data) if self.args.lean_scan else data[b'ENVELOPE'].message_id
+                    self.db['destination']['folders'][name]['mails'][mail_id]['msg_id'] = msg_id
+
+                    #: mails without a Message-ID can't be compared, so they never count as already existing
+                    if msg_id:
+                        self.db['destination']['folders'][name]['msg_ids'][msg_id] += 1
+
+                self.stats['destination_mails'] += 1
+                self.output(self.colorize('Getting destination folders : Progressing ({} mails): {}'.
+                                          format(self.stats['destination_mails'], name), clear=True), flush=True,
+                            end='')
+            del mails[:self.args.buffer_size]
+
+    def append_mails(self, destination, df_name, mails):
+        """
+            append the mails to the destination folder
+            if the server supports MULTIAPPEND (RFC 3502) all mails are uploaded with a single command. IMAPClient sends
+            them as non-synchronizing literals if LITERAL+ (RFC 7888) is supported too.
+            returns a list of (exception, uid) tuples. the exception is None for each copied mail and the uid is None if
+            the server did not return it (UIDPLUS)
+            raises a ConnectionLost (or Throttled) with the results so far if the connection broke (or the server
+            throttles)
+        """
+        throttle = self.throttles['destination']
+        if len(mails) > 1 and destination.has_capability('MULTIAPPEND'):
+            try:
+                with throttle.command(sum([mail['size'] for mail in mails])):
+                    typ, data = destination.multiappend(df_name, [{'msg': mail['msg'], 'flags': mail['flags'],
+                                                                  'date': mail['date']} for mail in mails])
+                    if typ != 'OK' and data and is_throttled(data[0]):
+                        raise Throttled('destination', data[0])
+                #: the texts of the OK responses differ (like "Completed" of Cyrus), every mail was stored anyway
+                if typ == 'OK':
+                    _, uids = parse_appenduid(data[0] if data else b'')
+                    if len(uids) != len(mails):
+                        uids = [None] * len(mails)
+                    return [(None, uid) for uid in uids]
+            except (exceptions.IMAPClientError, OSError) as e:
+                if connection_lost(e):
+                    raise ConnectionLost('destination', e)
+                if is_throttled(e):
+                    raise Throttled('destination', e)
+                logging.info(f'MULTIAPPEND failed: {imaperror_decode(e)}')
+
+            #: the MULTIAPPEND was refused (NO or BAD). it is atomic, so nothing was stored. retrying one by one shows
+            #: which mails are failing.
+
+        results = []
+        for mail in mails:
+            try:
+                #: a streamed mail is sent in chunks from a temporary file, its latency is not measured
+                with throttle.command(mail['size'], measured=not isinstance(mail['msg'], SpooledMail)):
+                    if isinstance(mail['msg'], SpooledMail):
+                        status = append_mail(destination, df_name, mail['msg'], mail['flags'], msg_time=mail['date'],
+                                             chunk_size=self.args.stream_size)
+                    else:
+                        status = destination.append(df_name, mail['msg'], mail['flags'], msg_time=mail['date'])
+                if append_succeeded(status):
+                    _, uids = parse_appenduid(status)
+                    results.append((None, uids[0] if uids else None))
+                else:
+                    raise exceptions.IMAPClientError(f'Unknown success message: {status.decode()}')
+
+            except (exceptions.IMAPClientError, OSError) as e:
+                if connection_lost(e):
+                    raise ConnectionLost('destination', e, results)
+                if is_throttled(e):
+                    raise Throttled('destination', e, results)
+                results.append((e, None))
+                if self.args.abort_on_error:
+                    break
+        return results
+
+    def select_mails(self, sf_name, df_name):
+        """
+            select the scanned mails of the source folder that have to be copied. mails which would be skipped anyway
+            (zero sized, too large or already existing) are left out, so they are never downloaded.
+        """
+        folder = self.db['source']['folders'][sf_name]
+        mails = []
+        skipped = []
+        existing = []
+
+        for mail_id in sorted(folder['mails']):
+            mail = folder['mails'][mail_id]
+
+            #: skip empty mails / zero sized
+            if mail['size'] == 0:
+                self.stats['skipped_mails']['zero_size'] += 1
+                self.output(self.colorize(f'Skipped! (zero sized){self.skipped_subject(mail)}', color='cyan'))
+
+            #: skip too large mails
+            elif self.args.max_mail_size and mail['size'] > self.args.max_mail_size:
+                self.stats['skipped_mails']['max_size'] += 1
+                self.output(self.colorize(f'Skipped! (too large) ({beautysized(mail["size"])})'
+                                          f'{self.skipped_subject(mail)}', color='cyan'))
+
+            #: skip mails that already exist
+            elif self.args.incremental and mail['msg_id'] and df_name in self.db['destination']['folders'] and \
+                    self.db['destination']['folders'][df_name]['msg_ids'][mail['msg_id']] > 0:
+                self.stats['skipped_mails']['already_exists'] += 1
+                existing.append((mail_id, None))
+
+            else:
+                mails.append(mail_id)
+                continue
+
+            self.stats['processed'] += 1
+            skipped.append(mail_id)
+
+        if self.state and existing:
+            self.state.add_mails(sf_name, df_name, existing)
+        if self.checkpoint and skipped:
+            self.checkpoint.add(sf_name, folder['uidvalidity'], skipped)
+
+        folder['pending'] = mails
+
+    def is_streamed(self, sf_name, mail_id):
+        """
+            returns True if the mail is large enough to be streamed in chunks
+        """
+        return bool(self.args.stream_size) and \
+            self.db['source']['folders'][sf_name]['mails'][mail_id]['size'] > self.args.stream_size
+
+    def fetch_buffer(self, client, sf_name, buffer, sizer):
+        """
+            fetch flags, date and content of all mails in the buffer. a large mail is fetched in chunks into a temporary
+            file instead. the fetch time of a buffer adjusts the byte budget of the following buffers.
+            the content of mails which were already downloaded for another folder is taken from the mail cache.
+        """
+        mails = self.db['source']['folders'][sf_name]['mails']
+        if len(buffer) == 1 and self.is_streamed(sf_name, buffer[0]):
+            return fetch_mail(client, buffer[0], self.args.stream_size, self.args.max_line_length)
+
+        cached = {}
+        if self.mail_cache:
+            for mail_id in buffer:
+                msg = self.mail_cache.get(cache_key(mails[mail_id]))
+                if msg is not None:
+                    cached[mail_id] = msg
+        uncached = [mail_id for mail_id in buffer if mail_id not in cached]
+
+        result = {}
+        if uncached:
+            start = time()
+            try:
+                result = client.fetch(uncached, ['FLAGS', 'RFC822', 'INTERNALDATE'])
+            except Exception:
+                sizer.failed()
+                raise
+            sizer.update(sum([mails[mail_id]['size'] for mail_id in uncached]), time() - start)
+
+            if self.mail_cache:
+                for mail_id, data in result.items():
+                    if b'RFC822' in data and self.mail_cache.wanted(cache_key(mails[mail_id])):
+                        self.mail_cache.add(cache_key(mails[mail_id]), data[b'RFC822'])
+
+        #: flags and date may differ between the folders, so only the content is cached
+        if cached:
+            for mail_id, data in client.fetch(list(cached), ['FLAGS', 'INTERNALDATE']).items():
+                data[b'RFC822'] = cached[mail_id]
+                result[mail_id] = data
+
+        return {mail_id: result[mail_id] for mail_id in buffer if mail_id in result}
+
+    def split_folder(self, sf_name, df_name, count):
+        """
+            split the pending mails of a source folder into (up to) count parts of about the same size, each covering a
+            disjoint range of UIDs. a folder is only split if it fills more than one buffer.
+            returns a list of parts which can be transferred independently
+        """
+        folder = self.db['source']['folders'][sf_name]
+        sizes = [folder['mails'][mail_id]['size'] for mail_id in folder['pending']]
+        total = sum(sizes)
+        buffers = max(-(-len(sizes) // self.args.buffer_size) if self.args.buffer_size else 1,
+                      -(-total // self.args.buffer_bytes) if self.args.buffer_bytes else 1)
+        count = max(1, min(count, buffers))
+        parts = []
+
+        first = 0
+        done = 0
+        for i, size in enumerate(sizes):
+            done += size
+            if len(parts) < count - 1 and i + 1 < len(sizes) and done >= total * (len(parts) + 1) / count:
+                parts.append(folder['pending'][first:i + 1])
+                first = i + 1
+        parts.append(folder['pending'][first:])
+
+        parts = [{'sf_name': sf_name,
+                  'df_name': df_name,
+                  'mails': mails,
+                  'number': number,
+                  'processed': 0,
+                  'copied': 0,
+                  'errors': 0,
+                  'reserved': set()} for number, mails in enumerate(parts, start=1)]
+
+        for part in parts:
+            part['count'] = len(parts)
+        return parts
+
+    def label_mails(self, destination, part, mail_ids):
+        """
+            mails of a Gmail source that were already copied to another folder of a Gmail destination are not uploaded
+            again, instead the label of this folder is added to the existing copy. the other mails are reserved for
+            this part (a copy without uid), so parallel workers don't upload them as well.
+            returns the mails that still have to be copied and the mails another worker is uploading at the moment
+        """
+        sf_name, df_name = part['sf_name'], part['df_name']
+        folder_flags = self.db['destination']['folders'].get(df_name, {}).get('flags', ())
+
+        if df_name.upper() == 'INBOX':
+            label = '\\Inbox'
+        elif b'\\All' in folder_flags:
+            label = None  #: every mail is in "All Mail" anyway
+        elif any(flag in GMAIL_LABELS for flag in folder_flags):
+            label = GMAIL_LABELS[next(flag for flag in folder_flags if flag in GMAIL_LABELS)]
+        elif any(flag in SPECIAL_FOLDER_FLAGS for flag in folder_flags):
+            return sorted(mail_ids), []  #: like trash and spam, which are no labels
+        else:
+            label = df_name
+
+        mails = self.db['source']['folders'][sf_name]['mails']
+        remaining = []
+        deferred = []
+        copies = {}  #: destination folder -> [(source uid, destination uid)]
+        with self.lock:
+            for mail_id in mail_ids:
+                gm_msgid = mails[mail_id]['gm_msgid']
+                copy = self.gmail_copies.get(gm_msgid)
+                if copy is None or copy[0] == df_name:
+                    remaining.append(mail_id)
+                    if copy is None and gm_msgid:
+                        self.gmail_copies[gm_msgid] = (df_name, None)
+                        part['reserved'].add(gm_msgid)
+                elif copy[1] is None:
+                    deferred.append(mail_id)
+                else:
+                    copies.setdefault(copy[0], []).append((mail_id, copy[1]))
+
+        for copy_folder, labelled in copies.items():
+            if label:
+                try:
+                    destination.select_folder(copy_folder)
+                    destination.add_gmail_labels([uid for _, uid in labelled], [label], silent=True)
+                except exceptions.IMAPClientError as e:
+                    #: upload the mails instead
+                    logging.warning(f'Could not label mails in {copy_folder}: {imaperror_decode(e)}')
+                    remaining.extend([mail_id for mail_id, _ in labelled])
+                    continue
+
+            with self.lock:
+                self.stats['processed'] += len(labelled)
+                self.stats['copied_mails'] += len(labelled)
+                self.stats['labelled_mails'] += len(labelled)
+                part['processed'] += len(labelled)
+                part['copied'] += len(labelled)
+            if self.state:
+                self.state.add_mails(sf_name, df_name, labelled)
+            if self.checkpoint:
+                self.checkpoint.add(sf_name, self.db['source']['folders'][sf_name]['uidvalidity'],
+                                    [mail_id for mail_id, _ in labelled])
+
+        return sorted(remaining), deferred
+
+    def release_gmail_copies(self, part):
+        """
+            release the reservations of the mails of the part which were not uploaded (like skipped or failed mails),
+            so the workers waiting for them copy them on their own
+        """
+        with self.gmail_uploads:
+            for gm_msgid in part['reserved']:
+                if self.gmail_copies.get(gm_msgid) == (part['df_name'], None):
+                    del self.gmail_copies[gm_msgid]
+            part['reserved'].clear()
+            self.gmail_uploads.notify_all()
+
+    def gmail_buffers(self, source, destination, part, sizer):
+        """
+            yields the buffers of fetch_buffers() for a Gmail destination. mails which are uploaded by another worker
+            at the moment are labelled (or copied, if the other upload failed) after the other mails of the part.
+        """
+        mails = self.db['source']['folders'][part['sf_name']]['mails']
+
+        def uploading(mail_id):
+            copy = self.gmail_copies.get(mails[mail_id]['gm_msgid'])
+            return copy is not None and copy[1] is None
+
+        mail_ids = part['mails']
+        while mail_ids:
+            remaining, mail_ids = self.label_mails(destination, part, mail_ids)
+            yield from self.fetch_buffers(source, part['sf_name'], remaining, sizer)
+            #: this part holds no reservation while it waits, so two waiting workers can't block each other
+            self.release_gmail_copies(part)
+
+            with self.gmail_uploads:
+                self.gmail_uploads.wait_for(lambda: not any([uploading(mail_id) for mail_id in mail_ids]))
+
+    def fetch_buffers(self, source, sf_name, pending, sizer):
+        """
+            yields (buffer, fetched mails) tuples of the pending mails of the source folder. the next buffers are
+            fetched while the current one is copied, a streamed mail uses only stream_size bytes of memory.
+            if the source connection broke (or the source throttles), it is reconnected (or waited for) and the buffers
+            which were not yielded yet are fetched again.
+        """
+        mails = self.db['source']['folders'][sf_name]['mails']
+
+        def fetch(buffer):
+            start = time()
+            streamed = len(buffer) == 1 and self.is_streamed(sf_name, buffer[0])
+            with self.throttles['source'].command(sum([mails[mail_id]['size'] for mail_id in buffer]),
+                                                  measured=not streamed):
+                fetched = self.fetch_buffer(source, sf_name, buffer, sizer)
+            self.metrics.add_folder(sf_name, fetch_time=time() - start,
+                                    fetch_bytes=sum([mails[mail_id]['size'] for mail_id in fetched]))
+            return fetched
+
+        pending = list(pending)
+        retries = 0
+        while pending:
+            try:
+                source.select_folder(sf_name, readonly=True)
+                buffers = sizer.buffers(pending,
+                                        lambda mail_id: min(mails[mail_id]['size'],
+                                                            self.args.stream_size or mails[mail_id]['size']),
+                                        lambda mail_id: self.is_streamed(sf_name, mail_id))
+                for buffer, fetched in Prefetcher(fetch, buffers, self.args.prefetch_size):
+                    yield buffer, fetched
+                    #: the buffers are consecutive parts of the pending mails
+                    pending = pending[len(buffer):]
+                    retries = 0
+                return
+            except (exceptions.IMAPClientError, OSError) as e:
+                if connection_lost(e):
+                    retries = self.reconnect(source, 'source', e, retries)
+                elif is_throttled(e):
+                    retries = self.wait_throttled('source', e, retries)
+                else:
+                    raise
+
+    def transfer_folder(self, source, destination, part):
+        """
+            copy the mails of a folder part from the source folder to the destination folder by using the given
+            connections
+        """
+        sf_name, df_name = part['sf_name'], part['df_name']
+        mails = self.db['source']['folders'][sf_name]['mails']
+        part_info = f'(part {part["number"]}/{part["count"]}) ' if part['count'] > 1 else ''
+
+        #: every connection learns its own buffer size
+        with self.lock:
+            sizer = self.sizers.setdefault(source, BufferSizer(self.args.buffer_bytes, self.args.buffer_size))
+
+        if self.gmail_destination:
+            buffers = self.gmail_buffers(source, destination, part, sizer)
+        else:
+            buffers = self.fetch_buffers(source, sf_name, part['mails'], sizer)
+
+        for buffer_counter, (buffer, fetched) in enumerate(buffers):
+            if self.abort.is_set():
+                raise KeyboardInterrupt
+
+            with self.lock:
+                self.output(self.colorize('[{:>5.1f}%] Progressing... {}(loading buffer {})'.format(
+                    self.progress, part_info, buffer_counter+1), clear=True), end='')
+
+            batch = []
+            copied = []  #: (source uid, destination uid) tuples for the state database
+            done = []  #: source uids processed without an error for the checkpoint
+            for i, fetch in enumerate(fetched.items()):
+                mail_id, data = fetch
+
+                #: placeholders, so we can still attempt to use them in error reporting
+                flags = msg = date = size = "(unknown)"
+                msg_id = b"(unknown)"
+
+                try:
+                    msg_id = self.db['source']['folders'][sf_name]['mails'][mail_id]['msg_id']
+                    size = self.db['source']['folders'][sf_name]['mails'][mail_id]['size']
+
+                    flags = data[b'FLAGS']
+                    msg = data[b'RFC822']
+                    date = data[b'INTERNALDATE']
+
+                except KeyError as e:
+                    try:
+                        msg_id_decoded = msg_id.decode()
+                    except Exception as sub_exception:
+                        msg_id_decoded = f'(decode failure): {sub_exception}'
+
+                    with self.lock:
+                        self.stats['errors'].append({'size': size,
+                                                     'subject': self.mail_subject(mails[mail_id], data.get(b'RFC822'))
+                                                     if mail_id in mails else '(unknown)',
+                                                     'exception': f'{type(e).__name__}: {e}',
+                                                     'folder': df_name,
+                                                     'date': date,
+                                                     'id': msg_id_decoded})
+                        part['errors'] += 1
+                        self.output('\n{} {}\n'.format(self.colorize('Error:', color='red', bold=True), e))
+                    continue
+
+                with self.lock:
+                    self.progress = self.stats['processed'] / self.stats['source_mails'] * 100
+
+                    #: copy mail
+                    if not self.quiet:
+                        self.output(self.colorize(
+                            '[{:>5.1f}%] Progressing... {}(buffer {}) (mail {}/{}) ({}) ({}): {}'.format(
+                                self.progress, part_info, buffer_counter+1, i+1, len(buffer), beautysized(size), date,
+                                self.mail_subject(mails[mail_id], msg)), clear=True), end='')
+
+                    #: skip mails that already exist (zero sized, too large and existing mails were already filtered by
+                    #: select_mails(), but a mail could exist twice in the source)
+                    if self.args.incremental and msg_id and df_name in self.db['destination']['folders'] and \
+                            self.db['destination']['folders'][df_name]['msg_ids'][msg_id] > 0:
+                        self.stats['skipped_mails']['already_exists'] += 1
+                        self.stats['processed'] += 1
+                        part['processed'] += 1
+                        copied.append((mail_id, None))
+                        done.append(mail_id)
+                        continue
+
+                #: workaround for microsoft exchange server
+                if self.args.max_line_length:
+                    if msg.line_too_long if isinstance(msg, SpooledMail) else \
+                            line_length_exceeded(msg, self.args.max_line_length)[0]:
+                        with self.lock:
+                            self.stats['skipped_mails']['max_line_length'] += 1
+                            self.stats['processed'] += 1
+                            part['processed'] += 1
+                            done.append(mail_id)
+                            self.output('\n{} \n'.format(self.colorize('Skipped! (line length)', color='cyan')), end='')
+                        continue
+
+                batch.append({'mail_id': mail_id,
+                              'msg_id': msg_id,
+                              'size': size,
+                              'date': date,
+                              'flags': [flag for flag in flags if flag.lower() not in self.denied_flags],
+                              'msg': msg})
+
+            start = time()
+            results = []
+            retries = 0
+            while True:
+                try:
+                    results.extend(self.append_mails(destination, df_name, batch[len(results):]))
+                    break
+                except TransferInterrupted as e:
+                    #: the mails appended before are kept, only the rest of the buffer is appended again
+                    results.extend(e.results)
+                    if isinstance(e, Throttled):
+                        retries = self.wait_throttled('destination', e.error, retries)
+                    else:
+                        retries = self.reconnect(destination, 'destination', e.error, retries)
+            self.metrics.add_folder(sf_name, append_time=time() - start,
+                                    append_bytes=sum([mail['size'] for mail in batch]),
+                                    mails=len([e for e, _ in results if e is None]))
+
+            aborting = False
+            for mail, (e, uid) in zip(batch, results):
+                with self.lock:
+                    self.stats['processed'] += 1
+                    part['processed'] += 1
+
+                    if e is None:
+                        self.stats['copied_mails'] += 1
+                        part['copied'] += 1
+                        copied.append((mail['mail_id'], uid))
+                        done.append(mail['mail_id'])
+                        #: only reserved mails are copies that other folders can label (not the ones in trash or spam)
+                        if self.gmail_destination and uid and mails[mail['mail_id']]['gm_msgid'] in part['reserved']:
+                            self.gmail_copies[mails[mail['mail_id']]['gm_msgid']] = (df_name, uid)
+                            part['reserved'].discard(mails[mail['mail_id']]['gm_msgid'])
+                            self.gmail_uploads.notify_all()
+                        if mail['msg_id'] and df_name in self.db['destination']['folders']:
+                            self.db['destination']['folders'][df_name]['msg_ids'][mail['msg_id']] += 1
+                        continue
+
+                    try:
+                        msg_id_decoded = mail['msg_id'].decode()
+                    except Exception as sub_exception:
+                        msg_id_decoded = f'(decode failure): {sub_exception}'
+
+                    error_information = {'size': beautysized(mail['size']),
+                                         'subject': self.mail_subject(mails[mail['mail_id']], mail['msg']),
+                                         'exception': f'{type(e).__name__}: {e}',
+                                         'folder': df_name,
+                                         'date': mail['date'],
+                                         'id': msg_id_decoded}
+
+                    self.stats['errors'].append(error_information)
+                    part['errors'] += 1
+                    self.output(f'\n{self.colorize("Error:", color="red", bold=True)} {e}\n')
+
+                if self.args.abort_on_error:
+                    aborting = True
+                    break
+
+            #: remove the temporary files of streamed mails
+            for data in fetched.values():
+                if isinstance(data.get(b'RFC822'), SpooledMail):
+                    data[b'RFC822'].close()
+
+            if self.state and copied:
+                self.state.add_mails(sf_name, df_name, copied)
+            if self.args.follow:
+                with self.lock:
+                    copies = self.db['source']['folders'][sf_name]['copies']
+                    copies.update({mail_id: uid for mail_id, uid in copied if uid})
+            if self.checkpoint:
+                self.checkpoint.add(sf_name, self.db['source']['folders'][sf_name]['uidvalidity'], done)
+
+            if aborting:
+                raise KeyboardInterrupt
+
+        with self.lock:
+            folder = self.db['source']['folders'][sf_name]
+            folder['parts_left'] -= 1
+            folder['errors'] += part['errors']
+
+            #: the high-water mark only moves if all mails below were processed without an error
+            if self.state and folder['parts_left'] == 0 and folder['errors'] == 0:
+                self.state.set_folder(sf_name, folder['uidvalidity'], high_water_mark=folder['high_water_mark'],
+                                      highest_modseq=folder['highestmodseq'])
+            if self.checkpoint and folder['parts_left'] == 0 and folder['errors'] == 0:
+                self.checkpoint.finish(sf_name, folder['uidvalidity'])
+
+            if self.args.workers > 1:
+                self.output(self.colorize(f'Folder finished: {sf_name} {part_info}({part["copied"]} copied, '
+                                          f'{part["processed"]} processed, {part["errors"]} errors)', clear=True))
+            else:
+                self.output(self.colorize('Folder finished!', clear=True))
+                self.output()
+
+    def create_folder(self, destination, df_name):
+        """
+            create the destination folder and subscribe it (unless --destination-no-subscribe)
+        """
+        with interruptions('destination'):
+            destination.create_folder(df_name)
+            if self.args.destination_no_subscribe is False:
+                destination.subscribe_folder(df_name)
+
+    def sync_flags(self, source, destination, sf_name, df_name, modseq, copies=None):
+        """
+            apply the flags of all mails of the source folder which were changed since modseq (CONDSTORE, RFC 7162) to
+            their copies in the destination folder. copies maps the source uids to the destination uids, the copies of
+            other mails are looked up in the state database.
+            returns the number of updated mails
+        """
+        with interruptions('source'):
+            source.select_folder(sf_name, readonly=True)
+            changed = source.fetch('1:*', ['FLAGS'], modifiers=[f'CHANGEDSINCE {modseq}'])
+
+        copies = dict(copies or {})
+        if self.state:
+            copies.update(self.state.destination_uids(sf_name, [mail_id for mail_id in changed
+                                                                if mail_id not in copies]))
+
+        #: mails with the same flags are updated with a single command
+        groups = {}
+        for mail_id, data in changed.items():
+            if copies.get(mail_id):
+                flags = tuple(sorted([flag for flag in data[b'FLAGS'] if flag.lower() not in self.denied_flags]))
+                groups.setdefault(flags, []).append(copies[mail_id])
+
+        with interruptions('destination'):
+            if groups:
+                destination.select_folder(df_name)
+            for flags, uids in groups.items():
+                destination.set_flags(uids, flags, silent=True)
+
+        updated = sum([len(uids) for uids in groups.values()])
+        self.stats['synced_flags'] += updated
+        return updated
+
+    def copy_new_mails(self, source, destination, sf_name, uidnext):
+        """
+            scan and copy all mails of the source folder with an uid of at least uidnext
+        """
+        folder = self.db['source']['folders'][sf_name]
+        with interruptions('source'):
+            source.select_folder(sf_name, readonly=True)
+
+            #: "n:*" always contains the last mail, even if its uid is lower than n
+            mails = [mail_id for mail_id in source.search(['UID', f'{uidnext}:*']) if mail_id >= uidnext]
+            if not mails:
+                return
+
+            folder['mails'] = {}
+            folder['size'] = 0
+            folder['high_water_mark'] = max(mails + [folder['high_water_mark']])
+            self.scan_source_folder(source, sf_name, list(mails))
+        self.output(self.colorize(f'New mails: {sf_name} ({len(folder["mails"])} mails)', clear=True))
+
+        self.select_mails(sf_name, folder['df_name'])
+        folder['parts_left'] = 1
+        folder['errors'] = 0
+        self.transfer_folder(source, destination, self.split_folder(sf_name, folder['df_name'], 1)[0])
+
+    def follow_changes(self, source, destination, source_idle, destination_idle):
+        """
+            keep the copied folders in sync until the process is interrupted. the source idles on INBOX (or the
+            first folder), after a change there or every --follow-interval seconds all folders are checked by STATUS.
+            new mails are copied and changed flags are applied to the copies of this run. a broken connection is
+            reconnected (and a throttled command retried) like while copying, then the folders are checked again.
+        """
+        folders = [name for name, folder in self.db['source']['folders'].items() if 'df_name' in folder]
+        if not folders:
+            return
+        idle_folder = 'INBOX' if 'INBOX' in folders else sorted(folders)[0]
+        self.output(self.colorize(f'Following {len(folders)} folders (idle on {idle_folder}, press Ctrl+C to stop)',
+                                  bold=True))
+        self.output()
+
+        retries = 0
+        try:
+            while True:
+                try:
+                    with interruptions('destination'):
+                        destination_idle.start_idle()
+                    with interruptions('source'):
+                        source_idle.wait(idle_folder, min(self.args.follow_interval, self.args.idle_interval))
+                    destination_idle.stop_idle()
+                    self.follow_folders(source, destination, folders)
+                    retries = 0
+                except TransferInterrupted as e:
+                    destination_idle.stop_idle()
+                    if isinstance(e, Throttled):
+                        retries = self.wait_throttled(e.side, e.error, retries)
+                    else:
+                        retries = self.reconnect(source if e.side == 'source' else destination, e.side, e.error,
+                                                 retries)
+                except (exceptions.IMAPClientError, OSError) as e:
+                    raise MigrationError(f'Following failed: {imaperror_decode(e)}')
+        except KeyboardInterrupt:
+            self.output(self.colorize('Stopped following!', clear=True))
+
+    def follow_folders(self, source, destination, folders):
+        """
+            check the given source folders by STATUS and copy their changes
+        """
+        with interruptions('source'):
+            statuses = folder_statuses(source)
+        for _, _, sf_name, status in statuses:
+            if sf_name not in folders or not status:
+                continue
+            folder = self.db['source']['folders'][sf_name]
+
+            if status[b'UIDVALIDITY'] != folder['uidvalidity']:
+                self.output(self.colorize(f'Skipped! (UIDVALIDITY changed, a new run is required): {sf_name}',
+                                          color='cyan'))
+                folders.remove(sf_name)
+                continue
+
+            #: the copies of new mails get the current flags anyway, so flags are synced first
+            if folder['highestmodseq'] and status.get(b'HIGHESTMODSEQ', 0) > folder['highestmodseq']:
+                updated = self.sync_flags(source, destination, sf_name, folder['df_name'], folder['highestmodseq'],
+                                          folder['copies'])
+                if updated:
+                    self.output(self.colorize(f'Flags synced: {sf_name} ({updated} mails)', clear=True))
+                folder['highestmodseq'] = status[b'HIGHESTMODSEQ']
+
+            if status[b'UIDNEXT'] > folder['uidnext']:
+                self.copy_new_mails(source, destination, sf_name, folder['uidnext'])
+                folder['uidnext'] = status[b'UIDNEXT']
+
+    def worker(self, source, destination, source_idle, destination_idle, jobs):
+        """
+            transfer folder parts from the job queue until it is empty or the process was aborted
+        """
+        source_idle.stop_idle()
+        destination_idle.stop_idle()
+
+        try:
+            while not self.abort.is_set():
+                try:
+                    part = jobs.get_nowait()
+                except Empty:
+                    break
+                try:
+                    self.transfer_folder(source, destination, part)
+                finally:
+                    #: other workers may wait for the Gmail copies of this part
+                    self.release_gmail_copies(part)
+
+        except KeyboardInterrupt:
+            self.abort.set()
+
+        except Exception as e:
+            self.failures.append(e)
+            self.abort.set()
+
+        #: hold the connections alive until all workers are done
+        source_idle.start_idle()
+        destination_idle.start_idle()
+
+    def run_workers(self, jobs):
+        """
+            process the job queue with all connection pairs in parallel
+        """
+        threads = [Thread(target=self.worker, args=(*pair, jobs), daemon=True) for pair in self.connection_pairs]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.abort.set()
+            raise
+
+        if self.failures:
+            raise self.failures[0]
+        if self.abort.is_set():
+            raise KeyboardInterrupt
@@ -0,0 +1,144 @@
+from threading import Thread, Condition, Lock
+
+
+class Prefetcher(Thread):
+    def __init__(self, fetch, buffers, max_bytes):
+        """
+        fetch the given buffers in the background, so the next buffer is loaded while the current one is processed
+
+        buffers is an iterable of (buffer, size) tuples. it's consumed lazily, so the next buffer can be built after
+        the previous one was fetched. the bytes in flight (the buffer in process and all prefetched buffers) are
+        limited by max_bytes. a buffer is always fetched if nothing is in flight, so a single buffer larger than
+        max_bytes does not block.
+        """
+        self.fetch = fetch
+        self.buffers = buffers
+        self.max_bytes = max_bytes
+        self._results = []
+        self._in_flight = 0
+        self._done = False
+        self._exit = False
+        self._condition = Condition()
+        super(Prefetcher, self).__init__(daemon=True)
+
+    def run(self):
+        for buffer, size in self.buffers:
+            with self._condition:
+                while self._in_flight and self._in_flight + size > self.max_bytes and self._exit is False:
+                    self._condition.wait()
+                if self._exit:
+                    break
+                self._in_flight += size
+
+            try:
+                result = self.fetch(buffer)
+            except Exception as e:
+                with self._condition:
+                    self._results.append((buffer, size, None, e))
+                    self._condition.notify_all()
+                break
+
+            with self._condition:
+                self._results.append((buffer, size, result, None))
+                self._condition.notify_all()
+
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """
+        yields (buffer, result) in the order of the buffers and raises the exception of a failed fetch
+        """
+        self.start()
+        size = 0
+
+        try:
+            while True:
+                with self._condition:
+                    #: the previous buffer was processed, so its bytes are no longer in flight
+                    self._in_flight -= size
+                    self._condition.notify_all()
+
+                    while not self._results and not self._done:
+                        self._condition.wait()
+                    if not self._results:
+                        return
+                    buffer, size, result, exception = self._results.pop(0)
+
+                if exception:
+                    raise exception
+                yield buffer, result
+        finally:
+            self.exit()
+
+    def exit(self):
+        """
+        stop prefetching and wait until a running fetch is finished, so the connection can be used again
+        """
+        with self._condition:
+            self._exit = True
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join()
+
+
+class BufferSizer:
+    def __init__(self, max_bytes, max_count, target_time=5, min_bytes=1000000):
+        """
+        group mails into buffers by a byte budget and a maximum count
+
+        the budget starts at max_bytes and is adjusted by the measured fetch time of each buffer: it shrinks if a
+        fetch takes longer than target_time seconds (or fails, e.g. by a timeout) and grows back if a full buffer is
+        fetched in less than half of that time. so a slow connection gets smaller buffers and a fast one the largest.
+        a max_bytes or max_count of 0 (or None) disables the limit.
+        """
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.target_time = target_time
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.budget = max_bytes
+        self._lock = Lock()
+
+    def buffers(self, mails, size_of, alone=lambda mail: False):
+        """
+        yields (buffer, size) tuples of the given mails in order. the budget is read for every new buffer, so it
+        follows the adjustments made while the previous buffers were fetched. a mail for which alone() is True gets
+        its own buffer.
+        """
+        buffer, buffer_size = [], 0
+        for mail in mails:
+            size = size_of(mail)
+            if alone(mail):
+                if buffer:
+                    yield buffer, buffer_size
+                    buffer, buffer_size = [], 0
+                yield [mail], size
+                continue
+
+            full = self.max_count and len(buffer) >= self.max_count
+            if buffer and (full or (self.budget and buffer_size + size > self.budget)):
+                yield buffer, buffer_size
+                buffer, buffer_size = [], 0
+            buffer.append(mail)
+            buffer_size += size
+
+        if buffer:
+            yield buffer, buffer_size
+
+    def update(self, size, duration):
+        """
+        adjust the budget by the duration (in seconds) a buffer of size bytes needed to be fetched
+        """
+        with self._lock:
+            if duration > self.target_time:
+                self.budget = max(self.min_bytes, int(self.budget * max(0.5, self.target_time / duration)))
+            elif duration < self.target_time / 2 and size >= self.budget / 2:
+                self.budget = min(self.max_bytes, int(self.budget * 1.5))
+
+    def failed(self):
+        """
+        halve the budget after a failed fetch
+        """
+        with self._lock:
+            self.budget = max(self.min_bytes, self.budget // 2)
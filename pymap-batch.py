@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+"""
+    Copy and transfer many IMAP mailboxes in parallel with pymap-copy
+"""
+__version__ = '1.0.1'
+__author__ = 'Lukas Schulte-Tickmann'
+__url__ = 'https://github.com/Schluggi/pymap-copy'
+
+import csv
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from contextlib import redirect_stderr
+from functools import lru_cache, partial
+from tempfile import TemporaryDirectory
+from threading import Thread, Condition, RLock
+from time import time
+
+PYMAP_COPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pymap-copy.py')
+VALUE_ONLY = ('source-user', 'source-pass', 'destination-user', 'destination-pass')  #: never treated as a flag
+
+
+def load_jobs(path):
+    """
+    returns the jobs of a csv or yaml file as a list of dicts. each key is the name of a pymap-copy option (like
+    source-user or destination_server), empty values are dropped.
+    """
+    if path.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit('PyYAML is required for yaml job files (pip install pyyaml)')
+        with open(path) as f:
+            rows = yaml.safe_load(f) or []
+        if isinstance(rows, dict):
+            rows = rows.get('jobs', [])
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for row in rows:
+        job = {str(key).strip().replace('_', '-'): value for key, value in row.items()
+               if key and value is not None and value != ''}
+        for option in ('source-user', 'source-server', 'destination-user', 'destination-server'):
+            if option not in job:
+                raise SystemExit(f'Job {len(jobs) + 1} has no {option}')
+        jobs.append(job)
+    return jobs
+
+
+def job_arguments(job):
+    """
+    returns the command line arguments of pymap-copy for the job. true/yes values are passed as flags (like
+    incremental: yes), lists as a repeated option (like several redirects).
+    """
+    arguments = []
+    for key, values in job.items():
+        for value in values if isinstance(values, list) else [values]:
+            if key not in VALUE_ONLY and (value is True or str(value).lower() in ('true', 'yes')):
+                arguments.append(f'--{key}')
+            elif key not in VALUE_ONLY and (value is False or str(value).lower() in ('false', 'no')):
+                continue
+            else:
+                arguments.extend([f'--{key}', str(value)])
+    return arguments
+
+
+@lru_cache(maxsize=None)
+def copy_parser():
+    """
+    returns the argument parser of pymap-copy (without -h/--help), so the options of a job are read like pymap-copy
+    reads them
+    """
+    from migrator import add_arguments
+
+    parser = ArgumentParser(prog='pymap-copy.py', add_help=False)
+    add_arguments(parser)
+    return parser
+
+
+def worker_count(arguments):
+    """
+    returns the number of connection pairs pymap-copy will use with these arguments. invalid arguments count as one
+    pair, pymap-copy refuses them anyway.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stderr(devnull):
+            return max(1, copy_parser().parse_args(arguments).workers)
+    except SystemExit:
+        return 1
+
+
+class HostLimiter:
+    def __init__(self, max_per_host):
+        """
+        limits the number of connections that are opened to each host at the same time, 0 means no limit
+
+        a job that needs more connections than the limit is started when its hosts are idle, so it can't block forever
+        """
+        self.max_per_host = max_per_host
+        self.used = Counter()
+        self.condition = Condition()
+
+    def fits(self, hosts):
+        if not self.max_per_host:
+            return True
+        return all(self.used[host] == 0 or self.used[host] + count <= self.max_per_host
+                   for host, count in hosts.items())
+
+
+class BatchRunner:
+    def __init__(self, jobs, arguments, processes, max_per_host, log_dir, results):
+        """
+        runs pymap-copy for each job with up to processes jobs at the same time and writes a result record of each
+        job as a json line to results
+        """
+        self.jobs = jobs
+        self.arguments = arguments
+        self.processes = processes
+        self.limiter = HostLimiter(max_per_host)
+        self.log_dir = log_dir
+        self.results = results
+        self.pending = list(enumerate(jobs, start=1))
+        self.finished = 0
+        self.failed = 0
+        self._lock = RLock()  #: guards the results file, the counters and the output
+
+    def hosts(self, job, arguments):
+        """
+        returns a Counter of the connections the job opens to each host
+        """
+        workers = worker_count(arguments)
+        return Counter({job['source-server']: workers}) + Counter({job['destination-server']: workers})
+
+    def next_job(self):
+        """
+        returns the next pending job whose hosts have free connections (waits until there is one) or None
+        """
+        with self.limiter.condition:
+            while self.pending:
+                for i, (number, job) in enumerate(self.pending):
+                    arguments = job_arguments(job) + self.arguments
+                    hosts = self.hosts(job, arguments)
+                    if self.limiter.fits(hosts):
+                        del self.pending[i]
+                        self.limiter.used.update(hosts)
+                        return number, job, arguments, hosts
+                self.limiter.condition.wait()
+            return None
+
+    def release(self, hosts):
+        with self.limiter.condition:
+            self.limiter.used.subtract(hosts)
+            self.limiter.condition.notify_all()
+
+    def log_file(self, number, job):
+        return os.path.join(self.log_dir, f'{number:05d}-{job["source-user"]}.log'.replace('/', '_'))
+
+    def run_job(self, number, job, arguments, stats_dir):
+        stats_file = os.path.join(stats_dir, f'{number}.json')
+        log_file = self.log_file(number, job)
+
+        start_time = time()
+        with open(log_file, 'w') as log:
+            returncode = subprocess.call([sys.executable, PYMAP_COPY, '--no-colors', '--stats-file', stats_file] +
+                                         arguments, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        duration = time() - start_time
+
+        try:
+            with open(stats_file) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = None  #: pymap-copy aborted before the summary (like a failed login)
+        self.finish(number, job, returncode, duration, log_file, stats)
+
+    def finish(self, number, job, returncode, duration, log_file, stats, error=None):
+        """
+        writes the result record of the job and prints its status. returncode is None for jobs of the async engine,
+        error is the reason why such a job was stopped.
+        """
+        source = f'{job["source-user"]}@{job["source-server"]}'
+        destination = f'{job["destination-user"]}@{job["destination-server"]}'
+
+        if returncode or error or stats is None or stats.get('aborted'):
+            status = 'failed'
+        elif stats['errors']:
+            status = 'errors'
+        else:
+            status = 'ok'
+
+        result = {'job': number, 'source': source, 'destination': destination, 'status': status,
+                  'returncode': returncode, 'duration': round(duration, 2), 'log': log_file, 'stats': stats,
+                  'error': error}
+
+        with self._lock:
+            self.finished += 1
+            if status != 'ok':
+                self.failed += 1
+            with open(self.results, 'a') as f:
+                f.write(json.dumps(result, default=str) + '\n')
+
+            if stats and stats.get('aborted'):
+                details = f'{stats["copied_mails"]} mails copied, aborted: {stats["aborted"]}'
+            elif stats and not error:
+                details = f'{stats["copied_mails"]} mails copied, {len(stats["errors"])} errors'
+            else:
+                details = f'aborted, see {log_file}'
+            print(f'[{self.finished}/{len(self.jobs)}] {source} -> {destination}: {status} ({details}) '
+                  f'in {duration:.1f}s', flush=True)
+
+    def worker(self, stats_dir):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            number, job, arguments, hosts = job
+            try:
+                self.run_job(number, job, arguments, stats_dir)
+            finally:
+                self.release(hosts)
+
+    def run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        with TemporaryDirectory(prefix='pymap-batch-') as stats_dir:
+            threads = [Thread(target=self.worker, args=(stats_dir,), daemon=True)
+                       for _ in range(min(self.processes, len(self.jobs)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def run_async(self, memory):
+        """
+        runs all jobs with the async engine in this process instead of a pymap-copy process per job. up to processes
+        jobs run at the same time, their mails in memory are limited to memory bytes in total.
+        """
+        import asyncio
+        from asyncengine import AsyncMigrator, MemoryBudget, run_all
+        from migrator import MigrationError, OPTIONS
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        budget = MemoryBudget(memory)
+        migrators, logs = [], {}
+        for number, job in self.pending:
+            log_file = self.log_file(number, job)
+            log = open(log_file, 'w')
+            try:
+                with redirect_stderr(log):
+                    job_args = copy_parser().parse_args(['--no-colors'] + job_arguments(job) + self.arguments)
+                options = {option: getattr(job_args, option) for option in OPTIONS}
+                migrator = AsyncMigrator(job_args.source_user, job_args.source_pass, job_args.source_server,
+                                         job_args.destination_user, job_args.destination_pass,
+                                         job_args.destination_server, output=partial(print, file=log), memory=budget,
+                                         **options)
+            except (SystemExit, ValueError, MigrationError) as e:
+                error = str(e) if not isinstance(e, SystemExit) else 'invalid arguments'
+                print(f'Error: {error}', file=log)
+                log.close()
+                self.finish(number, job, None, 0, log_file, None, error=error)
+                continue
+            migrators.append(migrator)
+            logs[migrator] = (number, job, log, log_file)
+        self.pending = []
+
+        def finished(migrator, result, duration):
+            number, job, log, log_file = logs[migrator]
+            if isinstance(result, Exception):
+                print(f'\nAbort! {result}', file=log)
+                error = str(result) or type(result).__name__
+            else:
+                error = None
+            log.close()
+            self.finish(number, job, None, duration, log_file, migrator.stats, error=error)
+
+        asyncio.run(run_all(migrators, self.processes, self.limiter.max_per_host, callback=finished))
+
+
+parser = ArgumentParser(usage='%(prog)s [options] jobs [-- pymap-copy options]',
+                        description='Copy many mailboxes with pymap-copy. Each row of the job file describes one '
+                                    'mailbox pair, its columns are pymap-copy options (like source-user, source-pass, '
+                                    'source-server, destination-user, destination-pass, destination-server). '
+                                    'Options for all jobs can be given after --.',
+                        epilog='pymap-batch.py jobs.csv -n 4 --max-per-host 8 -- --incremental')
+parser.add_argument('-v', '--version', help='show version and exit.', action="version",
+                    version=f'pymap-batch {__version__} by {__author__} ({__url__})')
+parser.add_argument('jobs', help='a csv file (with a header row) or a yaml file (a list of mappings)')
+parser.add_argument('-n', '--processes', help='the number of mailboxes copied at the same time (default: 4)',
+                    type=int, default=4)
+parser.add_argument('--max-per-host', help='the maximum number of connections to a single server, a job counts '
+                                           'its --workers (default: 0 = no limit)', type=int, default=0)
+parser.add_argument('--log-dir', help='the output of each job is written to a file in this directory '
+                                      '(default: pymap-batch-logs)', default='pymap-batch-logs')
+parser.add_argument('--results', help='a json line with the result and the statistics of each job is appended to '
+                                      'this file (default: pymap-batch-results.jsonl)',
+                    default='pymap-batch-results.jsonl')
+parser.add_argument('--async', help='run all jobs in this process with the async engine instead of a pymap-copy '
+                                    'process per job, so --processes can be in the hundreds (see README)',
+                    dest='use_async', action='store_true')
+parser.add_argument('--memory', help='the maximum size in byte of the mails held in memory by all jobs of --async '
+                                     '(default: 500000000)', type=int, default=500000000)
+
+#: everything after -- is passed to pymap-copy
+if '--' in sys.argv:
+    common_arguments = sys.argv[sys.argv.index('--') + 1:]
+    args = parser.parse_args(sys.argv[1:sys.argv.index('--')])
+else:
+    common_arguments = []
+    args = parser.parse_args()
+
+if args.processes < 1:
+    parser.error('--processes must be at least 1')
+
+batch_jobs = load_jobs(args.jobs)
+
+if not batch_jobs:
+    print('No jobs found.')
+    exit()
+
+print(f'Jobs: {len(batch_jobs)}, {"concurrent jobs (async)" if args.use_async else "processes"}: {args.processes}, '
+      f'max connections per host: {args.max_per_host or "unlimited"}\n', flush=True)
+
+runner = BatchRunner(batch_jobs, common_arguments, args.processes, args.max_per_host, args.log_dir, args.results)
+batch_start = time()
+try:
+    if args.use_async:
+        runner.run_async(args.memory)
+    else:
+        runner.run()
+except KeyboardInterrupt:
+    print('\nAbort! Running jobs are stopped.')
+    exit(1)
+
+print(f'\nFinished {runner.finished} jobs in {time() - batch_start:.1f}s, {runner.failed} failed or with errors. '
+      f'Results: {args.results}')
+exit(1 if runner.failed else 0)
@@ -7,7 +7,7 @@ setuptools.setup(
     name='pymap-copy',
     version='1.0.2',
     python_requires='>=3.6',
-    scripts=['pymap-copy.py'],
+    scripts=['pymap-batch.py', 'pymap-copy.py'],
     author='Lukas Schulte-Tickmann',
     author_email='github@das-it-gesicht.de',
     description='Copy and transfer IMAP mailboxes',
@@ -20,7 +20,8 @@ setuptools.setup(
         'Funding': 'https://www.paypal.com/cgi-bin/webscr?cmd=_s-xclick&hosted_button_id=KPG2MY37LCC24&source=url'
     },
     packages=setuptools.find_packages(),
-    py_modules=['imapidle', 'utils'],
+    py_modules=['aioimap', 'asyncengine', 'checkpoint', 'compress', 'imapidle', 'mailcache', 'metrics', 'migrator',
+                'prefetch', 'statedb', 'stream', 'throttle', 'utils'],
     install_requires=[
         'chardet',
         'IMAPClient',
@@ -0,0 +1,142 @@
+import sqlite3
+from threading import RLock
+
+
+class StateDB:
+    def __init__(self, path, source_account, destination_account):
+        """
+        a local sqlite database that remembers which source mails were already copied to which destination mail
+
+        every folder is stored with its UIDVALIDITY. if the UIDVALIDITY of a folder changes, its UIDs are no longer
+        valid and the folder must be scanned completely again.
+        """
+        self.source_account = source_account
+        self.destination_account = destination_account
+        self._lock = RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS folders (
+                source_account TEXT NOT NULL,
+                destination_account TEXT NOT NULL,
+                source_folder TEXT NOT NULL,
+                source_uidvalidity INTEGER NOT NULL,
+                high_water_mark INTEGER NOT NULL DEFAULT 0,
+                destination_folder TEXT,
+                destination_uidvalidity INTEGER,
+                highest_modseq INTEGER,
+                PRIMARY KEY (source_account, destination_account, source_folder)
+            );
+            CREATE TABLE IF NOT EXISTS mails (
+                source_account TEXT NOT NULL,
+                destination_account TEXT NOT NULL,
+                source_folder TEXT NOT NULL,
+                source_uid INTEGER NOT NULL,
+                destination_folder TEXT,
+                destination_uid INTEGER,
+                PRIMARY KEY (source_account, destination_account, source_folder, source_uid)
+            );
+        ''')
+
+        #: databases of older versions have no highest_modseq yet
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(folders)')]
+        if 'highest_modseq' not in columns:
+            self._db.execute('ALTER TABLE folders ADD COLUMN highest_modseq INTEGER')
+            self._db.commit()
+
+    def get_folder(self, folder):
+        """
+        returns the stored state of the source folder as dict or None if the folder is unknown
+        """
+        with self._lock:
+            row = self._db.execute('SELECT source_uidvalidity, high_water_mark, destination_folder, '
+                                   'destination_uidvalidity, highest_modseq FROM folders WHERE source_account = ? AND '
+                                   'destination_account = ? AND source_folder = ?',
+                                   (self.source_account, self.destination_account, folder)).fetchone()
+        if row is None:
+            return None
+        return {'uidvalidity': row[0],
+                'high_water_mark': row[1],
+                'destination_folder': row[2],
+                'destination_uidvalidity': row[3],
+                'highest_modseq': row[4]}
+
+    def set_folder(self, folder, uidvalidity, destination_folder=None, destination_uidvalidity=None,
+                   high_water_mark=None, highest_modseq=None):
+        """
+        store the state of the source folder. all mails of the folder are forgotten if the UIDVALIDITY changed.
+        highest_modseq is the HIGHESTMODSEQ (CONDSTORE) of the source folder up to which the flags were copied.
+        """
+        with self._lock:
+            state = self.get_folder(folder)
+            if state and state['uidvalidity'] != uidvalidity:
+                self.reset_folder(folder)
+                state = None
+
+            if state is None:
+                state = {'high_water_mark': 0, 'destination_folder': None, 'destination_uidvalidity': None,
+                         'highest_modseq': None}
+            if high_water_mark is None:
+                high_water_mark = state['high_water_mark']
+            if highest_modseq is None:
+                highest_modseq = state['highest_modseq']
+            if destination_folder is None:
+                destination_folder = state['destination_folder']
+                destination_uidvalidity = state['destination_uidvalidity']
+
+            self._db.execute('INSERT OR REPLACE INTO folders (source_account, destination_account, source_folder, '
+                             'source_uidvalidity, high_water_mark, destination_folder, destination_uidvalidity, '
+                             'highest_modseq) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (self.source_account, self.destination_account, folder, uidvalidity, high_water_mark,
+                              destination_folder, destination_uidvalidity, highest_modseq))
+            self._db.commit()
+
+    def reset_folder(self, folder):
+        """
+        forget the source folder and all of its mails
+        """
+        with self._lock:
+            for table in ('folders', 'mails'):
+                self._db.execute(f'DELETE FROM {table} WHERE source_account = ? AND destination_account = ? AND '
+                                 f'source_folder = ?', (self.source_account, self.destination_account, folder))
+            self._db.commit()
+
+    def copied_uids(self, folder, above=0):
+        """
+        returns a set of all source UIDs of the folder that are larger than above and were already copied
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT source_uid FROM mails WHERE source_account = ? AND destination_account = ? '
+                                    'AND source_folder = ? AND source_uid > ?',
+                                    (self.source_account, self.destination_account, folder, above)).fetchall()
+        return {row[0] for row in rows}
+
+    def destination_uids(self, folder, uids):
+        """
+        returns a dict of the given source UIDs of the folder and the UIDs of their copies (if they are known)
+        """
+        result = {}
+        with self._lock:
+            #: sqlite limits the number of parameters of a query
+            for i in range(0, len(uids), 500):
+                chunk = list(uids[i:i + 500])
+                rows = self._db.execute(f'SELECT source_uid, destination_uid FROM mails WHERE source_account = ? AND '
+                                        f'destination_account = ? AND source_folder = ? AND destination_uid IS NOT '
+                                        f'NULL AND source_uid IN ({", ".join("?" * len(chunk))})',
+                                        [self.source_account, self.destination_account, folder] + chunk).fetchall()
+                result.update(dict(rows))
+        return result
+
+    def add_mails(self, folder, destination_folder, mails):
+        """
+        remember the given mails as copied
+        mails is a list of (source_uid, destination_uid) tuples. the destination_uid is None if it is unknown
+        """
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO mails VALUES (?, ?, ?, ?, ?, ?)',
+                                 [(self.source_account, self.destination_account, folder, source_uid,
+                                   destination_folder, destination_uid) for source_uid, destination_uid in mails])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,133 @@
+from tempfile import SpooledTemporaryFile
+
+from imapclient import exceptions
+from imapclient.datetime_util import datetime_to_INTERNALDATE
+from imapclient.imapclient import seq_to_parenstr
+from imapclient.util import to_bytes
+
+HEAD_SIZE = 65536  #: the first bytes of a mail are kept in memory to read its headers
+
+
+def line_length_exceeded(data, limit, carry=0):
+    """
+    check if data contains a line longer than limit, without copying data
+
+    carry is the length of the unfinished last line of the previous chunk (if data is a part of a larger mail).
+    returns a tuple of the result and the length of the unfinished last line of data.
+    """
+    start = 0
+    while True:
+        end = data.find(b'\n', start)
+        if end == -1:
+            carry += len(data) - start
+            return carry > limit, carry
+        if carry + end - start > limit:
+            return True, 0
+        carry = 0
+        start = end + 1
+
+
+class SpooledMail:
+    def __init__(self, max_size, max_line_length=None):
+        """
+        a mail which is held in memory up to max_size bytes and written to a temporary file beyond
+        """
+        self.file = SpooledTemporaryFile(max_size=max_size)
+        self.size = 0
+        self.head = b''
+        self.line_too_long = False
+        self._max_line_length = max_line_length
+        self._carry = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+        if len(self.head) < HEAD_SIZE:
+            self.head += chunk[:HEAD_SIZE - len(self.head)]
+
+        if self._max_line_length and not self.line_too_long:
+            self.line_too_long, self._carry = line_length_exceeded(chunk, self._max_line_length, self._carry)
+
+    def chunks(self, chunk_size):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def fetch_mail(client, uid, chunk_size, max_line_length=None):
+    """
+    fetch a single mail in chunks (BODY.PEEK[]<offset.length>) into a SpooledMail, so at most chunk_size bytes of
+    it are held in memory. the RFC822.SIZE of some servers is wrong, so the mail is fetched until a chunk is shorter
+    than chunk_size (or empty).
+
+    returns a dict like IMAPClient.fetch() with the SpooledMail as RFC822
+    """
+    mail = SpooledMail(chunk_size, max_line_length)
+    data = {}
+
+    while True:
+        fetch_data = [f'BODY.PEEK[]<{mail.size}.{chunk_size}>']
+        if not data:
+            fetch_data.extend(['FLAGS', 'INTERNALDATE'])
+
+        try:
+            response = client.fetch([uid], fetch_data).get(uid)
+        except Exception:
+            mail.close()
+            raise
+        if response is None:
+            mail.close()
+            return {}
+
+        if not data:
+            data = {b'FLAGS': response[b'FLAGS'], b'INTERNALDATE': response[b'INTERNALDATE'], b'RFC822': mail}
+
+        chunk = next((value for key, value in response.items() if key.startswith(b'BODY[]')), None)
+        if chunk:
+            mail.write(chunk)
+        if not chunk or len(chunk) < chunk_size:
+            break
+
+    return {uid: data}
+
+
+def append_mail(client, folder, mail, flags=(), msg_time=None, chunk_size=1048576):
+    """
+    append a SpooledMail to the folder. the mail is sent in chunks as the literal of the APPEND command, so it is
+    never completely loaded into memory.
+
+    returns the APPEND response like IMAPClient.append()
+    """
+    imap = client._imap
+    literal_plus = client.has_capability('LITERAL+')
+
+    command = [b'APPEND', to_bytes(client._normalise_folder(folder)), to_bytes(seq_to_parenstr(flags))]
+    if msg_time:
+        command.append(to_bytes(f'"{datetime_to_INTERNALDATE(msg_time)}"'))
+
+    tag = imap._new_tag()
+    imap.send(tag + b' ' + b' '.join(command) + b' {' + str(mail.size).encode() + (b'+' if literal_plus else b'') +
+              b'}\r\n')
+
+    if not literal_plus:
+        #: wait for the continuation response, the server may refuse the mail before
+        while imap._get_response():
+            if imap.tagged_commands[tag]:
+                typ, data = imap.tagged_commands.pop(tag)
+                raise exceptions.IMAPClientError(f'append failed: {data[0].decode(errors="replace")}')
+
+    for chunk in mail.chunks(chunk_size):
+        imap.send(chunk)
+    imap.send(b'\r\n')
+
+    typ, data = imap._command_complete('APPEND', tag)
+    if typ != 'OK':
+        raise exceptions.IMAPClientError(f'append failed: {data[0].decode(errors="replace")}')
+    return data[0]
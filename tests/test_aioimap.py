@@ -0,0 +1,109 @@
+"""
+    Tests of the async IMAP client against the local IMAP stand-in of the benchmarks
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from imapclient import exceptions  # noqa: E402
+
+from aioimap import AsyncIMAPClient  # noqa: E402
+from fakeimap import Mailbox, Server  # noqa: E402
+
+
+def mail(number, size=0):
+    return (f'From: sender@example.org\r\nSubject: Test mail {number}\r\nMessage-ID: <test{number}@example.org>\r\n'
+            f'\r\n').encode() + b'x' * size + b'\r\n'
+
+
+class AsyncIMAPClientTest(unittest.IsolatedAsyncioTestCase):
+    #: no LITERAL+, so each literal waits for the continuation response of the server
+    capabilities = ('IMAP4rev1', 'UIDPLUS')
+    max_literal = 0
+    max_commands = 0
+
+    async def asyncSetUp(self):
+        self.mailbox = Mailbox()
+        for number in range(3):
+            self.mailbox.add('INBOX', mail(number, size=number * 1000), ['\\Seen'])
+        self.server = Server(self.mailbox, self.capabilities, max_literal=self.max_literal,
+                             max_commands=self.max_commands).start()
+        self.client = AsyncIMAPClient('127.0.0.1', self.server.port, ssl=False, timeout=10)
+        await self.client.connect()
+        await self.client.login('user', 'password')
+
+    async def asyncTearDown(self):
+        try:
+            await self.client.logout()
+        except (exceptions.IMAPClientError, OSError):
+            pass
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FetchTest(AsyncIMAPClientTest):
+    async def test_multiple_literals(self):
+        """
+        a FETCH response with several literals in one line (the mail and its header fields)
+        """
+        await self.client.select_folder('INBOX', readonly=True)
+        fields = 'BODY.PEEK[HEADER.FIELDS (SUBJECT MESSAGE-ID)]'
+        result = await self.client.fetch([1, 2, 3], ['RFC822', fields, 'FLAGS'])
+
+        self.assertEqual(sorted(result), [1, 2, 3])
+        for uid, data in result.items():
+            number = uid - 1
+            self.assertEqual(data[b'RFC822'], mail(number, size=number * 1000))
+            self.assertEqual(data[b'BODY[HEADER.FIELDS (SUBJECT MESSAGE-ID)]'],
+                             f'Subject: Test mail {number}\r\nMessage-Id: <test{number}@example.org>\r\n\r\n'.encode())
+            self.assertEqual(data[b'FLAGS'], (b'\\Seen',))
+
+
+class RejectedLiteralTest(AsyncIMAPClientTest):
+    max_literal = 2000
+
+    async def test_rejected_literal(self):
+        """
+        a refused synchronizing literal fails the command, but the connection can still be used
+        """
+        with self.assertRaises(exceptions.IMAPClientError) as context:
+            await self.client.append('INBOX', mail(10, size=5000))
+        self.assertNotIsInstance(context.exception, exceptions.IMAPClientAbortError)
+        self.assertIn('APPEND failed', str(context.exception))
+        self.assertIn('TOOBIG', str(context.exception))
+
+        await self.client.noop()
+        text = await self.client.append('INBOX', mail(11))
+        self.assertIn(b'APPENDUID', text)
+        self.assertEqual(self.mailbox.count(), 4)
+
+
+class ByeTest(AsyncIMAPClientTest):
+    #: CAPABILITY, LOGIN and the CAPABILITY after the login
+    max_commands = 3
+
+    async def test_bye(self):
+        """
+        a BYE of the server aborts the command like in imaplib
+        """
+        with self.assertRaises(exceptions.IMAPClientAbortError) as context:
+            await self.client.noop()
+        self.assertIn('too many commands', str(context.exception))
+
+        #: the connection is closed
+        with self.assertRaises(exceptions.IMAPClientAbortError):
+            await self.client.noop()
+
+    async def test_logout(self):
+        """
+        the BYE of a LOGOUT is expected
+        """
+        self.server.max_commands = 0
+        await self.client.logout()
+
+
+if __name__ == '__main__':
+    unittest.main()
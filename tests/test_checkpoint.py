@@ -0,0 +1,59 @@
+"""
+    Tests of the checkpoint of the processed mails
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import Checkpoint  # noqa: E402
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'checkpoint.json')
+        self.checkpoint = Checkpoint(self.path, 'source', 'destination', interval=3600)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ranges(self):
+        """
+        the uids are kept as sorted ranges which are merged as soon as they touch
+        """
+        self.checkpoint.add('INBOX', 1, [5, 1, 2, 9])
+        self.checkpoint.add('INBOX', 1, [3, 2, 8])
+        self.checkpoint.add('INBOX', 1, [4])
+        self.assertEqual(self.checkpoint._data['folders']['INBOX']['done'], [[1, 5], [8, 9]])
+
+        self.assertEqual([uid for uid in range(12) if self.checkpoint.is_done('INBOX', 1, uid)], [1, 2, 3, 4, 5, 8, 9])
+        self.assertFalse(self.checkpoint.is_done('INBOX', 2, 1))
+        self.assertFalse(self.checkpoint.is_done('Other', 1, 1))
+
+    def test_random_order(self):
+        uids = random.Random(1).sample(range(1, 2000), 1500)
+        for i in range(0, len(uids), 7):
+            self.checkpoint.add('INBOX', 1, uids[i:i + 7])
+
+        done = self.checkpoint._data['folders']['INBOX']['done']
+        self.assertEqual(done, sorted(done))
+        self.assertTrue(all([last + 1 < first for (_, last), (first, _) in zip(done, done[1:])]))
+        self.assertEqual({uid for uid in range(2001) if self.checkpoint.is_done('INBOX', 1, uid)}, set(uids))
+
+    def test_resume(self):
+        self.checkpoint.add('INBOX', 1, [1, 2, 3])
+        self.checkpoint.finish('INBOX', 1)
+
+        resumed = Checkpoint(self.path, 'source', 'destination', resume=True)
+        self.assertTrue(resumed.is_finished('INBOX', 1))
+        self.assertTrue(resumed.is_done('INBOX', 1, 3))
+        with self.assertRaises(ValueError):
+            Checkpoint(self.path, 'other', 'destination', resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
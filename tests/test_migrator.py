@@ -0,0 +1,79 @@
+"""
+    Tests of the Migrator parts which don't need a server
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrator import Migrator  # noqa: E402
+
+
+class GmailDestination:
+    """
+    records the labels added to the mails of a Gmail destination
+    """
+    def __init__(self):
+        self.selected = None
+        self.labels = []
+
+    def select_folder(self, folder):
+        self.selected = folder
+
+    def add_gmail_labels(self, uids, labels, silent=False):
+        self.labels.append((self.selected, uids, labels))
+
+
+class LabelMailsTest(unittest.TestCase):
+    def setUp(self):
+        self.migrator = Migrator('user', 'password', 'localhost', 'user', 'password', 'localhost', gmail=True)
+        self.migrator.gmail_destination = True
+        self.migrator.db['source']['folders']['Source'] = {
+            'uidvalidity': 1,
+            'mails': {uid: {'size': 100, 'msg_id': None, 'subject': None, 'gm_msgid': 1000 + uid}
+                      for uid in range(1, 5)}}
+        self.migrator.db['destination']['folders'].update({'Work': {'flags': ()},
+                                                           '[Gmail]/Trash': {'flags': (b'\\HasNoChildren', b'\\Trash')},
+                                                           'Other': {'flags': ()}})
+        self.destination = GmailDestination()
+
+    def part(self, df_name):
+        return {'sf_name': 'Source', 'df_name': df_name, 'mails': [1, 2, 3, 4], 'processed': 0, 'copied': 0,
+                'errors': 0, 'reserved': set()}
+
+    def test_special_folder(self):
+        """
+        mails of trash or spam are uploaded again and not reserved, as these folders are no labels
+        """
+        self.migrator.gmail_copies[1001] = ('Other', 7)
+        part = self.part('[Gmail]/Trash')
+        self.assertEqual(self.migrator.label_mails(self.destination, part, [3, 1, 2]), ([1, 2, 3], []))
+        self.assertEqual(part['reserved'], set())
+        self.assertEqual(self.destination.labels, [])
+
+    def test_special_folder_buffers(self):
+        self.migrator.fetch_buffers = lambda source, sf_name, pending, sizer: iter([(pending, {})])
+        part = self.part('[Gmail]/Trash')
+        self.assertEqual(list(self.migrator.gmail_buffers(None, self.destination, part, None)), [([1, 2, 3, 4], {})])
+
+    def test_label_and_reserve(self):
+        """
+        copies in other folders are labelled, uploads of other workers are deferred and the rest is reserved
+        """
+        self.migrator.gmail_copies.update({1001: ('Other', 7), 1002: ('Other', None)})
+        part = self.part('Work')
+        remaining, deferred = self.migrator.label_mails(self.destination, part, part['mails'])
+
+        self.assertEqual((remaining, deferred), ([3, 4], [2]))
+        self.assertEqual(self.destination.labels, [('Other', [7], ['Work'])])
+        self.assertEqual(part['reserved'], {1003, 1004})
+        self.assertEqual(self.migrator.stats['labelled_mails'], 1)
+
+        self.migrator.release_gmail_copies(part)
+        self.assertNotIn(1003, self.migrator.gmail_copies)
+        self.assertEqual(self.migrator.gmail_copies[1002], ('Other', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+from time import sleep, time
+
+#: parts of NO and BYE responses of throttling servers (RFC 5530 response codes, Gmail and Office 365)
+THROTTLE_HINTS = ('[throttled]', '[unavailable]', '[limit]', 'throttl', 'too many', 'try again later',
+                  'bandwidth limits', 'server unavailable')
+
+
+def is_throttled(error):
+    """
+    returns True if the error (or response) is a refusal of a throttling server
+    """
+    text = str(error).lower()
+    return any([hint in text for hint in THROTTLE_HINTS])
+
+
+class Throttle:
+    def __init__(self, max_concurrency=1, max_bytes=0, max_ops=0, slowdown=4, min_time=1, min_bytes=100000,
+                 window=10):
+        """
+        adapts the load on a server like the congestion control of TCP (AIMD): the number of concurrent commands and
+        the rate in bytes per second are halved if a command is throttled (a NO or BYE response like "[THROTTLED]" or
+        "[UNAVAILABLE]") or was slow. they grow additively (by one command and by min_bytes per second) with each
+        command that is answered in time, so the load stays close to the maximum the server accepts instead of
+        alternating between throttled and idle.
+
+        the latency is compared per megabyte (a smaller command counts as one megabyte), so large commands on a slow
+        link are not mistaken for throttling: a command is slow if it took longer than min_time seconds and slowdown
+        times the usual seconds per megabyte of the previous commands.
+
+        as long as nothing was throttled, the rate is only limited by max_bytes (bytes per second). max_ops (commands
+        per second) and max_bytes are fixed ceilings, 0 disables them. the throughput of the last window seconds is
+        the starting point of the first decrease.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_bytes = max_bytes
+        self.max_ops = max_ops
+        self.slowdown = slowdown
+        self.min_time = min_time
+        self.min_bytes = min_bytes
+        self.window = window
+        self.concurrency = float(self.max_concurrency)
+        self.rate = max_bytes or None  #: the allowed bytes per second, None is unlimited
+        self.throttled = 0  #: the number of throttled or too slow commands
+        self.baseline = None  #: the usual seconds per megabyte of the commands
+        self.active = 0
+        self._next = 0.0  #: the earliest start of the next command
+        self._history = deque()  #: (end time, bytes) of the commands of the last window seconds
+        self._start = time()
+        self._condition = Condition()
+
+    def acquire(self, size):
+        """
+        wait until a command of size bytes may be sent
+        """
+        with self._condition:
+            while self.active >= int(self.concurrency):
+                self._condition.wait()
+            self.active += 1
+
+            now = time()
+            start = max(now, self._next)
+            interval = size / self.rate if self.rate else 0
+            if self.max_ops:
+                interval = max(interval, 1 / self.max_ops)
+            self._next = start + interval
+
+        if start > now:
+            sleep(start - now)
+
+    def release(self, size, seconds, throttled=False, measured=True):
+        """
+        a command of size bytes took seconds, throttled is True if the server refused it because of throttling.
+        the latency of a command which is not measured (like a mail streamed in chunks) is ignored.
+        """
+        with self._condition:
+            self.active -= 1
+            now = time()
+            if not throttled:
+                self._history.append((now, size))
+            while self._history and self._history[0][0] < now - self.window:
+                self._history.popleft()
+
+            slow = False
+            if measured and not throttled:
+                latency = seconds / max(size, 1000000) * 1000000
+                slow = bool(self.baseline) and seconds > self.min_time and latency > self.baseline * self.slowdown
+                #: slow commands move the baseline too, so a lasting slowdown becomes the new usual latency
+                self.baseline = latency if self.baseline is None else self.baseline * 0.9 + latency * 0.1
+
+            if throttled or slow:
+                self.throttled += 1
+                elapsed = min(self.window, now - self._start) or 1
+                throughput = sum([length for _, length in self._history]) / elapsed
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(self.min_bytes, int(min(self.rate or throughput, throughput) / 2))
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                if self.rate:
+                    self.rate = min(self.max_bytes or self.rate + self.min_bytes, self.rate + self.min_bytes)
+            self._condition.notify_all()
+
+    @contextmanager
+    def command(self, size, measured=True):
+        """
+        wait until a command of size bytes may be sent and measure it (see release()). an exception of a throttling
+        server counts as throttled.
+        """
+        self.acquire(size)
+        start = time()
+        try:
+            yield
+        except Exception as e:
+            self.release(size, time() - start, throttled=is_throttled(e), measured=measured)
+            raise
+        self.release(size, time() - start, measured=measured)
+
+    def status(self):
+        """
+        returns the current limits as text
+        """
+        rate = f'{self.rate * 8 / 1000000:.1f} Mbps' if self.rate else 'unlimited'
+        return f'{rate}, {int(self.concurrency)}/{self.max_concurrency} concurrent commands'
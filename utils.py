@@ -1,6 +1,6 @@
-from chardet import detect
 from email.header import decode_header
 from ast import literal_eval
+from re import search, sub, IGNORECASE
 
 
 def imaperror_decode(e):
@@ -44,7 +44,8 @@ def decode_mime(mime_bytes):
         s = mime_bytes.decode()
 
     except UnicodeDecodeError:
-        #: try to detect encoding
+        #: try to detect encoding, chardet is only imported if it's needed because loading it is slow
+        from chardet import detect
         encoding = detect(mime_bytes)['encoding']
 
         if encoding:
@@ -72,3 +73,26 @@ def decode_mime(mime_bytes):
                 words.append(word)
 
     return ''.join(words)
+
+
+def parse_appenduid(status):
+    #: the APPENDUID response code (RFC 4315) looks like "[APPENDUID <uidvalidity> <uid-set>] ..."
+    match = search(rb'\[APPENDUID (\d+) ([\d:,]+)\]', status, IGNORECASE)
+    if not match:
+        return None, []
+
+    uids = []
+    for uid_range in match.group(2).split(b','):
+        first, _, last = uid_range.partition(b':')
+        uids.extend(range(int(first), int(last or first) + 1))
+    return int(match.group(1)), uids
+
+
+def get_header(msg, name):
+    #: returns the unfolded value of the first header field with this name (or None). only the header is searched.
+    end = search(rb'\r?\n\r?\n', msg)
+    header = msg[:end.start() + 2] if end else msg
+    match = search(rb'(?im)^' + name + rb'[ \t]*:(.*(?:\r?\n[ \t].*)*)', header)
+    if not match:
+        return None
+    return sub(rb'\r?\n[ \t]', b' ', match.group(1)).strip()